@@ -0,0 +1,287 @@
+'''A local stand-in for the parts of the Jellyfin API used by JellyfinClient, with a synthetic library.
+
+Only meant for benchmarks - it keeps everything in memory and implements just enough of each
+endpoint for the client to work.'''
+import io
+import re
+import json
+import time
+import uuid
+import random
+import threading
+import urllib.parse
+import http.server
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from PIL import Image
+
+WORDS = [
+    "night", "city", "love", "dark", "last", "man", "woman", "return", "story", "house", "blood", "king",
+    "river", "summer", "winter", "ghost", "secret", "war", "dream", "road", "star", "island", "fire", "heart",
+    "silent", "golden", "lost", "wild", "black", "white", "little", "big", "strange", "eternal", "iron", "glass",
+]
+
+
+def generate_library(size: int, seed: int = 0) -> list:
+    '''Synthetic movies and series, with (mostly) unique titles, years and provider ids'''
+    rng = random.Random(seed)
+    created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    items = []
+    for i in range(size):
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title()
+        if rng.random() < 0.7:
+            # Most titles are unique, some are shared by remakes
+            title += f" {i}"
+        created += timedelta(seconds=rng.randint(1, 120))
+        item_id = uuid.UUID(int=rng.getrandbits(128)).hex
+        items.append({
+            "Id": item_id,
+            "Name": title,
+            "OriginalTitle": title,
+            "Type": "Series" if rng.random() < 0.2 else "Movie",
+            "ProductionYear": rng.randint(1920, 2025),
+            "ProviderIds": {"Imdb": f"tt{1000000 + i}", "Tmdb": str(10000 + i)},
+            "DateCreated": created.strftime("%Y-%m-%dT%H:%M:%S.0000000Z"),
+            "DateLastSaved": created.strftime("%Y-%m-%dT%H:%M:%S.0000000Z"),
+            "ImageTags": {"Primary": item_id[:8]},
+        })
+    return items
+
+
+def generate_list(library: list, size: int, seed: int = 0, missing: float = 0.1, with_ids: bool = True) -> dict:
+    '''A plugin result for a list of library items, with some items which aren't in the library'''
+    rng = random.Random(seed)
+    items = []
+    for jf_item in rng.sample(library, min(size, len(library))):
+        if rng.random() < missing:
+            item = {"title": f"Missing Film {rng.getrandbits(32)}", "release_year": str(rng.randint(1920, 2025)), "media_type": "movie"}
+            if with_ids:
+                item["imdb_id"] = f"tt9{rng.getrandbits(24):07d}"
+        else:
+            item = {
+                "title": jf_item["Name"],
+                "release_year": str(jf_item["ProductionYear"]),
+                "media_type": "movie" if jf_item["Type"] == "Movie" else "show",
+            }
+            if with_ids:
+                item["imdb_id"] = jf_item["ProviderIds"]["Imdb"]
+        items.append(item)
+    return {"name": f"Benchmark list {seed}", "description": "Synthetic benchmark list", "items": items}
+
+
+def library_items_for(list_info: dict, seed: int = 0, missing: float = 0.1) -> list:
+    '''Library items for the items of a recorded list, so most of them can be matched'''
+    rng = random.Random(seed)
+    items = []
+    for item in list_info["items"]:
+        if rng.random() < missing:
+            continue
+        item_id = uuid.UUID(int=rng.getrandbits(128)).hex
+        year = int(item["release_year"]) if str(item.get("release_year") or "").isdigit() else None
+        items.append({
+            "Id": item_id,
+            "Name": item["title"],
+            "OriginalTitle": item["title"],
+            "Type": "Series" if item.get("media_type") in ("show", "tvSeries", "tvMiniSeries") else "Movie",
+            "ProductionYear": year,
+            "ProviderIds": {"Imdb": item["imdb_id"]} if item.get("imdb_id") else {},
+            "DateCreated": "2024-01-01T00:00:00.0000000Z",
+            "DateLastSaved": "2024-01-01T00:00:00.0000000Z",
+            "ImageTags": {"Primary": item_id[:8]},
+        })
+    return items
+
+
+def _words(text: str) -> list:
+    return re.findall(r"\w+", text.lower())
+
+
+class FakeJellyfin:
+    '''In-memory library and playlists, served over HTTP by FakeJellyfin.serve()'''
+
+    def __init__(self, library: list, latency_ms: float = 0, user_id: str = "benchmark-user"):
+        self.user_id = user_id
+        self.latency = latency_ms / 1000
+        self.items = {item["Id"]: item for item in library}
+        self.playlists = {}
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._images = {}
+
+        # Word index for searchTerm queries
+        self._by_word = {}
+        for item in library:
+            for word in set(_words(item["Name"])):
+                self._by_word.setdefault(word, []).append(item)
+
+    def serve(self, port: int = 0) -> http.server.ThreadingHTTPServer:
+        '''Starts serving on a background thread. The url is http://127.0.0.1:<server.server_port>'''
+        fake = self
+
+        class Handler(_Handler):
+            jellyfin = fake
+
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    # --- Items ---
+
+    def query_items(self, query: dict) -> dict:
+        if "parentid" in query:
+            playlist = self.playlists.get(query["parentid"][0])
+            items = [self.items[item_id] for _, item_id in playlist["entries"]] if playlist else []
+            return {"Items": items, "TotalRecordCount": len(items)}
+
+        types = {t.lower() for value in query.get("includeitemtypes", []) for t in value.split(",")}
+        if types == {"playlist"}:
+            items = list(self.playlists.values())
+            return {"Items": [{k: v for k, v in p.items() if k != "entries"} for p in items], "TotalRecordCount": len(items)}
+
+        if "searchterm" in query:
+            term = query["searchterm"][0].lower()
+            words = _words(term)
+            candidates = self._by_word.get(words[0], []) if words else []
+            items = [item for item in candidates if term in item["Name"].lower()]
+        else:
+            items = list(self.items.values())
+        if types:
+            items = [item for item in items if item["Type"].lower() in types]
+        if "mindatelastsaved" in query:
+            since = query["mindatelastsaved"][0]
+            items = [item for item in items if item["DateLastSaved"] >= since]
+        if query.get("sortby", [""])[0].lower() == "datecreated":
+            items = sorted(items, key=lambda item: item["DateCreated"], reverse=query.get("sortorder", [""])[0].lower() == "descending")
+
+        total = len(items)
+        start = int(query.get("startindex", ["0"])[0])
+        limit = query.get("limit")
+        items = items[start:start + int(limit[0])] if limit else items[start:]
+        return {"Items": items, "TotalRecordCount": total}
+
+    # --- Playlists ---
+
+    def create_playlist(self, body: dict) -> dict:
+        playlist_id = uuid.uuid4().hex
+        with self._lock:
+            self.playlists[playlist_id] = {
+                "Id": playlist_id, "Name": body["Name"], "Type": "Playlist", "Tags": [], "Overview": "", "ImageTags": {}, "entries": []
+            }
+        return {"Id": playlist_id}
+
+    def playlist_entries(self, playlist_id: str) -> dict:
+        playlist = self.playlists[playlist_id]
+        return {"Items": [{**self.items[item_id], "PlaylistItemId": entry_id} for entry_id, item_id in playlist["entries"]]}
+
+    def add_entries(self, playlist_id: str, ids: list):
+        with self._lock:
+            self.playlists[playlist_id]["entries"].extend((uuid.uuid4().hex, item_id) for item_id in ids if item_id in self.items)
+
+    def remove_entries(self, playlist_id: str, entry_ids: list):
+        entry_ids = set(entry_ids)
+        with self._lock:
+            playlist = self.playlists[playlist_id]
+            # Like Jellyfin, also accept item ids
+            playlist["entries"] = [e for e in playlist["entries"] if e[0] not in entry_ids and e[1] not in entry_ids]
+
+    def move_entry(self, playlist_id: str, entry_id: str, index: int):
+        with self._lock:
+            entries = self.playlists[playlist_id]["entries"]
+            entry = next(e for e in entries if e[0] == entry_id)
+            entries.remove(entry)
+            entries.insert(index, entry)
+
+    def image(self, item_id: str) -> bytes:
+        '''A small poster per item - the colour is derived from its id'''
+        color = tuple(int(item_id[i:i + 2], 16) if len(item_id) >= i + 2 else 0 for i in (0, 2, 4))
+        if color not in self._images:
+            buffer = io.BytesIO()
+            Image.new("RGB", (300, 450), color).save(buffer, format="JPEG")
+            self._images[color] = buffer.getvalue()
+        return self._images[color]
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    jellyfin = None
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int = 200, body=None, content_type: str = "application/json"):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        body = body or b""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self, method: str):
+        jellyfin = self.jellyfin
+        url = urllib.parse.urlsplit(self.path)
+        query = {k.lower(): v for k, v in urllib.parse.parse_qs(url.query).items()}
+        path = url.path.rstrip("/")
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if jellyfin.latency:
+            time.sleep(jellyfin.latency)
+
+        # Count requests by endpoint, with ids left out
+        jellyfin.requests[f"{method} {re.sub(r'/[0-9a-f]{32}', '/{id}', path) or '/'}"] += 1
+
+        users = f"/Users/{jellyfin.user_id}"
+        if method == "GET" and path in ("", "/System/Info", users):
+            return self._reply(body={"Version": "10.9.0-benchmark", "Id": jellyfin.user_id})
+        if method == "GET" and path == f"{users}/Items":
+            return self._reply(body=jellyfin.query_items(query))
+        match = re.fullmatch(rf"{users}/Items/(\w+)", path)
+        if method == "GET" and match:
+            item = jellyfin.playlists.get(match[1]) or jellyfin.items.get(match[1])
+            return self._reply(body={k: v for k, v in item.items() if k != "entries"}) if item else self._reply(404)
+        match = re.fullmatch(r"/Items/(\w+)", path)
+        if method == "POST" and match:
+            update = json.loads(body)
+            playlist = jellyfin.playlists.get(match[1])
+            if playlist is not None:
+                playlist["Tags"] = update.get("Tags", playlist["Tags"])
+                playlist["Overview"] = update.get("Overview", playlist["Overview"])
+            return self._reply(204)
+        match = re.fullmatch(r"/Items/(\w+)/Images/Primary", path)
+        if match:
+            if method == "POST":
+                if match[1] in jellyfin.playlists:
+                    jellyfin.playlists[match[1]]["ImageTags"] = {"Primary": uuid.uuid4().hex[:8]}
+                return self._reply(204)
+            playlist = jellyfin.playlists.get(match[1])
+            if playlist is not None and not playlist["ImageTags"]:
+                return self._reply(404)
+            return self._reply(body=jellyfin.image(match[1]), content_type="image/jpeg")
+        if method == "POST" and path == "/Playlists":
+            return self._reply(body=jellyfin.create_playlist(json.loads(body)))
+        match = re.fullmatch(r"/Playlists/(\w+)/Items", path)
+        if match and match[1] in jellyfin.playlists:
+            if method == "GET":
+                return self._reply(body=jellyfin.playlist_entries(match[1]))
+            if method == "POST":
+                jellyfin.add_entries(match[1], query.get("ids", [""])[0].split(","))
+                return self._reply(204)
+            if method == "DELETE":
+                jellyfin.remove_entries(match[1], query.get("entryids", [""])[0].split(","))
+                return self._reply(204)
+        match = re.fullmatch(r"/Playlists/(\w+)/Items/(\w+)/Move/(\d+)", path)
+        if method == "POST" and match:
+            jellyfin.move_entry(match[1], match[2], int(match[3]))
+            return self._reply(204)
+        return self._reply(404)
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_DELETE(self):
+        self._route("DELETE")
@@ -0,0 +1,31 @@
+'''Records the result of a plugin as a fixture for run_benchmark.py.
+
+    python benchmarks/record_fixture.py imdb_list ls055592025 benchmarks/fixtures/imdb_ls055592025.json'''
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pluginlib
+from utils.base_plugin import collect_list
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record a plugin result as a benchmark fixture')
+    parser.add_argument('plugin', type=str, help='Plugin name, e.g. letterboxd')
+    parser.add_argument('list_id', type=str, help='List id as it would be given in config.yaml')
+    parser.add_argument('output', type=str, help='JSON file to write')
+    parser.add_argument('--plugin-config', type=str, default='{}', help='Plugin settings as JSON')
+    args = parser.parse_args()
+
+    plugins = pluginlib.PluginLoader(modules=['plugins']).plugins['list_scraper']
+    list_info = collect_list(plugins[args.plugin].iter_list(args.list_id, json.loads(args.plugin_config)))
+    with open(args.output, "w") as f:
+        json.dump(list_info, f, indent=2)
+    print(f"Recorded {len(list_info['items'])} items of {list_info['name']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+'''Runs main.main against a local fake Jellyfin server and reports where the time and requests went.
+
+    python benchmarks/run_benchmark.py --library-size 50000 --lists 5 --list-size 1000 --latency-ms 5
+
+Lists come from recorded plugin results (--fixture, see record_fixture.py) or are generated from the
+synthetic library. Nothing is requested from the internet, so runs can be compared with each other.
+Every run after the first reuses the playlists and caches of the run before it.'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import yaml
+from utils.base_plugin import ListScraper
+from fake_jellyfin import FakeJellyfin, generate_library, generate_list, library_items_for
+
+
+class BenchmarkFixture(ListScraper):
+    '''Serves plugin results from JSON files - the list id is the path of the file'''
+
+    _alias_ = 'benchmark_fixture'
+    _cache_ttl_hours = None
+
+    def get_list(list_id, config=None):
+        with open(list_id) as f:
+            return json.load(f)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark against a local fake Jellyfin server')
+    parser.add_argument('--library-size', type=int, default=10000, help='Number of synthetic library items')
+    parser.add_argument('--lists', type=int, default=5, help='Number of generated lists (ignored with --fixture)')
+    parser.add_argument('--list-size', type=int, default=500, help='Items per generated list')
+    parser.add_argument('--missing', type=float, default=0.1, help='Fraction of list items which are not in the library')
+    parser.add_argument('--fixture', action='append', default=[], help='Recorded plugin result (JSON), can be repeated')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Latency added to every fake Jellyfin response')
+    parser.add_argument('--runs', type=int, default=2, help='Number of consecutive runs')
+    parser.add_argument('--font', type=str, help='TTF font to render posters with. Without it, playlists pretend to have posters already')
+    parser.add_argument('--config', type=str, help='YAML with settings to merge into the benchmark config, e.g. library_index or max_parallel_lists')
+    parser.add_argument('--output', type=str, help='Write the results as JSON to this file')
+    parser.add_argument('--keep', action='store_true', help="Don't delete the working directory afterwards")
+    return parser.parse_args()
+
+
+def merge(config: dict, overrides: dict) -> dict:
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            merge(config[key], value)
+        else:
+            config[key] = value
+    return config
+
+
+def stage_totals(summary: dict) -> dict:
+    '''Seconds and requests per stage, summed over all lists'''
+    totals = {}
+    for list_summary in summary["lists"].values():
+        for name, stage in list_summary["stages"].items():
+            total = totals.setdefault(name, {"seconds": 0.0, "requests": 0})
+            total["seconds"] += stage["seconds"]
+            total["requests"] += sum(host["count"] for host in stage["requests"].values())
+    return {name: {"seconds": round(total["seconds"], 3), "requests": total["requests"]} for name, total in totals.items()}
+
+
+def print_run(run: dict):
+    print(f"\nRun {run['run']}: {run['wall_seconds']:.2f}s wall time, {run['jellyfin_requests']} Jellyfin requests "
+          f"({run['jellyfin_requests'] / max(run['lists'], 1):.1f} per list)")
+    for name, stage in run["stages"].items():
+        print(f"  {name:<12} {stage['seconds']:>9.3f}s {stage['requests']:>8} requests")
+    for endpoint, count in sorted(run["endpoints"].items(), key=lambda e: -e[1]):
+        print(f"    {count:>8}  {endpoint}")
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="jap-benchmark-")
+
+    # Lists and the library they are matched against
+    library = generate_library(args.library_size)
+    fixtures = []
+    if args.fixture:
+        for i, path in enumerate(args.fixture):
+            with open(path) as f:
+                library += library_items_for(json.load(f), seed=i, missing=args.missing)
+            fixtures.append(os.path.abspath(path))
+    else:
+        for i in range(args.lists):
+            path = os.path.join(workdir, f"list_{i}.json")
+            with open(path, "w") as f:
+                json.dump(generate_list(library, args.list_size, seed=i, missing=args.missing), f)
+            fixtures.append(path)
+
+    jellyfin = FakeJellyfin(library, latency_ms=args.latency_ms)
+    server = jellyfin.serve()
+    if not args.font:
+        # Skip the poster stage by starting with playlists which already have a poster
+        for path in fixtures:
+            with open(path) as f:
+                playlist = jellyfin.create_playlist({"Name": json.load(f)["name"]})
+            jellyfin.playlists[playlist["Id"]]["ImageTags"] = {"Primary": "benchmark"}
+    else:
+        # get_font looks for the poster font in ./fonts
+        os.makedirs(os.path.join(workdir, "fonts"))
+        shutil.copy(args.font, os.path.join(workdir, "fonts", "Dosis_wght_800.ttf"))
+
+    config = {
+        "jellyfin": {
+            "server_url": f"http://127.0.0.1:{server.server_port}",
+            "api_key": "benchmark",
+            "user_id": jellyfin.user_id,
+        },
+        "plugins": {"benchmark_fixture": {"enabled": True, "list_ids": fixtures}},
+        "cache_dir": os.path.join(workdir, "cache"),
+        "metrics": {"json_file": os.path.join(workdir, "metrics.json")},
+    }
+    if args.config:
+        with open(args.config) as f:
+            merge(config, yaml.safe_load(f) or {})
+    config_path = os.path.join(workdir, "config.yaml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f)
+
+    # main parses its arguments and configures logging when it is imported
+    sys.argv = ["main.py", "--config", config_path]
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    import main as jap
+
+    results = {"library_size": len(library), "lists": len(fixtures), "latency_ms": args.latency_ms, "runs": []}
+    try:
+        for run in range(1, args.runs + 1):
+            jellyfin.requests.clear()
+            start = time.monotonic()
+            jap.main(jap.config)
+            wall_seconds = time.monotonic() - start
+            with open(config["metrics"]["json_file"]) as f:
+                summary = json.load(f)
+            results["runs"].append({
+                "run": run,
+                "wall_seconds": round(wall_seconds, 3),
+                "lists": len(fixtures),
+                "jellyfin_requests": sum(jellyfin.requests.values()),
+                "stages": stage_totals(summary),
+                "endpoints": dict(jellyfin.requests),
+            })
+            print_run(results["runs"][-1])
+    finally:
+        os.chdir(cwd)
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            print(f"\nWorking directory: {workdir}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
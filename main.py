@@ -1,11 +1,20 @@
 from typing import cast
 from utils.jellyfin import JellyfinClient
-from utils.jellyseerr import JellyseerrClient
+from utils.jellyfin_async import AsyncJellyfinClient, BackgroundJellyfinClient
+from utils.jellyseerr import JellyseerrClient, RequestQueue
+from utils.cache import MatchCache, ScrapeCache, ListFingerprints, JellyseerrCache, PosterCache, MetadataStore, get_cache_dir
+from utils.log import OrderedLogSink, log_format
+from utils import http, metadata, metrics
 import pluginlib
 from loguru import logger
 from pyaml_env import parse_config
 import os
 import sys
+import concurrent.futures
+import contextlib
+import collections
+import json
+import urllib.parse
 
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.cron import CronTrigger
@@ -19,7 +28,8 @@ args = parser.parse_args()
 log_level = os.getenv("LOG_LEVEL", "INFO").upper()
 # Configure Loguru logger
 logger.remove()  # Remove default configuration
-logger.add(sys.stderr, level=log_level)
+log_sink = OrderedLogSink(sys.stderr)
+logger.add(log_sink, level=log_level, format=log_format)
 
 # Load config
 if not os.path.exists(args.config):
@@ -27,22 +37,92 @@ if not os.path.exists(args.config):
     logger.error(f"Copy config.yaml.example to {args.config} and add your jellyfin config.")
     raise Exception("No config file found.")
 config = parse_config(args.config, default_value=None)
+if not config.get("cache_dir"):
+    config["cache_dir"] = os.path.join(os.path.dirname(os.path.abspath(args.config)), "cache")
 
 def main(config):
+    run_metrics = metrics.RunMetrics()
+    metrics.publish(run_metrics)
+
+    # Connection pool, timeout and retry settings for all HTTP requests
+    http.configure(config.get("http", None))
+
+    # Setup persistent match cache
+    match_cache = None
+    if config["jellyfin"].get("match_cache", False):
+        match_cache = MatchCache(
+            os.path.join(get_cache_dir(config), "match_cache.db"),
+            max_age_days=config["jellyfin"].get("match_cache_max_age_days", None),
+            miss_max_age_days=config["jellyfin"].get("match_cache_miss_max_age_days", 7)
+        )
+
+    # Setup cache of scraped lists
+    scrape_cache = None
+    if config.get("scrape_cache", False):
+        scrape_cache = ScrapeCache(os.path.join(get_cache_dir(config), "scrape_cache.db"))
+
+    # Setup store of title details shared by all plugins - kept between runs if metadata_store is set
+    metadata_path = ":memory:"
+    if config.get("metadata_store", False):
+        metadata_path = os.path.join(get_cache_dir(config), "metadata.db")
+    metadata.set_store(MetadataStore(metadata_path, max_age_days=config.get("metadata_max_age_days", 30)))
+
+    # Setup cache of generated posters, to only regenerate posters whose playlist has changed
+    poster_cache = None
+    if config.get("regenerate_posters", "missing") == "on_change":
+        poster_cache = PosterCache(
+            os.path.join(get_cache_dir(config), "poster_cache.db"),
+            os.path.join(get_cache_dir(config), "poster_cells")
+        )
+
     # Setup jellyfin connection
     jf_client = JellyfinClient(
         server_url=config['jellyfin']['server_url'],
         api_key=config['jellyfin']['api_key'],
-        user_id=config['jellyfin']['user_id']
+        user_id=config['jellyfin']['user_id'],
+        library_index=config['jellyfin'].get('library_index', False),
+        library_index_item_types=config['jellyfin'].get('library_index_item_types', None),
+        match_cache=match_cache,
+        poster_cache=poster_cache
     )
+    jf_client.refresh_match_cache()
+
+    # Match list items with asyncio, many at a time, instead of one after another per list
+    async_jf = None
+    if config["jellyfin"].get("async_matching", False):
+        async_jf = BackgroundJellyfinClient(AsyncJellyfinClient(
+            server_url=config['jellyfin']['server_url'],
+            api_key=config['jellyfin']['api_key'],
+            user_id=config['jellyfin']['user_id'],
+            max_concurrent_requests=config['jellyfin'].get('max_concurrent_requests') or 16,
+            library_index=config['jellyfin'].get('library_index', False),
+            library_index_item_types=config['jellyfin'].get('library_index_item_types', None),
+            match_cache=match_cache
+        ))
+
+    # Setup fingerprints of synced lists, so lists which haven't changed can be skipped
+    fingerprints = None
+    library_watermark = None
+    if config.get("skip_unchanged_lists", False):
+        fingerprints = ListFingerprints(os.path.join(get_cache_dir(config), "list_fingerprints.db"))
+        library_watermark = jf_client.get_library_watermark()
 
     if "jellyseerr" in config:
+        js_cache = None
+        if config['jellyseerr'].get('request_cache', False):
+            js_cache = JellyseerrCache(
+                os.path.join(get_cache_dir(config), "jellyseerr_cache.db"),
+                search_max_age_hours=config['jellyseerr'].get('search_cache_hours', 24),
+                request_max_age_days=config['jellyseerr'].get('request_cache_days', 7)
+            )
         js_client = JellyseerrClient(
             server_url=config['jellyseerr']['server_url'],
             api_key=config['jellyseerr'].get('api_key', None),
             email=config['jellyseerr'].get('email', None),
             password=str(config['jellyseerr'].get('password', None)),
-            user_type=str(config['jellyseerr'].get('user_type', "local"))
+            user_type=str(config['jellyseerr'].get('user_type', "local")),
+            cache=js_cache,
+            max_workers=int(config['jellyseerr'].get('max_workers', 4))
         )
     else:
         js_client = None
@@ -57,76 +137,250 @@ def main(config):
         config["plugins"]["jellyfin_api"]["user_id"] = config["jellyfin"]["user_id"]
         config["plugins"]["jellyfin_api"]["api_key"] = config["jellyfin"]["api_key"]
 
-    # Update jellyfin with lists
+    # Let plugins reset anything they share between the lists of a run
+    for plugin_name, plugin_config in config["plugins"].items():
+        if plugin_config.get("enabled", False) and plugin_name in plugins:
+            plugins[plugin_name].start_run()
+
+    # Limit the number of concurrent requests to each host
+    for host, limit in (config.get("host_concurrency") or {}).items():
+        http.set_host_limit(host, limit)
+    # Limit the number of requests per second to the websites of each plugin
+    for plugin_name, plugin_config in config["plugins"].items():
+        if plugin_config.get("enabled", False) and plugin_name in plugins:
+            rate_limit = plugin_config.get("rate_limit", plugins[plugin_name]._rate_limit)
+            if rate_limit:
+                for host in plugins[plugin_name]._hosts:
+                    http.set_host_rate_limit(host, rate_limit, plugin_config.get("rate_limit_burst", 1))
+    if config["jellyfin"].get("max_concurrent_requests"):
+        http.set_host_limit(urllib.parse.urlsplit(config["jellyfin"]["server_url"]).hostname, config["jellyfin"]["max_concurrent_requests"])
+
+    # Collect lists to update
+    jobs = []
     for plugin_name in config['plugins']:
         if config['plugins'][plugin_name]["enabled"] and plugin_name in plugins:
             for list_entry in config['plugins'][plugin_name]["list_ids"]:
-                if isinstance(list_entry, dict):
-                    if "list_id" in list_entry:
-                        list_id = list_entry["list_id"]
-                    else:
-                        list_id = list_entry
-                    list_name = list_entry.get("list_name", None)
-                else:
-                    list_id = list_entry
-                    list_name = None
-
-                logger.info(f"")
-                logger.info(f"")
-                logger.info(f"Getting list info for plugin: {plugin_name}, list id: {list_id}")
-
-                # Match list items to jellyfin items
-                list_info = plugins[plugin_name].get_list(list_id, config['plugins'][plugin_name])
-
-                # Find jellyfin playlist or create it
-                playlist_id = jf_client.find_playlist_with_name_or_create(
-                    list_name or list_info['name'],
-                    list_id,
-                    list_info.get("description", None),
-                    plugin_name,
-                    media_type=config["jellyfin"].get("playlist_defaults", {}).get("media_type", "Video"),
-                    is_public=config["jellyfin"].get("playlist_defaults", {}).get("is_public", True)
-                )
-
-                # Match all items to Jellyfin IDs, preserving order
-                logger.info(f"Processing list with {len(list_info['items'])} items")
-                matched_items = []
-                unmatched_items = []
-
-                for item in list_info['items']:  # ORDER PRESERVED!
-                    jellyfin_id = jf_client.match_item_to_jellyfin(
-                        item,
-                        year_filter=config["plugins"][plugin_name].get("year_filter", True),
-                        jellyfin_query_parameters=config["jellyfin"].get("query_parameters", {})
-                    )
-
-                    if jellyfin_id:
-                        matched_items.append(jellyfin_id)
+                jobs.append((plugin_name, list_entry))
+    list_tags = [f"{i + 1}/{len(jobs)} {plugin_name}:{list_label(list_entry)}" for i, (plugin_name, list_entry) in enumerate(jobs)]
+
+    # Update jellyfin with lists
+    max_parallel_lists = int(config.get("max_parallel_lists") or 1)
+    poster_jobs = []
+    try:
+        if max_parallel_lists <= 1:
+            for list_tag, (plugin_name, list_entry) in zip(list_tags, jobs):
+                with logger.contextualize(list_tag=list_tag), run_metrics.list_context(list_tag):
+                    poster_jobs.append((list_tag, process_list(jf_client, js_client, plugins[plugin_name], plugin_name, list_entry, config, scrape_cache, fingerprints, library_watermark, async_jf)))
+        else:
+            logger.info(f"Processing {len(jobs)} lists, {max_parallel_lists} at a time")
+            log_sink.start(list_tags)
+
+            def run(list_tag, plugin_name, list_entry):
+                try:
+                    with logger.contextualize(list_tag=list_tag), run_metrics.list_context(list_tag):
+                        return process_list(jf_client, js_client, plugins[plugin_name], plugin_name, list_entry, config, scrape_cache, fingerprints, library_watermark, async_jf)
+                finally:
+                    log_sink.finish(list_tag)
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel_lists) as executor:
+                futures = [executor.submit(run, list_tag, plugin_name, list_entry) for list_tag, (plugin_name, list_entry) in zip(list_tags, jobs)]
+            for list_tag, future in zip(list_tags, futures):
+                poster_jobs.append((list_tag, future.result()))
+    finally:
+        if async_jf is not None:
+            async_jf.close()
+
+    # Generate missing posters once all playlists are synced
+    make_posters(jf_client, [(list_tag, poster) for list_tag, poster in poster_jobs if poster is not None], config, run_metrics)
+    if poster_cache is not None:
+        evicted = poster_cache.evict_cells(config.get("poster_cell_max_age_days", 30))
+        logger.debug(f"Removed {evicted} unused poster cells")
+
+    # Report how long each stage of each list took
+    run_metrics.finish()
+    summary = run_metrics.summary()
+    logger.info(f"Run metrics: {json.dumps(summary)}")
+    json_file = (config.get("metrics") or {}).get("json_file")
+    if json_file:
+        with open(json_file, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+def make_posters(jf_client, poster_jobs, config, run_metrics):
+    '''Generate posters for the (list tag, poster job) of playlists without an up to date poster'''
+    if not poster_jobs:
+        return
+    logger.info(f"Checking {len(poster_jobs)} playlist posters")
+
+    def run(list_tag, playlist_id, playlist_name, only_if_changed):
+        with logger.contextualize(list_tag=list_tag), run_metrics.list_context(list_tag), metrics.stage("posters"):
+            jf_client.make_poster(playlist_id, playlist_name, only_if_changed=only_if_changed)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=int(config.get("poster_workers") or 2)) as executor:
+        futures = [executor.submit(run, list_tag, *job) for list_tag, job in poster_jobs]
+    for future in futures:
+        future.result()
+
+
+def list_label(list_entry) -> str:
+    '''Short human readable label for a configured list, used in log messages'''
+    if isinstance(list_entry, dict):
+        label = list_entry.get("list_name") or list_entry.get("list_id") or list_entry
+    else:
+        label = list_entry
+    label = str(label)
+    return label if len(label) <= 50 else label[:47] + "..."
+
+
+def process_list(jf_client, js_client, plugin, plugin_name, list_entry, config, scrape_cache=None, fingerprints=None, library_watermark=None, async_jf=None):
+    '''Scrape a single list and sync it to its jellyfin playlist. Returns a poster job if the playlist's poster should be generated.'''
+    if isinstance(list_entry, dict):
+        if "list_id" in list_entry:
+            list_id = list_entry["list_id"]
+        else:
+            list_id = list_entry
+        list_name = list_entry.get("list_name", None)
+    else:
+        list_id = list_entry
+        list_name = None
+
+    logger.info(f"")
+    logger.info(f"")
+    logger.info(f"Getting list info for plugin: {plugin_name}, list id: {list_id}")
+
+    # Get list info - items may be streamed in as the plugin scrapes them
+    with metrics.stage("scrape"):
+        if scrape_cache is not None:
+            list_info = scrape_cache.iter_list(plugin, plugin_name, list_id, config['plugins'][plugin_name])
+        else:
+            list_info = plugin.iter_list(list_id, config['plugins'][plugin_name])
+
+    # Find jellyfin playlist or create it
+    with metrics.stage("sync"):
+        playlist_id = jf_client.find_playlist_with_name_or_create(
+            list_name or list_info['name'],
+            list_id,
+            list_info.get("description", None),
+            plugin_name,
+            media_type=config["jellyfin"].get("playlist_defaults", {}).get("media_type", "Video"),
+            is_public=config["jellyfin"].get("playlist_defaults", {}).get("is_public", True)
+        )
+
+    # Skip lists which are unchanged since they were last synced
+    items = metrics.timed_iter(list_info['items'], "scrape")
+    if fingerprints is not None:
+        # The whole list is needed for its fingerprint, so items aren't matched while they are scraped
+        items = list(items)
+        fingerprint = fingerprints.fingerprint(
+            items,
+            library_watermark,
+            playlist_id,
+            {k: v for k, v in config['plugins'][plugin_name].items() if k != "list_ids"},
+            config["jellyfin"].get("query_parameters", {}),
+            js_client is not None
+        )
+        if fingerprints.get(plugin_name, list_id) == fingerprint:
+            logger.info("List and library unchanged since the last sync - skipping")
+            metrics.count("unchanged_list_skips")
+            return poster_job(jf_client, playlist_id, list_info["name"], config)
+
+    # Match all items to Jellyfin IDs, preserving order
+    logger.info("Processing list items")
+    matched_items = []
+    unmatched_count = 0
+    scraped_items = []
+    item_count = 0
+    # Missing items are requested via Jellyseerr while the rest of the list is matched
+    request_queue = RequestQueue(js_client) if js_client is not None else None
+    year_filter = config["plugins"][plugin_name].get("year_filter", True)
+    query_parameters = config["jellyfin"].get("query_parameters", {})
+
+    def add_match(item, jellyfin_id):
+        nonlocal unmatched_count
+        if jellyfin_id:
+            matched_items.append(jellyfin_id)
+        else:
+            unmatched_count += 1
+            if request_queue is not None:
+                request_queue.add(item)
+
+    with request_queue or contextlib.nullcontext():
+        # (item, future) of items being matched by the async client, in list order
+        pending = collections.deque()
+        try:
+            for item in items:  # ORDER PRESERVED!
+                item_count += 1
+                scraped_items.append(dict(item))
+                with metrics.stage("match"):
+                    if async_jf is None:
+                        add_match(item, jf_client.match_item_to_jellyfin(item, year_filter=year_filter, jellyfin_query_parameters=query_parameters))
                     else:
-                        unmatched_items.append(item)
+                        pending.append((item, async_jf.match_item_to_jellyfin(item, year_filter, query_parameters)))
+                # Take the items matched so far, without getting ahead of the ones still being matched
+                while pending and pending[0][1].done():
+                    add_match(pending[0][0], pending.popleft()[1].result())
+
+            with metrics.stage("match"):
+                for item, future in pending:
+                    add_match(item, future.result())
+        finally:
+            # Stop matching the rest of a list which failed
+            for _, future in pending:
+                future.cancel()
+
+        # Wait for the requests of missing items
+        if request_queue is not None:
+            requested_count = request_queue.wait()
+            if request_queue.size:
+                metrics.count("jellyseerr_requests", requested_count)
+                logger.info(f"Requested {requested_count} of {request_queue.size} missing items via Jellyseerr")
+
+    # Share the titles' details with other plugins
+    metadata.add_items(scraped_items)
+    metrics.count("items", item_count)
+    metrics.count("items_matched", len(matched_items))
+    metrics.count("items_missed", unmatched_count)
+
+    # Sync playlist with matched items in order
+    logger.info(f"Matched {len(matched_items)}/{item_count} items")
+    synced = False
+    if matched_items:
+        with metrics.stage("sync"):
+            synced = jf_client.sync_playlist(
+                playlist_id,
+                matched_items,
+                clear=config["plugins"][plugin_name].get("clear_playlist", False)
+            )
+    else:
+        logger.warning(f"No items matched for playlist: {list_info['name']}")
+
+    # Only skip the list next time if the playlist is fully in sync
+    if fingerprints is not None and synced:
+        fingerprints.put(plugin_name, list_id, fingerprint)
 
-                # Sync playlist with matched items in order
-                logger.info(f"Matched {len(matched_items)}/{len(list_info['items'])} items")
-                if matched_items:
-                    jf_client.sync_playlist(playlist_id, matched_items)
-                else:
-                    logger.warning(f"No items matched for playlist: {list_info['name']}")
+    # Posters are generated after all lists are synced
+    return poster_job(jf_client, playlist_id, list_info["name"], config)
 
-                # Request missing items via Jellyseerr
-                if js_client is not None and unmatched_items:
-                    logger.info(f"Requesting {len(unmatched_items)} missing items via Jellyseerr")
-                    for item in unmatched_items:
-                        js_client.make_request(item)
 
-                # Add a poster image if playlist doesn't have one
-                if not jf_client.has_poster(playlist_id):
-                    logger.info("Playlist has no poster - generating one")
-                    jf_client.make_poster(playlist_id, list_info["name"])
+def poster_job(jf_client, playlist_id, playlist_name, config):
+    '''Returns (playlist id, name, only if changed) if the playlist's poster should be generated, else None'''
+    # Add a poster image if playlist doesn't have one
+    if not jf_client.has_poster(playlist_id):
+        logger.info("Playlist has no poster - generating one later")
+        return playlist_id, playlist_name, False
+    # Or regenerate it if the playlist has changed
+    if config.get("regenerate_posters", "missing") == "on_change":
+        return playlist_id, playlist_name, True
+    return None
 
 
 
 if __name__ == "__main__":
     logger.info("Starting up")
+    prometheus_port = (config.get("metrics") or {}).get("prometheus_port")
+    if prometheus_port:
+        metrics.serve_prometheus(prometheus_port)
+        logger.info(f"Serving metrics of the latest run on port {prometheus_port}")
     logger.info("Starting initial run")
     main(config)
 
@@ -1,59 +1,92 @@
-import bs4
-import requests
-import json
+import threading
+import concurrent.futures
+from utils import http
 from utils.base_plugin import ListScraper
+from utils.log import with_log_context
 from loguru import logger
 
 #from arrapi import SonarrAPI, RadarrAPI
 
 class Arr(ListScraper):
-    '''Generate collections based on Jellyfin API queries'''
+    '''Generate collections based on Radarr/Sonarr tags'''
 
     _alias_ = 'arr'
+    _revalidate = False  # Requests need the server's api key
+
+    # Every tag in a run is served from one download of each server's library
+    _snapshots = {}
+    _snapshot_locks = {}
+    _lock = threading.Lock()
+
+    def _download_snapshot(server_config):
+        '''Downloads the tags and the whole library of a Radarr or Sonarr server, and indexes the library by tag id'''
+        base_url = server_config["base_url"]
+        server_params = {"apikey": server_config["api_key"]}
+
+        r = http.get(base_url + "/api/v3/tag", params=server_params)
+        r.raise_for_status()
+        tags = {tag["label"]: tag["id"] for tag in r.json()}
+
+        # Radarr has movies, Sonarr has series
+        server_type = server_config.get("type")
+        if server_type is None:
+            r = http.get(base_url + "/api/v3/system/status", params=server_params)
+            r.raise_for_status()
+            server_type = r.json().get("appName", "")
+        if "sonarr" in server_type.lower():
+            endpoint, media_type = "series", "show"
+        else:
+            endpoint, media_type = "movie", "movie"
+
+        r = http.get(base_url + f"/api/v3/{endpoint}", params=server_params)
+        r.raise_for_status()
+        library = sorted(r.json(), key=lambda item: item["id"])
+        logger.debug(f"Loaded {len(library)} items from {base_url}")
+
+        items_by_tag = {}
+        for item in library:
+            for tag_id in item.get("tags", []):
+                items_by_tag.setdefault(tag_id, []).append({
+                    "title": item["title"],
+                    "release_year": item["year"],
+                    "media_type": media_type,
+                    "imdb_id": item.get("imdbId", None)
+                })
+        return {"tags": tags, "items_by_tag": items_by_tag}
+
+    def _get_snapshot(server_config):
+        '''Returns the snapshot of a server, downloading it if it hasn't been downloaded this run'''
+        key = (server_config["base_url"], server_config["api_key"])
+        with Arr._lock:
+            server_lock = Arr._snapshot_locks.setdefault(key, threading.Lock())
+        # Lists processed in parallel wait for the same download
+        with server_lock:
+            snapshot = Arr._snapshots.get(key)
+            if snapshot is None:
+                snapshot = Arr._snapshots[key] = Arr._download_snapshot(server_config)
+            return snapshot
+
+    @classmethod
+    def start_run(cls):
+        '''Libraries are downloaded again every run'''
+        with Arr._lock:
+            Arr._snapshots.clear()
 
     def get_list(list_id, config=None):
         '''Call arr API'''
+        server_configs = config["server_configs"]
+
+        # Download the libraries of all servers at the same time
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(server_configs), 1)) as executor:
+            snapshots = list(executor.map(with_log_context(Arr._get_snapshot), server_configs))
 
         items = []
-        for server_config in config["server_configs"]:
-            server_params = {"apikey": server_config["api_key"]}
-
-            # Get tag id
-            r = requests.get(server_config["base_url"] + "/api/v3/tag", params=server_params)
-            tag_id = None
-            for tag in r.json():
-                if tag["label"] == list_id:
-                    tag_id = tag["id"]
-                    break
+        for snapshot in snapshots:
+            tag_id = snapshot["tags"].get(list_id)
             if tag_id is None:
                 continue
-
-            # Get tag details
-            r = requests.get(server_config["base_url"] + f"/api/v3/tag/detail/{tag_id}", params=server_params)
-
-            # Get item details
-            for item_id in r.json().get("movieIds", []):
-                item_r = requests.get(server_config["base_url"] + f"/api/v3/movie/{item_id}", params=server_params)
-                item_r = item_r.json()
-                logger.debug(f"Response from Arr server: {item_r}")
-                items.append({
-                    "title": item_r["title"],
-                    "release_year": item_r["year"],
-                    "media_type": "movie",
-                    "imdb_id": item_r.get("imdbId", None)
-                })
-
-            for item_id in r.json().get("seriesIds", []):
-                item_r = requests.get(server_config["base_url"] + f"/api/v3/series/{item_id}", params=server_params)
-                item_r = item_r.json()
-                logger.debug(f"Response from Arr server: {item_r}")
-                items.append({
-                    "title": item_r["title"],
-                    "release_year": item_r["year"],
-                    "media_type": "show",
-                    "imdb_id": item_r.get("imdbId", None)
-                })
-
+            # Copies, since matching changes the items
+            items.extend(dict(item) for item in snapshot["items_by_tag"].get(tag_id, []))
 
         return {
             "name": list_id.replace("_", " ").title(),
@@ -1,8 +1,7 @@
 import yaml
 import re
 from utils.base_plugin import ListScraper
-import bs4
-import requests
+from utils import http, parsing
 from loguru import logger
 
 class BFI(ListScraper):
@@ -10,14 +9,15 @@ class BFI(ListScraper):
     _alias_ = 'bfi'
 
     def get_list(list_id, config=None):
-        r = requests.get(f"https://www.bfi.org.uk/lists/{list_id}")
-        soup = bs4.BeautifulSoup(r.text, 'html.parser')
+        r = http.get(f"https://www.bfi.org.uk/lists/{list_id}")
+        # Only the captions of the films are needed from the page itself
+        soup = parsing.parse(r.text, "figcaption")
 
         # Find the JSON-LD script tag
-        json_ld_tag = soup.find("script", type="application/ld+json")
+        json_ld_tag = parsing.find_script(r.text, type="application/ld+json")
         if not json_ld_tag:
             raise ValueError("No JSON-LD metadata found on the page")
-        json_ld = yaml.load(json_ld_tag.string, Loader=yaml.SafeLoader)
+        json_ld = yaml.load(json_ld_tag, Loader=yaml.SafeLoader)
 
         # Basic metadata
         list_name = json_ld.get("headline", "").strip()
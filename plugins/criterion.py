@@ -1,7 +1,6 @@
 import json
 from utils.base_plugin import ListScraper
-import bs4
-import requests
+from utils import http, parsing
 from loguru import logger
 #from requests_cache import CachedSession, FileCache
 
@@ -10,8 +9,8 @@ class CriterionChannel(ListScraper):
     _alias_ = 'criterion_channel'
 
     def get_list(list_id, config=None):
-        r = requests.get(f"https://www.criterionchannel.com/{list_id}")
-        soup = bs4.BeautifulSoup(r.text, 'html.parser')
+        r = http.get(f"https://www.criterionchannel.com/{list_id}")
+        soup = parsing.parse(r.text, ("h1", "collection-title"), ("div", "collection-description"), ("li", "js-collection-item"))
 
         list_name = soup.find("h1", class_="collection-title").text.strip()
         description = soup.find("div", class_="collection-description").text.strip()
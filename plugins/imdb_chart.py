@@ -1,30 +1,33 @@
-import bs4
-import requests
+from utils import http, imdb, parsing
 from utils.base_plugin import ListScraper
-import json
 
 class IMDBChart(ListScraper):
 
     _alias_ = 'imdb_chart'
+    _hosts = ["imdb.com"]
 
     def get_list(list_id, config=None):
-        res = requests.get(f'https://www.imdb.com/chart/{list_id}', headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:145.0) Gecko/20100101 Firefox/145.0', 'Accept-Language': 'en-US'})
-        soup = bs4.BeautifulSoup(res.text, 'html.parser')
+        config = config or {}
+        res = http.get(f'https://www.imdb.com/chart/{list_id}', headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:145.0) Gecko/20100101 Firefox/145.0', 'Accept-Language': 'en-US'})
+        soup = parsing.parse(res.text, 'title', 'meta')
         list_name = soup.find('title').text
         description = soup.find('meta', property='og:description')['content']
         movies = []
 
-        data = soup.find('script', id='__NEXT_DATA__')
-        data = json.loads(data.text)
+        data = parsing.script_json(res.text, id='__NEXT_DATA__')
+        edges = [edge["node"] for edge in next(iter(data["props"]["pageProps"]["pageData"].values()))["edges"]]
 
-        for movie in next(iter(data["props"]["pageProps"]["pageData"].values()))["edges"]:
-            movie = movie["node"]
+        # Some charts only hold the ids of their titles - look up the details of those concurrently
+        missing_ids = [movie["release"]["titles"][0]["id"] for movie in edges if "titleText" not in movie]
+        details = iter(imdb.get_titles(missing_ids, config.get("workers", 8)))
+
+        for movie in edges:
             if "titleText" not in movie:
-                # Get item details
-                res = requests.get(f'https://www.imdb.com/title/{movie["release"]["titles"][0]["id"]}', headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:145.0) Gecko/20100101 Firefox/145.0'})
-                soup = bs4.BeautifulSoup(res.text, 'html.parser')
-                item_data = json.loads(soup.find('script', id='__NEXT_DATA__').text)
-                movie = item_data["props"]["pageProps"]["aboveTheFoldData"]
+                movie = next(details)
+                # Skip titles whose details couldn't be fetched
+                if movie is not None:
+                    movies.append(dict(movie))
+                continue
 
             title = movie["titleText"]["text"]
 
@@ -1,38 +1,35 @@
-import bs4
-import requests
-import json
+from utils import http, imdb, parsing
 from utils.base_plugin import ListScraper
 
 class IMDBList(ListScraper):
 
     _alias_ = 'imdb_list'
+    _hosts = ["imdb.com"]
 
     def get_list(list_id, config=None):
-        r = requests.get(f'https://www.imdb.com/list/{list_id}', headers={'Accept-Language': 'en-US', 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:145.0) Gecko/20100101 Firefox/145.0', 'Accept-Language': 'en-US'})
-        soup = bs4.BeautifulSoup(r.text, 'html.parser')
+        config = config or {}
+        r = http.get(f'https://www.imdb.com/list/{list_id}', headers={'Accept-Language': 'en-US', 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:145.0) Gecko/20100101 Firefox/145.0', 'Accept-Language': 'en-US'})
+        soup = parsing.parse(r.text, 'h1', ('div', 'list-description'))
         list_name = soup.find('h1').text
         description = soup.find("div", {"class": "list-description"}).text
 
-        ld_json = soup.find("script", {"type": "application/ld+json"}).text
-        ld_json = json.loads(ld_json)
+        ld_json = parsing.script_json(r.text, type="application/ld+json")
         movies = []
         for row in ld_json["itemListElement"]:
             url_parts = row["item"]["url"].split("/")
             url_parts = [p for p in url_parts if p!=""]
 
-            release_year = None
-            if config.get("add_release_year", False):
-                # Get release_date
-                r = requests.get(row["item"]["url"], headers={'Accept-Language': 'en-US', 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:145.0) Gecko/20100101 Firefox/145.0', 'Accept-Language': 'en-US'})
-                soup = bs4.BeautifulSoup(r.text, 'html.parser')
-                movie_json = soup.find("script", {"type": "application/ld+json"}).text
-                release_year = json.loads(movie_json)["datePublished"].split("-")[0]
-
             movies.append({
                 "title": row["item"]["name"],
-                "release_year": release_year,
+                "release_year": None,
                 "media_type": row["item"]["@type"],
                 "imdb_id": url_parts[-1]
             })
 
+        if config.get("add_release_year", False):
+            # Get the release years from the title pages, concurrently. Years from other lists will do
+            for movie, details in zip(movies, imdb.get_titles([movie["imdb_id"] for movie in movies], config.get("workers", 8), authoritative=False)):
+                if details is not None:
+                    movie["release_year"] = details["release_year"]
+
         return {'name': list_name, 'items': movies, "description": description}
@@ -1,5 +1,5 @@
 import bs4
-import requests
+from utils import http
 import json
 from utils.base_plugin import ListScraper
 
@@ -7,6 +7,7 @@ class JellyfinAPI(ListScraper):
     '''Generate collections based on Jellyfin API queries'''
 
     _alias_ = 'jellyfin_api'
+    _cache_ttl_hours = None  # Queries the local library, so never cached
 
     def get_list(list_id, config=None):
         '''Call jellyfin API
@@ -31,7 +32,7 @@ class JellyfinAPI(ListScraper):
         }
         params = {**params, **list_id}
 
-        res = requests.get(f'{config["server_url"]}/Users/{config["user_id"]}/Items',headers={"X-Emby-Token": config["api_key"]}, params=params)
+        res = http.get(f'{config["server_url"]}/Users/{config["user_id"]}/Items',headers={"X-Emby-Token": config["api_key"]}, params=params)
 
         items = []
         for item in res.json()["Items"]:
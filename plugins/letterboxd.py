@@ -1,116 +1,184 @@
 import json
-from utils.base_plugin import ListScraper
-import bs4
-import requests
+import itertools
+import concurrent.futures
+from utils.base_plugin import ListScraper, collect_list
+from utils import http, metadata, parsing
+from utils.log import with_log_context
 from loguru import logger
 from requests_cache import CachedSession, FileCache
 
 class Letterboxd(ListScraper):
 
     _alias_ = 'letterboxd'
+    _hosts = ["letterboxd.com"]
+    # Be polite - letterboxd pages are fetched concurrently
+    _rate_limit = 5
+
+    # Parts of a list page which are used: title, description, paginator, films and next page link
+    _page_tags = ['h1', (None, 'body-text'), (None, 'paginate-pages'), 'article', (None, 'griditem'), (None, 'posteritem'), (None, 'next')]
+
+    def _get_page(list_id, page_number, watchlist, likeslist):
+        '''Fetch and parse a single page of a list'''
+        logger.info(f"Page number: {page_number}")
+        # Don't use /by/release-earliest/ - this overrides the list's natural order
+        # Keep the list in the order specified by the list creator
+        url_format = "https://letterboxd.com/{list_id}{maybe_detail}/page/{page_number}/"
+        maybe_detail = "" if watchlist or likeslist else "/detail"
+        r = http.get(
+            url_format.format(list_id=list_id, maybe_detail=maybe_detail, page_number=page_number),
+            headers={'User-Agent': 'Mozilla/5.0'},
+        )
+        return parsing.parse(r.text, *Letterboxd._page_tags)
+
+    def _get_page_count(soup):
+        '''Number of pages in the list according to the paginator, or None if there isn't one'''
+        page_numbers = [int(a.text) for a in soup.select(".paginate-pages a") if a.text.strip().isdigit()]
+        return max(page_numbers) if page_numbers else None
+
+    def _get_page_movies(soup, watchlist, likeslist):
+        '''Returns (movie, link) for every film on a list page'''
+        if watchlist:
+            page = soup.find_all('li', {'class': 'griditem'})
+        elif likeslist:
+            page = soup.find_all('li', {'class': 'posteritem'})
+        else:
+            page = soup.find_all('article')
 
-    def get_list(list_id, config=None):
+        movies = []
+        for movie_soup in page:
+            if watchlist or likeslist:
+                movie = {"title": movie_soup.find('img').attrs['alt'], "media_type": "movie"}
+                link = movie_soup.find("div").attrs["data-target-link"]
+            else:
+                movie = {"title": movie_soup.find('h2').find('a').text, "media_type": "movie"}
+                movie_year = movie_soup.find('small', {'class': 'metadata'})
+                if movie_year is not None:
+                    movie["release_year"] = movie_year.text.strip()
+
+                link = movie_soup.find('a')['href']
+            movies.append((movie, link))
+        return movies
+
+    def _get_movie_details(session, movie, link):
+        '''Fill in the imdb id and release year of a film from its letterboxd page'''
+        logger.debug(f"Getting release year and imdb details for: {movie['title']}")
+
+        try:
+            # Find the imdb id and release year
+            r = session.get(f"https://letterboxd.com{link}", headers={'User-Agent': 'Mozilla/5.0'})
+            # The imdb link and the release date are all that's needed from the film page
+            movie_soup = parsing.parse(r.text, 'a', 'span')
+
+            # Get IMDB ID
+            imdb_id = movie_soup.find('a', href=lambda href: href and 'imdb.com/title' in href)
+            if imdb_id is not None:
+                movie["imdb_id"] = imdb_id["href"].split("/title/")[1].split("/")[0]
+
+            # Get release year - try multiple possible locations
+            # Structure: <div class="details"> -> <div class="productioninfo"> -> <span class="releasedate">
+            movie_year = movie_soup.find("span", class_="releasedate")
+            if movie_year is not None:
+                # Extract year from the link text (e.g., <a href="/films/year/1993/">1993</a>)
+                year_link = movie_year.find('a')
+                if year_link is not None:
+                    movie["release_year"] = year_link.text.strip()
+                else:
+                    movie["release_year"] = movie_year.text.strip()
+
+            # If release year still not found, log a warning
+            if 'release_year' not in movie:
+                logger.warning(f"Could not find release year for movie: '{movie['title']}' at {link}")
+            else:
+                # Films without a year are only just announced - look them up again next time
+                metadata.put("letterboxd", link, movie)
+
+        except Exception as e:
+            logger.error(f"Error fetching details for movie: '{movie['title']}' at {link}: {e}")
+        return movie
+
+    def _iter_movies(list_id, config, first_page, watchlist, likeslist):
+        '''Yields the films of a list in order, fetching pages and film details concurrently'''
+        workers = config.get("workers", 8)
+
+        # Cache for movie pages - so we don't have to refetch imdb_ids
+        session = http.mount(CachedSession(backend='filesystem'))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            # Fetch the remaining pages concurrently if the paginator tells us how many there are
+            page_count = Letterboxd._get_page_count(first_page)
+            if page_count is not None:
+                get_page = with_log_context(Letterboxd._get_page)
+                pages = itertools.chain([first_page], executor.map(lambda n: get_page(list_id, n, watchlist, likeslist), range(2, page_count + 1)))
+            else:
+                pages = Letterboxd._follow_pages(list_id, first_page, watchlist, likeslist)
+
+            # Fetch film details concurrently. The details of the next page are requested
+            # before the films of the current page are handed out, keeping the list order.
+            get_movie_details = with_log_context(Letterboxd._get_movie_details)
+            pending = []
+            for page in pages:
+                submitted = []
+                for movie, link in Letterboxd._get_page_movies(page, watchlist, likeslist):
+                    if config.get("imdb_id_filter", False) or 'release_year' not in movie:
+                        # Films seen before, in any list, don't need their page fetched again
+                        details = metadata.get("letterboxd", link)
+                        if details is not None:
+                            movie.update({k: details[k] for k in ("imdb_id", "release_year") if details[k] is not None})
+                            submitted.append(movie)
+                        else:
+                            submitted.append(executor.submit(get_movie_details, session, movie, link))
+                    else:
+                        submitted.append(movie)
+                yield from Letterboxd._finished_movies(pending)
+                pending = submitted
+            yield from Letterboxd._finished_movies(pending)
+
+    def _follow_pages(list_id, soup, watchlist, likeslist):
+        '''Yields list pages one after another by following the next links'''
         page_number = 1
+        yield soup
+        while soup.find('a', {'class': 'next'}):
+            page_number += 1
+            soup = Letterboxd._get_page(list_id, page_number, watchlist, likeslist)
+            yield soup
+
+    def _finished_movies(results):
+        for movie in results:
+            if isinstance(movie, concurrent.futures.Future):
+                movie = movie.result()
+            # If a movie doesn't have a year, that means that the movie is only just announced and we don't even know when it's coming out. We can easily ignore these because movies will have a year of release by the time they come out.
+            if 'release_year' in movie:
+                yield movie
+
+    def iter_list(list_id, config=None):
         list_name = None
         description = None
-        movies = []
         config = config or {}
 
-        # Cache for movie pages - so we don't have to refetch imdb_ids
-        session = CachedSession(backend='filesystem')
-
-        while True:
-            logger.info(f"Page number: {page_number}")
-            watchlist = list_id.endswith("/watchlist")
-            likeslist = list_id.endswith("/likes/films")
-
-            if watchlist:
-                list_name = list_id.split("/")[0] + " Watchlist"
-                description = "Watchlist for " + list_id.split("/")[0]
-            elif likeslist:
-                list_name = list_id.split("/")[0] + " Likes"
-                description = "Likes list for " + list_id.split("/")[0]
-
-            if watchlist:
-                url_format = "https://letterboxd.com/{list_id}{maybe_detail}/page/{page_number}/"
-            else:
-                # Don't use /by/release-earliest/ - this overrides the list's natural order
-                # Keep the list in the order specified by the list creator
-                url_format = "https://letterboxd.com/{list_id}{maybe_detail}/page/{page_number}/"
-            maybe_detail = "" if watchlist or likeslist else "/detail"
-            r = requests.get(
-                url_format.format(list_id=list_id, maybe_detail=maybe_detail, page_number=page_number),
-                headers={'User-Agent': 'Mozilla/5.0'},
-            )
-
-            soup = bs4.BeautifulSoup(r.text, 'html.parser')
-
-            if list_name is None:
-                list_name = soup.find('h1', {'class': 'title-1 prettify'}).text
-
-            if description is None:
-                description = soup.find('div', {'class': 'body-text'})
-                if description is not None:
-                    description = "\n".join([p.text for p in description.find_all('p')])
-                else:
-                    description = ""
+        watchlist = list_id.endswith("/watchlist")
+        likeslist = list_id.endswith("/likes/films")
 
-            if watchlist:
-                page = soup.find_all('li', {'class': 'griditem'})
-            elif likeslist:
-                page = soup.find_all('li', {'class': 'posteritem'})
-            else:
-                page = soup.find_all('article')
+        if watchlist:
+            list_name = list_id.split("/")[0] + " Watchlist"
+            description = "Watchlist for " + list_id.split("/")[0]
+        elif likeslist:
+            list_name = list_id.split("/")[0] + " Likes"
+            description = "Likes list for " + list_id.split("/")[0]
 
-            for movie_soup in page:
-                if watchlist or likeslist:
-                    movie = {"title": movie_soup.find('img').attrs['alt'], "media_type": "movie"}
-                    link = movie_soup.find("div").attrs["data-target-link"]
-                else:
-                    movie = {"title": movie_soup.find('h2').find('a').text, "media_type": "movie"}
-                    movie_year = movie_soup.find('small', {'class': 'metadata'})
-                    if movie_year is not None:
-                        movie["release_year"] = movie_year.text.strip()
-
-                    link = movie_soup.find('a')['href']
-
-
-                if config.get("imdb_id_filter", False) or 'release_year' not in movie:
-                    logger.debug(f"Getting release year and imdb details for: {movie['title']}")
-
-                    try:
-                        # Find the imdb id and release year
-                        r = session.get(f"https://letterboxd.com{link}", headers={'User-Agent': 'Mozilla/5.0'})
-                        movie_soup = bs4.BeautifulSoup(r.text, 'html.parser')
-
-                        # Get IMDB ID
-                        imdb_id = movie_soup.find('a', href=lambda href: href and 'imdb.com/title' in href)
-                        if imdb_id is not None:
-                            movie["imdb_id"] = imdb_id["href"].split("/title/")[1].split("/")[0]
-
-                        # Get release year - try multiple possible locations
-                        # Structure: <div class="details"> -> <div class="productioninfo"> -> <span class="releasedate">
-                        movie_year = movie_soup.find("span", class_="releasedate")
-                        if movie_year is not None:
-                            # Extract year from the link text (e.g., <a href="/films/year/1993/">1993</a>)
-                            year_link = movie_year.find('a')
-                            if year_link is not None:
-                                movie["release_year"] = year_link.text.strip()
-                            else:
-                                movie["release_year"] = movie_year.text.strip()
-
-                        # If release year still not found, log a warning
-                        if 'release_year' not in movie:
-                            logger.warning(f"Could not find release year for movie: '{movie['title']}' at {link}")
-
-                    except Exception as e:
-                        logger.error(f"Error fetching details for movie: '{movie['title']}' at {link}: {e}")
-
-                # If a movie doesn't have a year, that means that the movie is only just announced and we don't even know when it's coming out. We can easily ignore these because movies will have a year of release by the time they come out.
-                if 'release_year' in movie:
-                    movies.append(movie)
-            if soup.find('a', {'class': 'next'}):
-                page_number += 1
+        soup = Letterboxd._get_page(list_id, 1, watchlist, likeslist)
+
+        if list_name is None:
+            list_name = soup.find('h1', {'class': 'title-1 prettify'}).text
+
+        if description is None:
+            description = soup.find('div', {'class': 'body-text'})
+            if description is not None:
+                description = "\n".join([p.text for p in description.find_all('p')])
             else:
-                break
+                description = ""
+
+        movies = Letterboxd._iter_movies(list_id, config, soup, watchlist, likeslist)
         return {'name': list_name, 'items': movies, "description": description}
+
+    def get_list(list_id, config=None):
+        return collect_list(Letterboxd.iter_list(list_id, config))
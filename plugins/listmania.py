@@ -1,7 +1,6 @@
 import yaml
 from utils.base_plugin import ListScraper
-import bs4
-import requests
+from utils import http, parsing
 from loguru import logger
 
 class ListMania(ListScraper):
@@ -9,14 +8,13 @@ class ListMania(ListScraper):
     _alias_ = 'listmania'
 
     def get_list(list_id, config=None):
-        r = requests.get(f"https://www.listmania.org/list/{list_id}")
-        soup = bs4.BeautifulSoup(r.text, 'html.parser')
+        r = http.get(f"https://www.listmania.org/list/{list_id}")
 
-        # Find the JSON-LD script tag
-        json_ld_tag = soup.find("script", type="application/ld+json")
+        # Find the JSON-LD script tag - everything is in there, so the page isn't parsed
+        json_ld_tag = parsing.find_script(r.text, type="application/ld+json")
         if not json_ld_tag:
             raise ValueError("No JSON-LD metadata found on the page")
-        json_ld = yaml.load(json_ld_tag.string, Loader=yaml.SafeLoader)
+        json_ld = yaml.load(json_ld_tag, Loader=yaml.SafeLoader)
 
         # Basic metadata
         list_name = json_ld.get("name", "").strip()
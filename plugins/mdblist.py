@@ -1,7 +1,6 @@
 import json
 from utils.base_plugin import ListScraper
-import bs4
-import requests
+from utils import http, parsing
 
 class MDBList(ListScraper):
 
@@ -12,14 +11,14 @@ class MDBList(ListScraper):
         list_id = list_id.strip("/")
 
         # Get the list name
-        r = requests.get(f"https://mdblist.com/lists/{list_id}")
-        soup = bs4.BeautifulSoup(r.text, 'html.parser')
+        r = http.get(f"https://mdblist.com/lists/{list_id}")
+        soup = parsing.parse(r.text, ('div', 'ui form'))
         list_name = soup.find('div', class_='ui form').find('h3').text.strip()
         description = soup.find("div", {"class": "ui form"}).find("div", {"class": "fourteen wide field"}).find_all("p")
         description = "\n".join([p.text for p in description])
 
         # Get the list items
-        r = requests.get(f"https://mdblist.com/lists/{list_id}/json")
+        r = http.get(f"https://mdblist.com/lists/{list_id}/json")
         movies = r.json()
         movies = [{**movie, 'media_type': movie["mediatype"]} for movie in movies]
 
@@ -1,5 +1,5 @@
 import json
-import requests
+from utils import http
 
 from utils.base_plugin import ListScraper
 
@@ -37,7 +37,7 @@ class PopularMovies(ListScraper):
             raise Exception(f"Invalid list_id \"{list_id}\" for popular-movies")
 
         # Get the list name
-        r = requests.get(f"https://popular-movies-data.stevenlu.com/{list_id}.json")
+        r = http.get(f"https://popular-movies-data.stevenlu.com/{list_id}.json")
         items = []
         for item in r.json():
             items.append({
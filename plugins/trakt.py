@@ -1,15 +1,25 @@
 import json
-from utils.base_plugin import ListScraper
+from utils.base_plugin import ListScraper, collect_list
 import bs4
 import os
-import requests
+from utils import http
+from utils.log import with_log_context
 from loguru import logger
 import time
+import threading
+import concurrent.futures
 
 class Trakt(ListScraper):
 
     _alias_ = 'trakt'
+    _hosts = ["api.trakt.tv"]
+    _revalidate = False  # Requests need the user's access token
     _access_token_file = '.trakt_access_token'
+    _auth_lock = threading.Lock()
+    # (session, token) per client id, shared by all trakt lists
+    _sessions = {}
+    # Items per chart page
+    _page_limit = 100
 
     _chart_types = {
             "movies/trending": {
@@ -76,105 +86,148 @@ class Trakt(ListScraper):
 
 
 
-    def _get_auth_token(config):
-        '''Get the authentication token for the Trakt API'''
-
-        headers = {
+    def _api_headers(config):
+        return {
             "Content-Type": "application/json",
             "trakt-api-version": "2",
             "trakt-api-key": config["client_id"]
         }
 
+
+    def _get_session(config, rejected_token=None):
+        '''Returns the authenticated session shared by all trakt lists. The token is loaded (or requested) once,
+        and refreshed when it expires or when trakt rejected rejected_token.'''
+        # Only ask the user to authenticate once when lists are processed in parallel
+        with Trakt._auth_lock:
+            if config["client_id"] not in Trakt._sessions:
+                Trakt._sessions[config["client_id"]] = (http.create_session(headers=Trakt._api_headers(config)), Trakt._load_or_request_auth_token(config))
+            session, token = Trakt._sessions[config["client_id"]]
+
+            if Trakt._token_expired(token) or (rejected_token is not None and rejected_token == token["access_token"]):
+                token = Trakt._refresh_auth_token(config, token)
+                Trakt._sessions[config["client_id"]] = (session, token)
+            session.headers["Authorization"] = f"Bearer {token['access_token']}"
+            return session, token
+
+
+    def _get(config, url, params=None):
+        '''GET over the shared session, retrying once with a refreshed token if trakt rejects the current one'''
+        session, token = Trakt._get_session(config)
+        r = session.get(url, params=params)
+        if r.status_code == 401:
+            logger.info("Trakt access token was rejected - refreshing it")
+            session, token = Trakt._get_session(config, rejected_token=token["access_token"])
+            r = session.get(url, params=params)
+        return r
+
+
+    def _token_expired(token):
+        if "created_at" not in token or "expires_in" not in token:
+            return False
+        # Refresh a little early, so the token doesn't expire halfway through a run
+        return time.time() > token["created_at"] + token["expires_in"] - 3600
+
+
+    def _save_auth_token(token):
+        with open(Trakt._access_token_file, 'w') as f:
+            json.dump(token, f)
+
+
+    def _load_or_request_auth_token(config):
+        '''Read the saved access token, or authenticate with the device flow'''
         if os.path.exists(Trakt._access_token_file):
             # If we have already authenticated, read the access token from the file
             with open(Trakt._access_token_file, 'r') as f:
-                access_token = f.read()
+                saved = f.read()
             logger.debug("Existing access token found")
-        else:
-            # If we have not authenticated, get the access token from the user
-            r = requests.post("https://api.trakt.tv/oauth/device/code", headers=headers, json={"client_id": config["client_id"]})
-            device_code = r.json()["device_code"]
-            user_code = r.json()["user_code"]
-            interval = r.json()["interval"]
-
-            logger.info("Authentication with Trakt API required")
-            logger.info(f"Please visit the following URL to get your access token: {r.json()['verification_url']}")
-            logger.info("")
-            logger.info(f"Your device code is: {user_code}")
-            logger.info("")
-
-            # Poll the API until the user has authenticated
-            while True:
-                r = requests.post("https://api.trakt.tv/oauth/device/token", headers=headers, json={
-                    "client_id": config["client_id"],
-                    "client_secret": config["client_secret"],
-                    "code": device_code
-                })
-                if r.status_code == 200:
-                    break
-                time.sleep(interval)
-
-            access_token = r.json()["access_token"]
-
-            # Save the access token to a file
-            with open(Trakt._access_token_file, 'w') as f:
-                f.write(access_token)
-            logger.info("Successfully authenticated with Trakt API")
-        return access_token
+            try:
+                return json.loads(saved)
+            except ValueError:
+                # Saved by an older version, which only kept the access token
+                return {"access_token": saved.strip()}
+        return Trakt._request_auth_token(config)
 
 
-    def get_list(list_id, config=None):
+    def _request_auth_token(config):
+        '''Authenticate with the device flow'''
+        headers = Trakt._api_headers(config)
 
-        headers = {
-            "Content-Type": "application/json",
-            "trakt-api-version": "2",
-            "trakt-api-key": config["client_id"]
-        }
+        # If we have not authenticated, get the access token from the user
+        r = http.post("https://api.trakt.tv/oauth/device/code", headers=headers, json={"client_id": config["client_id"]})
+        device_code = r.json()["device_code"]
+        user_code = r.json()["user_code"]
+        interval = r.json()["interval"]
 
-        access_token = Trakt._get_auth_token(config)
-        headers["Authorization"] = f"Bearer {access_token}"
-        logger.debug("Access token loaded")
+        logger.info("Authentication with Trakt API required")
+        logger.info(f"Please visit the following URL to get your access token: {r.json()['verification_url']}")
+        logger.info("")
+        logger.info(f"Your device code is: {user_code}")
+        logger.info("")
 
-        if list_id.startswith("users/"):
-            logger.debug("Trakt Default User list")
-            r = requests.get(f"https://api.trakt.tv/{list_id}", headers=headers)
-            components = list_id.split("/")
-            list_name = f"{components[1]}'s {components[2]}"
-            description = f"{components[1]}'s {components[2]}"
-            items_data = r.json()
-        elif list_id.startswith("shows/") or list_id.startswith("movies/"):
-            # Chart
-            logger.debug("Trakt chart list")
+        # Poll the API until the user has authenticated
+        while True:
+            r = http.post("https://api.trakt.tv/oauth/device/token", headers=headers, json={
+                "client_id": config["client_id"],
+                "client_secret": config["client_secret"],
+                "code": device_code
+            })
+            if r.status_code == 200:
+                break
+            time.sleep(interval)
 
-            current_page = 1
-            items_data = []
-            while True:
-                r = requests.get(f"https://api.trakt.tv/{list_id}?page={current_page}", headers=headers)
-                items_data += r.json()
-                page_count = int(r.headers.get("X-Pagination-Page-Count", 1))
-                logger.debug(f"Page {current_page}/{page_count}")
-                if current_page >= page_count:
-                    break
-                current_page += 1
+        # Save the token to a file
+        token = r.json()
+        Trakt._save_auth_token(token)
+        logger.info("Successfully authenticated with Trakt API")
+        return token
 
-            list_name = Trakt._chart_types[list_id]["title"]
-            description = Trakt._chart_types[list_id]["description"]
-            if list_id.startswith("shows/"):
-                item_types = "show"
-            else:
-                item_types = "movie"
-        else:
-            logger.debug("Trakt User list")
-            r = requests.get(f"https://api.trakt.tv/lists/{list_id}", headers=headers)
-            list_name = r.json()["name"]
-            description = r.json()["description"]
-            r = requests.get(f"https://api.trakt.tv/lists/{list_id}/items", headers=headers)
-            items_data = r.json()
+
+    def _refresh_auth_token(config, token):
+        '''Exchange the refresh token for a new access token, or authenticate again if that isn't possible'''
+        if "refresh_token" not in token:
+            return Trakt._request_auth_token(config)
+
+        r = http.post("https://api.trakt.tv/oauth/token", headers=Trakt._api_headers(config), json={
+            "refresh_token": token["refresh_token"],
+            "client_id": config["client_id"],
+            "client_secret": config["client_secret"],
+            "redirect_uri": "urn:ietf:wg:oauth:2.0:oob",
+            "grant_type": "refresh_token"
+        })
+        if r.status_code != 200:
+            logger.warning(f"Could not refresh the trakt access token ({r.status_code})")
+            return Trakt._request_auth_token(config)
+
+        token = r.json()
+        Trakt._save_auth_token(token)
+        logger.info("Refreshed trakt access token")
+        return token
+
+
+    def _get_chart_pages(list_id, config):
+        '''Yields the items of a chart page by page. The first page tells how many pages there are,
+        the rest are fetched concurrently.'''
+        url = f"https://api.trakt.tv/{list_id}"
+        limit = config.get("page_limit", Trakt._page_limit)
+
+        r = Trakt._get(config, url, {"page": 1, "limit": limit})
+        page_count = int(r.headers.get("X-Pagination-Page-Count", 1))
+        logger.debug(f"Page 1/{page_count}")
+        yield from r.json()
+        if page_count <= 1:
+            return
+
+        get_page = with_log_context(lambda page: Trakt._get(config, url, {"page": page, "limit": limit}).json())
+        with concurrent.futures.ThreadPoolExecutor(max_workers=config.get("workers", 4)) as executor:
+            # map keeps the page order
+            for page_number, items in enumerate(executor.map(get_page, range(2, page_count + 1)), start=2):
+                logger.debug(f"Page {page_number}/{page_count}")
+                yield from items
 
 
-        # Process the items
+    def _parse_items(items_data, item_types=None):
+        '''Turns trakt list entries into list items'''
         logger.debug("Processing items.")
-        items = []
         for item_data in items_data:
             if "type" in item_data:
                 item = {"media_type": item_data["type"]}
@@ -198,10 +251,44 @@ class Trakt(ListScraper):
                 breakpoint()
             if "year" in meta:
                 item["release_year"] = meta["year"]
-            items.append(item)
+            yield item
+
+
+    def iter_list(list_id, config=None):
+
+        item_types = None
+        if list_id.startswith("users/"):
+            logger.debug("Trakt Default User list")
+            r = Trakt._get(config, f"https://api.trakt.tv/{list_id}")
+            components = list_id.split("/")
+            list_name = f"{components[1]}'s {components[2]}"
+            description = f"{components[1]}'s {components[2]}"
+            items_data = r.json()
+        elif list_id.startswith("shows/") or list_id.startswith("movies/"):
+            # Chart - items are handed out as pages arrive
+            logger.debug("Trakt chart list")
+            items_data = Trakt._get_chart_pages(list_id, config)
+
+            list_name = Trakt._chart_types[list_id]["title"]
+            description = Trakt._chart_types[list_id]["description"]
+            if list_id.startswith("shows/"):
+                item_types = "show"
+            else:
+                item_types = "movie"
+        else:
+            logger.debug("Trakt User list")
+            r = Trakt._get(config, f"https://api.trakt.tv/lists/{list_id}")
+            list_name = r.json()["name"]
+            description = r.json()["description"]
+            r = Trakt._get(config, f"https://api.trakt.tv/lists/{list_id}/items")
+            items_data = r.json()
 
         return {
             "name": list_name,
             "description": description,
-            "items": items
+            "items": Trakt._parse_items(items_data, item_types)
         }
+
+
+    def get_list(list_id, config=None):
+        return collect_list(Trakt.iter_list(list_id, config))
@@ -1,24 +1,25 @@
 import json
-from utils.base_plugin import ListScraper
-import bs4
-import requests
+from utils.base_plugin import ListScraper, collect_list
+from utils import http, parsing
 
 class TSPDT(ListScraper):
 
     _alias_ = 'tspdt'
+    _cache_ttl_hours = 168  # Only updated once a year
 
-    def get_list(list_id, config=None):
-        r = requests.get("https://www.theyshootpictures.com/gf1000_all1000films_table.php")
-        soup = bs4.BeautifulSoup(r.text, 'html.parser')
-        movies = []
-
-
-        for row in soup.find_all('tr')[1:]:
-            values = row.find_all('td')
-            movie_title = values[2].text
+    def _iter_movies():
+        '''Downloads the table when first read, then yields the films row by row'''
+        r = http.get("https://www.theyshootpictures.com/gf1000_all1000films_table.php")
+        for values in parsing.table_rows(r.text)[1:]:
+            movie_title = values[2]
             for suffix in ["The", "A", "La", "Le", "L'"]:
                 if movie_title.endswith(", "+suffix):
                     movie_title = suffix + " " + movie_title[:-len(suffix)-2]
-            movie_year = values[4].text
-            movies.append({'title': movie_title, 'release_year': movie_year, 'media_type': 'movie'})
-        return {'name': "TSPDT Top 1000 Greatest", 'items': movies, "description": "Compiled from 16,000+ film lists and ballots, The TSPDT 1,000 Greatest Films is quite possibly the most definitive collection of the most critically acclaimed films you will find."}
+            movie_year = values[4]
+            yield {'title': movie_title, 'release_year': movie_year, 'media_type': 'movie'}
+
+    def iter_list(list_id, config=None):
+        return {'name': "TSPDT Top 1000 Greatest", 'items': TSPDT._iter_movies(), "description": "Compiled from 16,000+ film lists and ballots, The TSPDT 1,000 Greatest Films is quite possibly the most definitive collection of the most critically acclaimed films you will find."}
+
+    def get_list(list_id, config=None):
+        return collect_list(TSPDT.iter_list(list_id, config))
@@ -0,0 +1,23 @@
+import pytest
+
+
+class FakeResponse:
+    '''Stands in for a requests response with a JSON body'''
+
+    def __init__(self, data, status_code=200, headers=None):
+        self.data = data
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(f"{self.status_code} error")
+
+
+@pytest.fixture
+def fake_response():
+    '''FakeResponse class, for tests which replace HTTP requests'''
+    return FakeResponse
@@ -0,0 +1,42 @@
+from plugins.arr import Arr
+
+
+def test_get_list_from_snapshot(monkeypatch, fake_response):
+    responses = {
+        "https://radarr.example.com/api/v3/tag": [{"id": 1, "label": "my_tag"}, {"id": 2, "label": "other_tag"}],
+        "https://radarr.example.com/api/v3/system/status": {"appName": "Radarr"},
+        "https://radarr.example.com/api/v3/movie": [
+            {"id": 5, "title": "Heat", "year": 1995, "imdbId": "tt0113277", "tags": [1]},
+            {"id": 3, "title": "Alien", "year": 1979, "imdbId": "tt0078748", "tags": [1, 2]},
+            {"id": 4, "title": "Brazil", "year": 1985, "tags": []},
+        ],
+        "https://sonarr.example.com/api/v3/tag": [{"id": 7, "label": "my_tag"}],
+        "https://sonarr.example.com/api/v3/series": [{"id": 1, "title": "Twin Peaks", "year": 1990, "imdbId": "tt0098936", "tags": [7]}],
+    }
+    requested = []
+
+    def get(url, **kwargs):
+        requested.append(url)
+        return fake_response(responses[url])
+
+    monkeypatch.setattr("utils.http.get", get)
+    monkeypatch.setattr(Arr, "_snapshots", {})
+    config = {"server_configs": [
+        {"base_url": "https://radarr.example.com", "api_key": "a"},
+        {"base_url": "https://sonarr.example.com", "api_key": "b", "type": "sonarr"},
+    ]}
+
+    result = Arr.get_list("my_tag", config)
+    assert [item["title"] for item in result["items"]] == ["Alien", "Heat", "Twin Peaks"]
+    assert result["items"][2] == {"title": "Twin Peaks", "release_year": 1990, "media_type": "show", "imdb_id": "tt0098936"}
+    assert len(requested) == 5
+
+    # Other tags are served from the same snapshot
+    result = Arr.get_list("other_tag", config)
+    assert [item["title"] for item in result["items"]] == ["Alien"]
+    assert len(requested) == 5
+
+    # The next run downloads the libraries again
+    Arr.start_run()
+    Arr.get_list("my_tag", config)
+    assert len(requested) == 10
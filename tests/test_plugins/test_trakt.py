@@ -0,0 +1,47 @@
+import json
+import time
+from plugins.trakt import Trakt
+
+
+class FakeTrakt:
+    '''Chart with 3 pages, which only accepts the "fresh" access token'''
+
+    def __init__(self, fake_response):
+        self.fake_response = fake_response
+        self.headers = {}
+        self.requests = []
+
+    def get(self, url, params=None):
+        self.requests.append(params)
+        if self.headers.get("Authorization") != "Bearer fresh":
+            return self.fake_response({}, 401)
+        page = params["page"]
+        movies = [{"movie": {"title": f"Movie {page}.{i}", "year": 2000 + page, "ids": {"imdb": f"tt{page}{i}"}}} for i in range(2)]
+        return self.fake_response(movies, headers={"X-Pagination-Page-Count": "3"})
+
+
+def test_chart_pages_and_token_refresh(tmp_path, monkeypatch, fake_response):
+    token_file = tmp_path / "token"
+    token_file.write_text(json.dumps({"access_token": "stale", "refresh_token": "r", "created_at": time.time(), "expires_in": 86400}))
+    server = FakeTrakt(fake_response)
+    refreshes = []
+
+    def post(url, **kwargs):
+        refreshes.append(kwargs["json"]["refresh_token"])
+        return fake_response({"access_token": "fresh", "refresh_token": "r2", "created_at": time.time(), "expires_in": 86400})
+
+    monkeypatch.setattr(Trakt, "_access_token_file", str(token_file))
+    monkeypatch.setattr(Trakt, "_sessions", {})
+    monkeypatch.setattr("utils.http.create_session", lambda headers=None: server)
+    monkeypatch.setattr("utils.http.post", post)
+    config = {"client_id": "id", "client_secret": "secret"}
+
+    items = Trakt.get_list("movies/popular", config)["items"]
+    assert [item["title"] for item in items] == ["Movie 1.0", "Movie 1.1", "Movie 2.0", "Movie 2.1", "Movie 3.0", "Movie 3.1"]
+    assert all(params["limit"] == 100 for params in server.requests)
+    assert refreshes == ["r"]
+    assert json.loads(token_file.read_text())["access_token"] == "fresh"
+
+    # Other lists reuse the session and token
+    Trakt.get_list("movies/trending", config)
+    assert refreshes == ["r"]
@@ -0,0 +1,162 @@
+import os
+import time
+from PIL import Image
+from utils.cache import MatchCache, ScrapeCache, ListFingerprints, JellyseerrCache, PosterCache, MetadataStore
+
+
+def test_match_cache(tmp_path):
+    cache = MatchCache(str(tmp_path / "match_cache.db"))
+    context = MatchCache.context(True, {})
+    hit = {"title": "The Matrix", "release_year": "1999", "imdb_id": "tt0133093", "media_type": ["Movie"]}
+    miss = {"title": "Nosferatu", "release_year": "1922", "media_type": ["Movie"]}
+
+    assert cache.get(hit, context) is None
+    cache.put(hit, context, "abc")
+    cache.put(miss, context, None)
+
+    assert cache.get(hit, context) == {"jellyfin_id": "abc"}
+    assert cache.get(miss, context) == {"jellyfin_id": None}
+    assert cache.get(hit, MatchCache.context(False, {})) is None
+    assert cache.misses() == [(miss, context)]
+
+    cache.clear_hits()
+    assert cache.get(hit, context) is None
+    assert cache.get(miss, context) == {"jellyfin_id": None}
+
+
+def test_match_cache_max_age(tmp_path):
+    cache = MatchCache(str(tmp_path / "match_cache.db"), max_age_days=1)
+    context = MatchCache.context(True, {})
+    item = {"title": "The Matrix", "release_year": "1999", "media_type": ["Movie"]}
+    cache.put(item, context, "abc")
+    cache.execute("UPDATE matches SET checked_at = ?", (time.time() - 2 * 86400,))
+    assert cache.get(item, context) is None
+
+
+def test_match_cache_miss_max_age(tmp_path):
+    cache = MatchCache(str(tmp_path / "match_cache.db"), miss_max_age_days=7)
+    context = MatchCache.context(True, {})
+    hit = {"title": "The Matrix", "release_year": "1999", "media_type": ["Movie"]}
+    miss = {"title": "Nosferatu", "release_year": "1922", "media_type": ["Movie"]}
+    cache.put(hit, context, "abc")
+    cache.put(miss, context, None)
+    cache.execute("UPDATE matches SET checked_at = ?", (time.time() - 8 * 86400,))
+    assert cache.get(hit, context) == {"jellyfin_id": "abc"}
+    assert cache.get(miss, context) is None
+
+
+def test_meta(tmp_path):
+    cache = MatchCache(str(tmp_path / "match_cache.db"))
+    assert cache.get_meta("item_count") is None
+    cache.set_meta("item_count", 12)
+    assert MatchCache(str(tmp_path / "match_cache.db")).get_meta("item_count") == 12
+
+
+class CountingScraper:
+    _cache_ttl_hours = 1
+    _revalidate = True
+    calls = 0
+
+    def iter_list(list_id, config=None):
+        CountingScraper.calls += 1
+        return {"name": list_id, "items": iter([{"title": "The Matrix", "media_type": "movie"}])}
+
+
+def test_scrape_cache(tmp_path):
+    cache = ScrapeCache(str(tmp_path / "scrape_cache.db"))
+    config = {"enabled": True, "list_ids": ["a"]}
+
+    list_info = cache.iter_list(CountingScraper, "counting", "a", config)
+    assert list(list_info["items"]) == [{"title": "The Matrix", "media_type": "movie"}]
+    assert CountingScraper.calls == 1
+
+    # Reused while fresh, but not for other lists or settings
+    assert cache.iter_list(CountingScraper, "counting", "a", config) == {"name": "a", "items": [{"title": "The Matrix", "media_type": "movie"}]}
+    assert CountingScraper.calls == 1
+    list(cache.iter_list(CountingScraper, "counting", "a", {**config, "year_filter": False})["items"])
+    assert CountingScraper.calls == 2
+
+    # Expired results without validators are scraped again
+    list(cache.iter_list(CountingScraper, "counting", "a", {**config, "cache_ttl_hours": 0})["items"])
+    assert CountingScraper.calls == 3
+
+
+def test_list_fingerprints(tmp_path):
+    fingerprints = ListFingerprints(str(tmp_path / "list_fingerprints.db"))
+    items = [{"title": "The Matrix", "media_type": "movie"}, {"title": "Nosferatu", "media_type": "movie"}]
+    fingerprint = ListFingerprints.fingerprint(items, "10:abc", "playlist")
+
+    assert fingerprints.get("tspdt", "a") is None
+    fingerprints.put("tspdt", "a", fingerprint)
+    assert fingerprints.get("tspdt", "a") == fingerprint
+    assert fingerprints.get("tspdt", {"list_id": "a"}) is None
+
+    assert ListFingerprints.fingerprint(items[::-1], "10:abc", "playlist") != fingerprint
+    assert ListFingerprints.fingerprint(items, "11:def", "playlist") != fingerprint
+
+
+def test_jellyseerr_cache(tmp_path):
+    cache = JellyseerrCache(str(tmp_path / "jellyseerr_cache.db"), search_max_age_hours=1)
+    assert cache.get_search("The Matrix") is None
+    cache.put_search("The Matrix", [{"id": 603, "mediaType": "movie"}])
+    assert cache.get_search("The Matrix") == [{"id": 603, "mediaType": "movie"}]
+    cache.execute("UPDATE searches SET searched_at = ?", (time.time() - 7200,))
+    assert cache.get_search("The Matrix") is None
+
+    cache.put_media("imdb", "tt0133093", ("movie", 603))
+    assert cache.get_media("imdb", "tt0133093") == ("movie", 603)
+    assert not cache.is_requested(("movie", 603))
+    cache.put_request(("movie", 603), 12)
+    assert cache.is_requested(("movie", 603))
+    assert not cache.is_requested(("tv", 603))
+    # Requests are checked again once they're old, in case they were declined
+    cache.execute("UPDATE requests SET requested_at = ?", (time.time() - 8 * 86400,))
+    assert not cache.is_requested(("movie", 603))
+
+
+def test_poster_cache(tmp_path):
+    cache = PosterCache(str(tmp_path / "poster_cache.db"), str(tmp_path / "poster_cells"))
+    poster_hash = PosterCache.poster_hash("Top 250", ["/Items/a/Images/Primary?tag=1"])
+    assert PosterCache.poster_hash("Top 250", ["/Items/a/Images/Primary?tag=2"]) != poster_hash
+    assert PosterCache.poster_hash("Top 100", ["/Items/a/Images/Primary?tag=1"]) != poster_hash
+
+    assert cache.get_hash("playlist") is None
+    cache.put_hash("playlist", poster_hash)
+    assert cache.get_hash("playlist") == poster_hash
+
+    assert cache.get_cell("/Items/a/Images/Primary?tag=1", (100, 150)) is None
+    cache.put_cell("/Items/a/Images/Primary?tag=1", (100, 150), Image.new("RGB", (100, 150), (255, 0, 0)))
+    cell = cache.get_cell("/Items/a/Images/Primary?tag=1", (100, 150))
+    assert cell.size == (100, 150)
+    assert cache.get_cell("/Items/a/Images/Primary?tag=1", (50, 75)) is None
+
+    # Only cells which haven't been used for a while are evicted
+    assert cache.evict_cells(1) == 0
+    old = time.time() - 2 * 86400
+    for entry in os.scandir(tmp_path / "poster_cells"):
+        os.utime(entry.path, (old, old))
+    assert cache.evict_cells(1) == 1
+    assert cache.get_cell("/Items/a/Images/Primary?tag=1", (100, 150)) is None
+
+
+def test_metadata_store(tmp_path):
+    store = MetadataStore(str(tmp_path / "metadata.db"), max_age_days=1)
+    alien = {"title": "Alien", "release_year": "1979", "media_type": "movie", "imdb_id": "tt0078748"}
+    assert store.get("letterboxd", "/film/alien/") is None
+    store.put("letterboxd", "/film/alien/", alien)
+    assert store.get("letterboxd", "/film/alien/") == alien
+    assert store.get("imdb", "tt0078748") is None
+
+    # Already stored titles aren't overwritten by other plugins
+    store.add_many([("letterboxd", "/film/alien/", {**alien, "release_year": "1980"}), ("imdb", "tt0078748", {**alien, "media_type": "Movie"})])
+    assert store.get("letterboxd", "/film/alien/")["release_year"] == "1979"
+    assert store.get("imdb", "tt0078748") == {**alien, "media_type": "Movie"}
+    assert store.get("imdb", "tt0078748", authoritative=True) is None
+
+    # Looking the title up replaces contributed details, which then only fill in missing fields
+    store.put("imdb", "tt0078748", {**alien, "release_year": None})
+    store.add_many([("imdb", "tt0078748", {**alien, "title": "Alien (1979)", "media_type": "show"})])
+    assert store.get("imdb", "tt0078748", authoritative=True) == alien
+
+    store.execute("UPDATE titles SET fetched_at = 0")
+    assert store.get("imdb", "tt0078748") is None
@@ -0,0 +1,36 @@
+import json
+import time
+from datetime import datetime, timedelta, timezone
+import requests
+from utils import http
+
+
+def make_response(headers):
+    response = requests.Response()
+    response.headers.update(headers)
+    return response
+
+
+def test_requested_delay():
+    assert http._requested_delay(make_response({})) is None
+    assert http._requested_delay(make_response({"Retry-After": "12"})) == 12
+    until = (datetime.now(timezone.utc) + timedelta(seconds=30)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    assert 25 < http._requested_delay(make_response({"X-Ratelimit": json.dumps({"remaining": 0, "until": until})})) <= 30
+    assert http._requested_delay(make_response({"X-Ratelimit": json.dumps({"remaining": 10, "until": until})})) is None
+
+
+def test_has_secrets():
+    assert http.has_secrets("https://radarr.example.com/api/v3/tag?apikey=abc")
+    assert not http.has_secrets("https://www.imdb.com/chart/top?ref_=nv_mv_250")
+
+
+def test_rate_limiter_backoff():
+    limiter = http.RateLimiter(10, burst=2)
+    limiter.backoff(0.1)
+    assert limiter.rate == 5
+    start = time.monotonic()
+    limiter.wait()
+    assert time.monotonic() - start >= 0.09
+    for _ in range(10):
+        limiter.success()
+    assert limiter.rate == 10
@@ -0,0 +1,28 @@
+import json
+from utils import imdb, metadata
+from utils.cache import MetadataStore
+
+
+def test_parse_title_page():
+    next_data = {"props": {"pageProps": {"aboveTheFoldData": {
+        "id": "tt0133093", "titleText": {"text": "The Matrix"}, "releaseYear": {"year": 1999}, "titleType": {"id": "movie"}
+    }}}}
+    html = f'<html><script id="__NEXT_DATA__" type="application/json">{json.dumps(next_data)}</script></html>'
+    assert imdb.parse_title_page(html, "tt0133093") == {"title": "The Matrix", "release_year": 1999, "media_type": "movie", "imdb_id": "tt0133093"}
+
+    ld_json = {"@type": "TVSeries", "name": "Twin Peaks", "datePublished": "1990-04-08"}
+    html = f'<html><script type="application/ld+json">{json.dumps(ld_json)}</script></html>'
+    assert imdb.parse_title_page(html, "tt0098936") == {"title": "Twin Peaks", "release_year": "1990", "media_type": "TVSeries", "imdb_id": "tt0098936"}
+
+
+def test_get_titles_uses_metadata_store(monkeypatch):
+    store = MetadataStore(":memory:")
+    monkeypatch.setattr(metadata, "_store", store)
+    # Found in another plugin's list
+    metadata.add_items([{"title": "The Matrix", "release_year": 1999, "media_type": "movie", "imdb_id": "tt0133093"}])
+    fetched = []
+    monkeypatch.setattr(imdb.http, "get", lambda url, **kwargs: fetched.append(url))
+
+    titles = imdb.get_titles(["tt0133093", "tt0133093"], authoritative=False)
+    assert [title["release_year"] for title in titles] == [1999, 1999]
+    assert fetched == []
@@ -0,0 +1,9 @@
+from datetime import datetime, timezone
+from utils.jellyfin import parse_jellyfin_date
+
+
+def test_parse_jellyfin_date():
+    assert parse_jellyfin_date("2024-05-01T12:34:56Z") == datetime(2024, 5, 1, 12, 34, 56, tzinfo=timezone.utc)
+    assert parse_jellyfin_date("2024-05-01T12:34:56.1Z") == datetime(2024, 5, 1, 12, 34, 56, 100000, tzinfo=timezone.utc)
+    assert parse_jellyfin_date("2024-05-01T12:34:56.12Z") == datetime(2024, 5, 1, 12, 34, 56, 120000, tzinfo=timezone.utc)
+    assert parse_jellyfin_date("2024-05-01T12:34:56.1234567Z") == datetime(2024, 5, 1, 12, 34, 56, 123456, tzinfo=timezone.utc)
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+import pytest
+from benchmarks.fake_jellyfin import FakeJellyfin
+from utils import metrics
+from utils.cache import MatchCache
+from utils.jellyfin_async import AsyncJellyfinClient, BackgroundJellyfinClient
+
+LIBRARY = [
+    {"Id": f"{i:032x}", "Name": name, "OriginalTitle": name, "Type": item_type, "ProductionYear": year,
+     "ProviderIds": {"Imdb": imdb_id} if imdb_id else {}, "DateCreated": "2024-01-01T00:00:00.0000000Z",
+     "DateLastSaved": "2024-01-01T00:00:00.0000000Z", "ImageTags": {"Primary": "tag"}}
+    for i, (name, item_type, year, imdb_id) in enumerate([
+        ("The Matrix", "Movie", 1999, "tt0133093"),
+        ("The Matrix", "Movie", 2021, None),
+        ("Alien", "Movie", 1979, "tt0078748"),
+        ("Aliens", "Movie", 1986, "tt0090605"),
+        ("Dark", "Series", 2017, "tt5753856"),
+    ], start=1)
+]
+
+
+class CountingJellyfin(FakeJellyfin):
+    '''Keeps track of the most searches in flight at once'''
+
+    def __init__(self, library):
+        super().__init__(library)
+        self.active = 0
+        self.max_active = 0
+        self._active_lock = threading.Lock()
+
+    def query_items(self, query):
+        with self._active_lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        with self._active_lock:
+            self.active -= 1
+        return super().query_items(query)
+
+
+@pytest.fixture
+def jellyfin():
+    fake = CountingJellyfin(LIBRARY)
+    server = fake.serve()
+    fake.url = f"http://127.0.0.1:{server.server_port}"
+    yield fake
+    server.shutdown()
+
+
+def items():
+    return [
+        {"title": "The Matrix", "release_year": "1999", "imdb_id": "tt0133093", "media_type": "movie"},
+        {"title": "The Matrix", "release_year": "2021", "media_type": "movie"},
+        {"title": "Aliens", "release_year": "1986", "media_type": "movie"},
+        {"title": "Dark", "release_year": "2017", "imdb_id": "tt5753856", "media_type": "tvSeries"},
+        {"title": "Missing", "release_year": "2000", "media_type": "movie"},
+    ]
+
+
+@pytest.mark.parametrize("library_index", [False, True])
+def test_match_items(jellyfin, library_index, tmp_path):
+    match_cache = MatchCache(str(tmp_path / "match_cache.db"))
+
+    async def match():
+        async with AsyncJellyfinClient(jellyfin.url, "key", jellyfin.user_id, library_index=library_index, match_cache=match_cache) as client:
+            return await client.match_items(items())
+
+    expected = [LIBRARY[0]["Id"], LIBRARY[1]["Id"], LIBRARY[3]["Id"], LIBRARY[4]["Id"], None]
+    assert asyncio.run(match()) == expected
+    # Matched again from the match cache
+    searches = jellyfin.requests[f"GET /Users/{jellyfin.user_id}/Items"]
+    assert asyncio.run(match()) == expected
+    assert jellyfin.requests[f"GET /Users/{jellyfin.user_id}/Items"] == searches
+
+
+def test_in_flight_limit(jellyfin):
+    async def match():
+        async with AsyncJellyfinClient(jellyfin.url, "key", jellyfin.user_id, max_concurrent_requests=2) as client:
+            return await client.match_items([item for _ in range(4) for item in items()])
+
+    asyncio.run(match())
+    assert jellyfin.max_active == 2
+
+
+def test_playlists(jellyfin):
+    item_ids = [item["Id"] for item in LIBRARY]
+
+    async def sync():
+        async with AsyncJellyfinClient(jellyfin.url, "key", jellyfin.user_id) as client:
+            playlist_id = await client.create_playlist("Favourites")
+            assert await client.sync_playlist(playlist_id, item_ids[:3])
+            assert await client.sync_playlist(playlist_id, [item_ids[4], item_ids[2], item_ids[0]])
+            assert await client.upload_poster(playlist_id, b"jpeg")
+            return playlist_id, await client.get_all_playlists()
+
+    playlist_id, playlists = asyncio.run(sync())
+    assert [item_id for _, item_id in jellyfin.playlists[playlist_id]["entries"]] == [item_ids[4], item_ids[2], item_ids[0]]
+    assert [playlist["Name"] for playlist in playlists] == ["Favourites"]
+    assert playlists[0]["ImageTags"]
+
+
+def test_background_client(jellyfin):
+    client = BackgroundJellyfinClient(AsyncJellyfinClient(jellyfin.url, "key", jellyfin.user_id))
+    run_metrics = metrics.RunMetrics()
+    try:
+        with run_metrics.list_context("list"), metrics.stage("match"):
+            futures = [client.match_item_to_jellyfin(item) for item in items()]
+            results = [future.result() for future in futures]
+    finally:
+        client.close()
+
+    assert results[2] == LIBRARY[3]["Id"]
+    # Requests are counted towards the list which submitted them
+    requests = run_metrics.summary()["lists"]["list"]["stages"]["match"]["requests"]
+    assert requests["127.0.0.1"]["count"] == jellyfin.requests[f"GET /Users/{jellyfin.user_id}/Items"]
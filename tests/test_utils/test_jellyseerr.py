@@ -0,0 +1,40 @@
+import threading
+import pytest
+from utils.jellyseerr import RequestQueue
+
+
+class FakeClient:
+    max_workers = 1
+
+    def __init__(self):
+        self.requested = []
+        self.release = threading.Event()
+
+    def make_request(self, item):
+        self.release.wait(5)
+        self.requested.append(item["title"])
+        return True
+
+
+def test_request_queue():
+    client = FakeClient()
+    client.release.set()
+    with RequestQueue(client) as queue:
+        queue.add({"title": "Alien", "release_year": 1979})
+        queue.add({"title": "Alien", "release_year": 1979})
+        queue.add({"title": "Heat", "release_year": 1995})
+        assert queue.wait() == 2
+    assert queue.size == 3
+    assert sorted(client.requested) == ["Alien", "Heat"]
+
+
+def test_request_queue_stops_when_list_fails():
+    client = FakeClient()
+    with pytest.raises(RuntimeError):
+        with RequestQueue(client) as queue:
+            for title in ("Alien", "Heat", "Brazil"):
+                queue.add({"title": title})
+            threading.Timer(0.1, client.release.set).start()
+            raise RuntimeError("matching failed")
+    # The request which had started finishes, the others are dropped
+    assert client.requested == ["Alien"]
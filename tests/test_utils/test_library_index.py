@@ -0,0 +1,74 @@
+import pytest
+from utils.jellyfin import JellyfinClient
+from utils.library_index import LibraryIndex, normalize_title
+
+
+@pytest.fixture
+def library():
+    index = LibraryIndex()
+    for jf_item in [
+        {"Id": "1", "Name": "The Matrix", "Type": "Movie", "ProductionYear": 1999, "ProviderIds": {"Imdb": "tt0133093", "Tmdb": "603"}},
+        {"Id": "2", "Name": "The Matrix", "Type": "Movie", "ProductionYear": 2021, "ProviderIds": {}},
+        {"Id": "3", "Name": "Amélie", "OriginalTitle": "Le Fabuleux Destin d'Amélie Poulain", "Type": "Movie", "ProductionYear": 2001, "ProviderIds": {"Imdb": "tt0211915"}},
+        {"Id": "4", "Name": "Dark", "Type": "Series", "ProductionYear": 2017, "ProviderIds": {"Imdb": "tt5753856"}},
+    ]:
+        index.add(jf_item)
+    return index
+
+
+def match(index, item, year_filter=True):
+    candidates = index.candidates(item, item["media_type"])
+    result = JellyfinClient.select_match(item, candidates, year_filter)
+    return result["Id"] if result else None
+
+
+def test_normalize_title():
+    assert normalize_title("Amélie") == normalize_title("AMELIE")
+    assert normalize_title("Spider-Man:  Homecoming") == "spider man homecoming"
+
+
+def test_imdb_match(library):
+    assert match(library, {"title": "Matrix", "imdb_id": "tt0133093", "media_type": ["Movie"]}) == "1"
+    assert match(library, {"title": "The Matrix", "imdb_id": "tt9999999", "media_type": ["Movie"]}) is None
+
+
+def test_year_match(library):
+    assert match(library, {"title": "The Matrix", "release_year": "2021", "media_type": ["Movie"]}) == "2"
+    assert match(library, {"title": "the matrix", "release_year": 1999, "media_type": ["Movie"]}) == "1"
+
+
+def test_single_result_match(library):
+    assert match(library, {"title": "Amelie", "release_year": "2000", "media_type": ["Movie"]}) == "3"
+    assert match(library, {"title": "Le Fabuleux Destin d'Amélie Poulain", "release_year": None, "media_type": ["Movie"]}, year_filter=False) == "3"
+    assert match(library, {"title": "The Matrix", "release_year": "1980", "media_type": ["Movie"]}) is None
+
+
+def test_type_filter(library):
+    assert match(library, {"title": "Dark", "release_year": "2017", "media_type": ["Program", "Series"]}) == "4"
+    assert match(library, {"title": "Dark", "release_year": "2017", "media_type": ["Movie"]}) is None
+
+
+def test_search_like_jellyfin():
+    index = LibraryIndex()
+    for jf_item in [
+        {"Id": "1", "Name": "Aliens", "Type": "Movie", "ProductionYear": 1986},
+        {"Id": "2", "Name": "Alien", "Type": "Movie", "ProductionYear": 1979},
+        {"Id": "3", "Name": "Alien³", "Type": "Movie", "ProductionYear": 1992},
+        {"Id": "4", "Name": "Resurrection: Alien", "Type": "Movie", "ProductionYear": 1997},
+        {"Id": "5", "Name": "Dr. Strangelove or: How I Learned to Stop Worrying and Love the Bomb", "Type": "Movie", "ProductionYear": 1964},
+        {"Id": "6", "Name": "The Office", "Type": "Series", "ProductionYear": 2005},
+        {"Id": "7", "Name": "The Office", "Type": "Program", "ProductionYear": 2005},
+    ]:
+        index.add(jf_item)
+
+    # Names containing the title, exact matches first, then names starting with it
+    assert [jf_item["Id"] for jf_item in index.search("alien")] == ["2", "1", "3", "4"]
+    assert [jf_item["Id"] for jf_item in index.search("Dr. Strangelove")] == ["5"]
+    assert [jf_item["Id"] for jf_item in index.search("learned to stop")] == ["5"]
+    assert [jf_item["Id"] for jf_item in index.search("trangelove or how")] == ["5"]
+    assert index.search("strange love") == []
+
+    # Partial titles can match, and several results keep the single-result rule from matching
+    assert match(index, {"title": "Dr. Strangelove", "release_year": "1963", "media_type": ["Movie"]}) == "5"
+    assert match(index, {"title": "Alien", "release_year": "1980", "media_type": ["Movie"]}) is None
+    assert match(index, {"title": "Office", "release_year": "2005", "media_type": ["Program", "Series"]}) == "6"
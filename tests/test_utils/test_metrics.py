@@ -0,0 +1,21 @@
+from utils import metrics
+
+
+def test_run_metrics():
+    run_metrics = metrics.RunMetrics()
+    with run_metrics.list_context("1/1 tspdt:1000-greatest-films"):
+        for _ in metrics.timed_iter([1, 2, 3], "scrape"):
+            with metrics.stage("match"):
+                metrics.count("match_cache_hits")
+        metrics.count("match_cache_misses")
+    metrics.count("items")  # Outside of a list - ignored
+    run_metrics.finish()
+
+    summary = run_metrics.summary()["lists"]["1/1 tspdt:1000-greatest-films"]
+    assert set(summary["stages"]) == {"scrape", "match"}
+    assert summary["counters"] == {"match_cache_hits": 3, "match_cache_misses": 1}
+    assert summary["cache_hit_rates"] == {"match_cache": 0.75}
+
+    text = run_metrics.to_prometheus()
+    assert 'jellyfin_auto_playlists_stage_seconds{list="1/1 tspdt:1000-greatest-films",stage="match"}' in text
+    assert 'jellyfin_auto_playlists_list_events{list="1/1 tspdt:1000-greatest-films",event="match_cache_hits"} 3' in text
@@ -0,0 +1,36 @@
+import bs4
+from utils import parsing
+
+PAGE = """<html><head><title>Top 250</title>
+<script type="application/ld+json">{"name": "My list"}</script>
+<script id='__NEXT_DATA__' type="application/json">{"props": {"page": 1}}</script>
+</head><body>
+<h1 class="title-1 prettify">My list</h1>
+<div class="ui form"><h3>Name</h3><div class="fourteen wide field"><p>First</p><p>Second</p></div></div>
+<div class="ui"><p>Not this one</p></div>
+<table><tr><th>Title</th></tr><tr><td>Alien</td></tr><tr><td>Heat</td></tr></table>
+</body></html>"""
+
+
+def test_find_script():
+    assert parsing.script_json(PAGE, id="__NEXT_DATA__") == {"props": {"page": 1}}
+    assert parsing.script_json(PAGE, type="application/ld+json") == {"name": "My list"}
+    assert parsing.find_script(PAGE, id="missing") is None
+
+
+def test_parse_only():
+    soup = parsing.parse(PAGE, ("div", "ui form"), "tr")
+    assert [p.text for p in soup.find("div", class_="ui form").find_all("p")] == ["First", "Second"]
+    assert soup.find("h1") is None
+    assert [row.text for row in soup.find_all("tr")[1:]] == ["Alien", "Heat"]
+
+    soup = parsing.parse(PAGE, (None, "prettify"))
+    assert soup.find("h1", {"class": "title-1 prettify"}).text == "My list"
+
+
+def test_parse_matches_full_tree():
+    assert parsing.parse(PAGE).find("table").text == bs4.BeautifulSoup(PAGE, "html.parser").find("table").text
+
+
+def test_table_rows():
+    assert parsing.table_rows(PAGE) == [[], ["Alien"], ["Heat"]]
@@ -0,0 +1,48 @@
+import random
+import pytest
+from utils.playlist_sync import plan_playlist_changes, plan_playlist_moves
+
+
+def apply_sync(current, wanted):
+    '''Simulates the Jellyfin playlist endpoints for a planned sync'''
+    to_remove, to_add = plan_playlist_changes(current, wanted)
+    entries = [e for e in current if e[0] not in set(to_remove)]
+    entries += [(f"new-{i}", item_id) for i, item_id in enumerate(to_add)]
+    moves = plan_playlist_moves(entries, wanted)
+    for entry_id, new_index in moves:
+        entry = next(e for e in entries if e[0] == entry_id)
+        entries.remove(entry)
+        entries.insert(new_index, entry)
+    return entries, to_remove, to_add, moves
+
+
+def test_unchanged_playlist():
+    current = [(f"e{i}", f"i{i}") for i in range(10)]
+    _, to_remove, to_add, moves = apply_sync(current, [f"i{i}" for i in range(10)])
+    assert (to_remove, to_add, moves) == ([], [], [])
+
+
+def test_single_move():
+    current = [("e1", "d"), ("e2", "a"), ("e3", "b"), ("e4", "c")]
+    entries, _, _, moves = apply_sync(current, ["a", "b", "c", "d"])
+    assert [item_id for _, item_id in entries] == ["a", "b", "c", "d"]
+    assert moves == [("e1", 3)]
+
+
+def test_add_and_remove():
+    current = [("e1", "a"), ("e2", "x"), ("e3", "c")]
+    entries, to_remove, to_add, moves = apply_sync(current, ["a", "b", "c"])
+    assert to_remove == ["e2"]
+    assert to_add == ["b"]
+    assert [item_id for _, item_id in entries] == ["a", "b", "c"]
+    assert len(moves) == 1
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_sync(seed):
+    rng = random.Random(seed)
+    pool = [f"i{i}" for i in range(30)]
+    current = [(f"e{i}", rng.choice(pool)) for i in range(rng.randint(0, 40))]
+    wanted = [rng.choice(pool) for _ in range(rng.randint(1, 40))]
+    entries, _, _, _ = apply_sync(current, wanted)
+    assert [item_id for _, item_id in entries] == wanted
@@ -3,6 +3,36 @@ import pluginlib
 @pluginlib.Parent('list_scraper')
 class ListScraper(object):
 
+    # Hours a scraped list is reused for before its pages are checked for changes.
+    # Overridden by the plugin's cache_ttl_hours setting. None disables the scrape cache for the plugin.
+    _cache_ttl_hours = 0
+
+    # Whether an expired list is reused if its pages answer a conditional GET with 304 Not Modified.
+    # Off for plugins whose requests need credentials, which aren't stored with the cached list.
+    _revalidate = True
+
+    # Websites the plugin scrapes (subdomains included), and the default number of requests per
+    # second to each of them. Overridden by the plugin's rate_limit and rate_limit_burst settings.
+    _hosts = []
+    _rate_limit = None
+
     @pluginlib.abstractmethod
     def get_list(list_id, config=None):
         pass
+
+    @classmethod
+    def start_run(cls):
+        '''Called at the start of every run, before any lists are scraped. Plugins which share
+        downloads between their lists reset them here.'''
+        pass
+
+    @classmethod
+    def iter_list(cls, list_id, config=None):
+        '''Streaming version of get_list. Returns the same dictionary, but "items" may be a generator
+        which yields items as pages arrive. Plugins which don't override this are adapted from get_list.'''
+        return cls.get_list(list_id, config)
+
+
+def collect_list(list_info):
+    '''Turns the result of iter_list into a get_list result, by reading all of its items'''
+    return {**list_info, "items": list(list_info["items"])}
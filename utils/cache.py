@@ -0,0 +1,414 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from loguru import logger
+from PIL import Image
+from . import http, metrics
+
+
+def get_cache_dir(config) -> str:
+    '''Returns the directory used for persistent caches, creating it if needed'''
+    cache_dir = config["cache_dir"]
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    return cache_dir
+
+
+class SqliteStore:
+    '''Small thread-safe wrapper around a sqlite database file'''
+
+    schema = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);" + self.schema
+            )
+
+    def execute(self, sql: str, params=()) -> list:
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get_meta(self, key: str, default=None):
+        rows = self.execute("SELECT value FROM meta WHERE key = ?", (key,))
+        return json.loads(rows[0][0]) if rows else default
+
+    def set_meta(self, key: str, value):
+        self.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+
+class MatchCache(SqliteStore):
+    '''Persistent list item -> Jellyfin id resolutions, including misses'''
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS matches (
+            title TEXT NOT NULL,
+            year TEXT NOT NULL,
+            imdb_id TEXT NOT NULL,
+            media_type TEXT NOT NULL,
+            context TEXT NOT NULL,
+            item TEXT NOT NULL,
+            jellyfin_id TEXT,
+            checked_at REAL NOT NULL,
+            PRIMARY KEY (title, year, imdb_id, media_type, context)
+        );
+    """
+
+    def __init__(self, path: str, max_age_days: float = None, miss_max_age_days: float = 7):
+        super().__init__(path)
+        self.max_age = max_age_days * 86400 if max_age_days else None
+        self.miss_max_age = miss_max_age_days * 86400 if miss_max_age_days else None
+        if self.max_age is not None and (self.miss_max_age is None or self.max_age < self.miss_max_age):
+            self.miss_max_age = self.max_age
+
+    @staticmethod
+    def context(year_filter: bool, jellyfin_query_parameters: dict) -> str:
+        '''Matching settings which change the outcome of a match'''
+        return json.dumps({"year_filter": year_filter, "query_parameters": jellyfin_query_parameters}, sort_keys=True)
+
+    @staticmethod
+    def _key(item, context: str) -> tuple:
+        return (
+            str(item["title"]),
+            str(item.get("release_year") or ""),
+            str(item.get("imdb_id") or ""),
+            json.dumps(item["media_type"]),
+            context
+        )
+
+    def get(self, item, context: str):
+        '''Returns {"jellyfin_id": ...} for a cached resolution (id is None for a cached miss), or None if not cached'''
+        rows = self.execute(
+            "SELECT jellyfin_id, checked_at FROM matches WHERE title = ? AND year = ? AND imdb_id = ? AND media_type = ? AND context = ?",
+            self._key(item, context)
+        )
+        if not rows:
+            return None
+        jellyfin_id, checked_at = rows[0]
+        max_age = self.max_age if jellyfin_id is not None else self.miss_max_age
+        if max_age is not None and time.time() - checked_at > max_age:
+            return None
+        return {"jellyfin_id": jellyfin_id}
+
+    def put(self, item, context: str, jellyfin_id):
+        self.execute(
+            "INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            self._key(item, context) + (json.dumps(item), jellyfin_id, time.time())
+        )
+
+    def misses(self) -> list:
+        '''Returns (item, context) for every cached miss'''
+        rows = self.execute("SELECT item, context FROM matches WHERE jellyfin_id IS NULL")
+        return [(json.loads(item), context) for item, context in rows]
+
+    def clear_hits(self):
+        self.execute("DELETE FROM matches WHERE jellyfin_id IS NOT NULL")
+
+
+class ScrapeCache(SqliteStore):
+    '''Parsed plugin results, reused while they are fresh or while the source pages haven't changed'''
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS scrapes (
+            plugin TEXT NOT NULL,
+            list_key TEXT NOT NULL,
+            result TEXT NOT NULL,
+            validators TEXT,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (plugin, list_key)
+        );
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        # Validators stored by older versions could hold credentials in their urls
+        for plugin_name, list_key, validators in self.execute("SELECT plugin, list_key, validators FROM scrapes WHERE validators IS NOT NULL"):
+            if any(http.has_secrets(validator["url"]) for validator in json.loads(validators)):
+                self.execute("UPDATE scrapes SET validators = NULL WHERE plugin = ? AND list_key = ?", (plugin_name, list_key))
+
+    @staticmethod
+    def list_key(list_id, plugin_config: dict) -> str:
+        '''Identifies a list together with the plugin settings which could change its items'''
+        settings = {k: v for k, v in plugin_config.items() if k not in ("list_ids", "enabled")}
+        return hashlib.sha1(json.dumps([list_id, settings], sort_keys=True, default=str).encode()).hexdigest()
+
+    def iter_list(self, plugin, plugin_name: str, list_id, plugin_config: dict):
+        '''Same as plugin.iter_list, but reusing the previous result if it is within the plugin's cache_ttl_hours,
+        or if every page it was parsed from answers a conditional GET with 304 Not Modified'''
+        ttl_hours = plugin_config.get("cache_ttl_hours", plugin._cache_ttl_hours)
+        if ttl_hours is None:
+            return plugin.iter_list(list_id, plugin_config)
+
+        list_key = self.list_key(list_id, plugin_config)
+        rows = self.execute("SELECT result, validators, fetched_at FROM scrapes WHERE plugin = ? AND list_key = ?", (plugin_name, list_key))
+        if rows:
+            result, validators, fetched_at = rows[0]
+            if time.time() - fetched_at < ttl_hours * 3600:
+                logger.info(f"Using cached list from {time.ctime(fetched_at)}")
+                metrics.count("scrape_cache_hits")
+                return json.loads(result)
+            if validators is not None and plugin._revalidate and self._not_modified(json.loads(validators)):
+                logger.info("List source not modified - using cached list")
+                self.execute("UPDATE scrapes SET fetched_at = ? WHERE plugin = ? AND list_key = ?", (time.time(), plugin_name, list_key))
+                metrics.count("scrape_cache_hits")
+                return json.loads(result)
+
+        metrics.count("scrape_cache_misses")
+
+        responses = []
+        with http.record_responses(responses):
+            list_info = plugin.iter_list(list_id, plugin_config)
+        return {**list_info, "items": self._store_when_read(plugin_name, list_key, list_info, responses, plugin._revalidate)}
+
+    def _store_when_read(self, plugin_name: str, list_key: str, list_info: dict, responses: list, revalidate: bool = True):
+        '''Hands out the plugin's items, and stores the result once they have all been read'''
+        items = []
+        source = iter(list_info["items"])
+        while True:
+            # Only record the plugin's own requests, not those made while the items are processed
+            with http.record_responses(responses):
+                try:
+                    item = next(source)
+                except StopIteration:
+                    break
+            items.append(dict(item))
+            yield item
+
+        downloaded = [r for r in responses if r["method"] == "GET" and not r["from_cache"]]
+        if any(r["status_code"] >= 400 for r in downloaded):
+            return
+
+        # Pages can only be revalidated if they all sent an ETag or Last-Modified header, and
+        # didn't need credentials - those aren't stored
+        validators = None
+        if revalidate and downloaded and all((r["etag"] or r["last_modified"]) and not r["authenticated"] for r in downloaded):
+            validators = json.dumps([{k: r[k] for k in ("url", "etag", "last_modified", "headers")} for r in downloaded])
+        result = json.dumps({**list_info, "items": items})
+        self.execute("INSERT OR REPLACE INTO scrapes VALUES (?, ?, ?, ?, ?)", (plugin_name, list_key, result, validators, time.time()))
+
+    def _not_modified(self, validators: list) -> bool:
+        for validator in validators:
+            headers = dict(validator.get("headers") or {})
+            if validator["etag"]:
+                headers["If-None-Match"] = validator["etag"]
+            if validator["last_modified"]:
+                headers["If-Modified-Since"] = validator["last_modified"]
+            r = http.get(validator["url"], headers=headers)
+            if r.status_code != 304:
+                logger.debug(f"{validator['url']} has changed ({r.status_code})")
+                return False
+        return True
+
+
+class ListFingerprints(SqliteStore):
+    '''Fingerprint of every list as it was last synced, so unchanged lists can be skipped'''
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS fingerprints (
+            plugin TEXT NOT NULL,
+            list_id TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            synced_at REAL NOT NULL,
+            PRIMARY KEY (plugin, list_id)
+        );
+    """
+
+    @staticmethod
+    def fingerprint(items: list, *settings) -> str:
+        '''Hash of the ordered items together with anything else which changes the synced playlist'''
+        return hashlib.sha1(json.dumps([items, settings], sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, plugin_name: str, list_id):
+        rows = self.execute("SELECT fingerprint FROM fingerprints WHERE plugin = ? AND list_id = ?", (plugin_name, json.dumps(list_id, sort_keys=True)))
+        return rows[0][0] if rows else None
+
+    def put(self, plugin_name: str, list_id, fingerprint: str):
+        self.execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)", (plugin_name, json.dumps(list_id, sort_keys=True), fingerprint, time.time()))
+
+
+class JellyseerrCache(SqliteStore):
+    '''Jellyseerr search results, the media they resolved to and the requests made for them'''
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS searches (
+            query TEXT PRIMARY KEY,
+            results TEXT NOT NULL,
+            searched_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS media (
+            provider TEXT NOT NULL,
+            provider_id TEXT NOT NULL,
+            media_type TEXT NOT NULL,
+            media_id INTEGER NOT NULL,
+            PRIMARY KEY (provider, provider_id)
+        );
+        CREATE TABLE IF NOT EXISTS requests (
+            media_type TEXT NOT NULL,
+            media_id INTEGER NOT NULL,
+            request_id INTEGER,
+            requested_at REAL NOT NULL,
+            PRIMARY KEY (media_type, media_id)
+        );
+    """
+
+    def __init__(self, path: str, search_max_age_hours: float = 24, request_max_age_days: float = 7):
+        super().__init__(path)
+        self.search_max_age = search_max_age_hours * 3600 if search_max_age_hours else 0
+        self.request_max_age = request_max_age_days * 86400 if request_max_age_days else 0
+
+    def get_search(self, query: str):
+        '''Returns the cached results of a search, or None if it isn't cached or is too old'''
+        rows = self.execute("SELECT results, searched_at FROM searches WHERE query = ?", (query,))
+        if not rows or time.time() - rows[0][1] > self.search_max_age:
+            metrics.count("jellyseerr_search_cache_misses")
+            return None
+        metrics.count("jellyseerr_search_cache_hits")
+        return json.loads(rows[0][0])
+
+    def put_search(self, query: str, results: list):
+        self.execute("INSERT OR REPLACE INTO searches VALUES (?, ?, ?)", (query, json.dumps(results), time.time()))
+
+    def get_media(self, provider: str, provider_id: str):
+        '''Returns (media_type, media_id) of a previously resolved imdb or tmdb id, or None'''
+        rows = self.execute("SELECT media_type, media_id FROM media WHERE provider = ? AND provider_id = ?", (provider, str(provider_id)))
+        return tuple(rows[0]) if rows else None
+
+    def put_media(self, provider: str, provider_id: str, media: tuple):
+        self.execute("INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?)", (provider, str(provider_id)) + tuple(media))
+
+    def is_requested(self, media: tuple) -> bool:
+        '''Whether the media was requested recently. Older requests are checked again, as they could have been declined or deleted'''
+        rows = self.execute("SELECT requested_at FROM requests WHERE media_type = ? AND media_id = ?", tuple(media))
+        return bool(rows) and time.time() - rows[0][0] <= self.request_max_age
+
+    def put_request(self, media: tuple, request_id=None):
+        self.execute("INSERT OR REPLACE INTO requests VALUES (?, ?, ?, ?)", tuple(media) + (request_id, time.time()))
+
+
+class PosterCache(SqliteStore):
+    '''Hashes of the generated playlist posters, and the fitted posters they were built from'''
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS posters (
+            playlist_id TEXT PRIMARY KEY,
+            poster_hash TEXT NOT NULL,
+            generated_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path: str, cell_dir: str):
+        super().__init__(path)
+        self.cell_dir = cell_dir
+        if not os.path.exists(cell_dir):
+            os.makedirs(cell_dir)
+
+    @staticmethod
+    def poster_hash(playlist_name: str, poster_keys: list) -> str:
+        '''Changes when the title or any of the item images used in the poster change'''
+        return hashlib.sha1(json.dumps([playlist_name, poster_keys]).encode()).hexdigest()
+
+    def get_hash(self, playlist_id: str):
+        rows = self.execute("SELECT poster_hash FROM posters WHERE playlist_id = ?", (playlist_id,))
+        return rows[0][0] if rows else None
+
+    def put_hash(self, playlist_id: str, poster_hash: str):
+        self.execute("INSERT OR REPLACE INTO posters VALUES (?, ?, ?)", (playlist_id, poster_hash, time.time()))
+
+    def _cell_path(self, poster_key: str, size: tuple) -> str:
+        return os.path.join(self.cell_dir, hashlib.sha1(json.dumps([poster_key, list(size)]).encode()).hexdigest() + ".jpg")
+
+    def get_cell(self, poster_key: str, size: tuple):
+        '''Returns the poster of an item image fitted to size, or None if it isn't cached'''
+        path = self._cell_path(poster_key, size)
+        try:
+            # Cells in use are kept by evict_cells
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        with Image.open(path) as cell:
+            return cell.convert("RGB")
+
+    def put_cell(self, poster_key: str, size: tuple, cell):
+        path = self._cell_path(poster_key, size)
+        # Write to a temporary file first, so a concurrent reader never sees half a file
+        cell.save(path + f".{threading.get_ident()}.tmp", format="JPEG", quality=95)
+        os.replace(path + f".{threading.get_ident()}.tmp", path)
+
+    def evict_cells(self, max_age_days: float) -> int:
+        '''Deletes the cells which haven't been used for max_age_days. Returns the number deleted'''
+        evicted = 0
+        for entry in os.scandir(self.cell_dir):
+            try:
+                if time.time() - entry.stat().st_mtime > max_age_days * 86400:
+                    os.remove(entry.path)
+                    evicted += 1
+            except FileNotFoundError:
+                pass
+        return evicted
+
+
+class MetadataStore(SqliteStore):
+    '''IMDb id, title, release year and type of titles, by their id on the site a plugin found them on.
+
+    Details looked up on the site itself are authoritative and replace what is stored. Details which other
+    plugins contributed (e.g. a Trakt list item stored under its IMDb id) never replace anything - they
+    only fill in fields which are missing.'''
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS titles (
+            source TEXT NOT NULL,
+            source_id TEXT NOT NULL,
+            imdb_id TEXT,
+            title TEXT NOT NULL,
+            release_year,
+            media_type TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            authoritative INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (source, source_id)
+        );
+    """
+
+    def __init__(self, path: str, max_age_days: float = None):
+        super().__init__(path)
+        self.max_age = max_age_days * 86400 if max_age_days else None
+        # Stores from before contributed details were told apart - their origin is unknown
+        if "authoritative" not in [column[1] for column in self.execute("PRAGMA table_info(titles)")]:
+            self.execute("ALTER TABLE titles ADD COLUMN authoritative INTEGER NOT NULL DEFAULT 0")
+
+    def get(self, source: str, source_id: str, authoritative: bool = False):
+        '''Returns {"title", "release_year", "media_type", "imdb_id"} of a title, or None if it isn't stored or is too old.
+        With authoritative, details which other plugins contributed are ignored.'''
+        rows = self.execute(
+            "SELECT title, release_year, media_type, imdb_id, fetched_at, authoritative FROM titles WHERE source = ? AND source_id = ?",
+            (source, str(source_id))
+        )
+        if not rows or (self.max_age is not None and time.time() - rows[0][4] > self.max_age) or (authoritative and not rows[0][5]):
+            metrics.count("metadata_misses")
+            return None
+        metrics.count("metadata_hits")
+        return dict(zip(("title", "release_year", "media_type", "imdb_id"), rows[0][:4]))
+
+    @staticmethod
+    def _row(source: str, source_id: str, title: dict, authoritative: bool) -> tuple:
+        return (source, str(source_id), title.get("imdb_id"), title["title"], title.get("release_year"), title["media_type"], time.time(), int(authoritative))
+
+    def put(self, source: str, source_id: str, title: dict):
+        '''Stores details looked up on the title's own site'''
+        self.execute("INSERT OR REPLACE INTO titles VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self._row(source, source_id, title, True))
+
+    def add_many(self, titles: list):
+        '''Stores the (source, source_id, title) which other plugins contributed, in one transaction. Stored titles
+        only get their missing IMDb id and release year filled in'''
+        rows = [self._row(*title, False) for title in titles]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE titles SET imdb_id = COALESCE(imdb_id, ?), release_year = COALESCE(release_year, ?) WHERE source = ? AND source_id = ?",
+                [(row[2], row[4], row[0], row[1]) for row in rows]
+            )
+            self._conn.executemany("INSERT OR IGNORE INTO titles VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
@@ -0,0 +1,308 @@
+import threading
+import time
+import json
+import email.utils
+import contextvars
+import urllib.parse
+from datetime import datetime, timezone
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from loguru import logger
+from . import metrics
+
+# Connection pool, timeout and retry settings for all sessions - see configure()
+_settings = {
+    "pool_size": 10,          # Kept-alive connections per host
+    "timeout": 60,            # Seconds, unless a request sets its own timeout
+    "retries": 3,             # Retries for connection errors and 429/5xx responses on idempotent requests
+    "backoff_factor": 0.5,    # Seconds, doubled on every retry
+}
+_shared_session = None
+_shared_session_lock = threading.Lock()
+
+# Maximum number of in-flight requests per host, e.g. {"imdb.com": 4}. Also applies to subdomains.
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+
+# Maximum number of requests per second per host. Also applies to subdomains.
+_rate_limits = {}
+
+# Responses received while a scrape is being recorded - see record_responses()
+_recorded_responses = contextvars.ContextVar("recorded_responses", default=None)
+
+# Request headers which are recorded, so a page can be requested again the same way. Anything
+# else (e.g. authentication) is left out of recordings.
+_recorded_headers = ("User-Agent", "Accept", "Accept-Language")
+
+# Query parameters which hold credentials
+_secret_params = {"apikey", "api_key", "token", "access_token", "client_secret", "password"}
+
+
+def has_secrets(url: str) -> bool:
+    '''Whether a url has credentials in its query string'''
+    query = urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query)
+    return any(key.lower() in _secret_params for key, _ in query)
+
+
+def configure(http_config: dict = None):
+    '''Apply the `http` section of the config. Sessions created afterwards use the new settings.'''
+    global _shared_session
+    for key, value in (http_config or {}).items():
+        if key not in _settings:
+            raise ValueError(f"Unknown http setting: {key}")
+        _settings[key] = value
+    with _shared_session_lock:
+        _shared_session = None
+
+
+def set_host_limit(host: str, limit: int):
+    '''Limit the number of concurrent requests to a host (and its subdomains)'''
+    with _host_limits_lock:
+        _host_limits[host.lower()] = threading.BoundedSemaphore(int(limit))
+
+
+class RateLimiter:
+    '''Token bucket which starts at most `per_second` requests per second, in bursts of up to `burst`.
+
+    When a host signals it is overloaded, requests are paused and the rate is halved. The rate
+    then recovers gradually with every successful request. Without a per_second limit, requests
+    are only held back while the host asks us to wait.'''
+
+    def __init__(self, per_second: float = None, burst: int = 1):
+        self.per_second = float(per_second) if per_second else None
+        self.burst = max(1, int(burst))
+        self.rate = self.per_second
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def reserve(self) -> float:
+        '''Takes a request slot and returns 0 if one is free, otherwise the seconds to wait before trying again'''
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self.rate is None:
+                return 0.0
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def wait(self):
+        while (delay := self.reserve()) > 0:
+            time.sleep(delay)
+
+    def backoff(self, delay: float, slow_down: bool = True):
+        '''Hold back all requests for delay seconds, and halve the rate if slow_down is set'''
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            if slow_down and self.rate is not None:
+                self.rate = max(self.per_second / 16, self.rate / 2)
+
+    def success(self):
+        '''Speed back up towards per_second after a successful request'''
+        if self.rate is not None and self.rate < self.per_second:
+            with self._lock:
+                self.rate = min(self.per_second, self.rate + self.per_second / 10)
+
+
+def set_host_rate_limit(host: str, per_second: float, burst: int = 1):
+    '''Limit the number of requests per second to a host (and its subdomains)'''
+    with _host_limits_lock:
+        limiter = _rate_limits.get(host.lower())
+        if limiter is None or limiter.per_second != float(per_second) or limiter.burst != max(1, int(burst)):
+            _rate_limits[host.lower()] = RateLimiter(per_second, burst)
+
+
+def _get_rate_limiter(url: str) -> RateLimiter:
+    '''The rate limiter of the url's host. Hosts without a configured limit get one which only backs off.'''
+    limiter = _match_host(url, _rate_limits)
+    if limiter is None:
+        host = (urllib.parse.urlsplit(url).hostname or "").lower()
+        with _host_limits_lock:
+            limiter = _rate_limits.setdefault(host, RateLimiter())
+    return limiter
+
+
+def _requested_delay(response):
+    '''Seconds the server asked us to wait before the next request, from Retry-After or Trakt's X-Ratelimit header'''
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, (email.utils.parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+
+    rate_limit = response.headers.get("X-Ratelimit")
+    if rate_limit:
+        try:
+            rate_limit = json.loads(rate_limit)
+            if int(rate_limit["remaining"]) <= 0:
+                until = datetime.fromisoformat(rate_limit["until"].replace("Z", "+00:00"))
+                return max(0.0, (until - datetime.now(timezone.utc)).total_seconds())
+        except (ValueError, KeyError, TypeError, AttributeError):
+            pass
+    return None
+
+
+# Statuses which are retried, and the ones of those which mean we're sending too many requests
+retry_statuses = {429, 500, 502, 503, 504}
+throttle_statuses = {429, 503}
+
+
+def handle_response(url: str, status_code: int, response, attempt: int = 0):
+    '''Lets the rate limiter of the url's host react to a response. Returns None if the response is final,
+    otherwise the seconds to wait before retrying the request. Also used by the asyncio Jellyfin client,
+    so response only needs headers.'''
+    limiter = _get_rate_limiter(url)
+    delay = _requested_delay(response)
+    if status_code not in retry_statuses:
+        if delay is not None:
+            # e.g. the request quota is used up until the given time
+            logger.debug(f"{urllib.parse.urlsplit(url).hostname} asked to pause requests for {delay:.1f}s")
+            limiter.backoff(delay, slow_down=False)
+        limiter.success()
+        return None
+
+    if delay is None:
+        delay = float(_settings["backoff_factor"]) * 2 ** attempt
+    limiter.backoff(delay, slow_down=status_code in throttle_statuses)
+    return delay
+
+
+def _match_host(url: str, limits: dict):
+    host = (urllib.parse.urlsplit(url).hostname or "").lower()
+    with _host_limits_lock:
+        for limited_host, limit in limits.items():
+            if host == limited_host or host.endswith("." + limited_host):
+                return limit
+    return None
+
+
+@contextmanager
+def host_slot(url: str):
+    '''Waits for a free request slot for the url's host'''
+    semaphore = _match_host(url, _host_limits)
+    rate_limiter = _match_host(url, _rate_limits)
+    if semaphore is None:
+        if rate_limiter is not None:
+            rate_limiter.wait()
+        yield
+        return
+    with semaphore:
+        if rate_limiter is not None:
+            rate_limiter.wait()
+        yield
+
+
+class HostLimitedAdapter(HTTPAdapter):
+    '''Pooled transport adapter which applies the default timeout and the per-host concurrency and rate limits.
+
+    429/5xx responses to idempotent requests are retried here rather than by urllib3, so the host's
+    rate limiter backs off for every request to that host, not just the one that was refused.'''
+
+    def __init__(self):
+        # urllib3 only retries connection errors
+        retry = Retry(
+            total=int(_settings["retries"]),
+            backoff_factor=float(_settings["backoff_factor"]),
+            status_forcelist=[],
+            raise_on_status=False,
+        )
+        super().__init__(pool_connections=32, pool_maxsize=int(_settings["pool_size"]), max_retries=retry)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = _settings["timeout"]
+        retries = int(_settings["retries"]) if request.method in Retry.DEFAULT_ALLOWED_METHODS else 0
+
+        for attempt in range(retries + 1):
+            with host_slot(request.url):
+                response = super().send(request, timeout=timeout, **kwargs)
+
+            delay = handle_response(request.url, response.status_code, response, attempt)
+            if delay is None:
+                return response
+            if attempt < retries:
+                logger.debug(f"{request.method} {request.url} returned {response.status_code} - retrying in {delay:.1f}s")
+                response.close()
+        return response
+
+
+@contextmanager
+def record_responses(responses: list):
+    '''Appends a summary of every response received in this context to responses. Threads started
+    with utils.log.with_log_context from within this context are recorded too.'''
+    token = _recorded_responses.set(responses)
+    try:
+        yield responses
+    finally:
+        _recorded_responses.reset(token)
+
+
+def _record_response(response, *args, **kwargs):
+    responses = _recorded_responses.get()
+    if responses is not None:
+        responses.append({
+            "method": response.request.method,
+            "url": response.url,
+            "status_code": response.status_code,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "from_cache": getattr(response, "from_cache", False),
+            "headers": {k: response.request.headers[k] for k in _recorded_headers if k in response.request.headers},
+            "authenticated": "Authorization" in response.request.headers or has_secrets(response.url),
+        })
+
+
+def mount(session: requests.Session) -> requests.Session:
+    '''Route a session's requests through a pooled adapter with the per-host limits'''
+    session.mount("http://", HostLimitedAdapter())
+    session.mount("https://", HostLimitedAdapter())
+    session.hooks["response"].append(_record_response)
+    session.hooks["response"].append(metrics.record_response)
+    return session
+
+
+def create_session(headers: dict = None) -> requests.Session:
+    '''Returns a new pooled session, optionally with default headers (e.g. for authentication)'''
+    session = mount(requests.Session())
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def get_session() -> requests.Session:
+    '''Returns the session shared by everything which doesn't need its own default headers'''
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = create_session()
+        return _shared_session
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    '''Same as requests.request, but over the shared pooled session'''
+    return get_session().request(method=method, url=url, **kwargs)
+
+
+def get(url: str, params=None, **kwargs) -> requests.Response:
+    return request("get", url, params=params, **kwargs)
+
+
+def post(url: str, data=None, json=None, **kwargs) -> requests.Response:
+    return request("post", url, data=data, json=json, **kwargs)
+
+
+def delete(url: str, **kwargs) -> requests.Response:
+    return request("delete", url, **kwargs)
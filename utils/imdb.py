@@ -0,0 +1,56 @@
+import concurrent.futures
+from loguru import logger
+from . import http, metadata, parsing
+from .log import with_log_context
+
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:145.0) Gecko/20100101 Firefox/145.0', 'Accept-Language': 'en-US'}
+
+def parse_title_page(html: str, imdb_id: str) -> dict:
+    '''Returns the title, release year and title type from an IMDb title page'''
+    next_data = parsing.script_json(html, id='__NEXT_DATA__')
+    if next_data is not None:
+        data = next_data["props"]["pageProps"]["aboveTheFoldData"]
+        return {
+            "title": data["titleText"]["text"],
+            "release_year": data["releaseYear"]["year"] if data.get("releaseYear") else None,
+            "media_type": data["titleType"]["id"],
+            "imdb_id": data.get("id", imdb_id),
+        }
+
+    # Older layout - only the structured data
+    data = parsing.script_json(html, type="application/ld+json")
+    return {
+        "title": data["name"],
+        "release_year": data["datePublished"].split("-")[0] if data.get("datePublished") else None,
+        "media_type": data["@type"],
+        "imdb_id": imdb_id,
+    }
+
+
+def fetch_title(imdb_id: str):
+    '''Title details from the title page of an IMDb id. None if they can't be fetched'''
+    try:
+        r = http.get(f'https://www.imdb.com/title/{imdb_id}/', headers=HEADERS)
+        r.raise_for_status()
+        return parse_title_page(r.text, imdb_id)
+    except Exception as e:
+        logger.error(f"Error fetching details for IMDb title {imdb_id}: {e}")
+        return None
+
+
+def get_title(imdb_id: str, authoritative: bool = True):
+    '''Title details of an IMDb id, from the metadata store or its title page. None if they can't be fetched.
+    Without authoritative, titles which other plugins' lists held aren't looked up again - their title
+    and type can differ from IMDb's, but the release year can be used.'''
+    return metadata.resolve("imdb", imdb_id, lambda: fetch_title(imdb_id), authoritative)
+
+
+def get_titles(imdb_ids: list, workers: int = 8, authoritative: bool = True) -> list:
+    '''get_title for every id, fetching up to workers title pages at the same time. Keeps the order of imdb_ids'''
+    # Lists can hold the same title more than once
+    unique_ids = list(dict.fromkeys(imdb_ids))
+    if not unique_ids:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        titles = dict(zip(unique_ids, executor.map(with_log_context(lambda imdb_id: get_title(imdb_id, authoritative)), unique_ids)))
+    return [titles[imdb_id] for imdb_id in imdb_ids]
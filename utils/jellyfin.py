@@ -1,13 +1,32 @@
 import requests
+from . import http, metrics
+from .log import with_log_context
 from loguru import logger
 from base64 import b64encode
 import json
+import re
 import concurrent.futures
+import threading
 import unicodedata
-from .poster_generation import fetch_collection_posters, safe_download, create_mosaic, get_font
+from datetime import datetime, timedelta, timezone
+from .poster_generation import fetch_collection_posters, safe_download, render_mosaic, encode_jpeg, get_font, mosaic_cell_size, resized_image_url, fit_poster
+from .library_index import LibraryIndex
+from .cache import MatchCache, PosterCache
+from .playlist_sync import sync_steps
 
 
-class JellyfinClient:
+def parse_jellyfin_date(value: str) -> datetime:
+    '''Parses a Jellyfin timestamp (which can have 7 digit fractional seconds) into an aware datetime'''
+    match = re.match(r"(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?", value)
+    # Python 3.10 only parses fractions with exactly 3 or 6 digits
+    fraction = (match.group(2) or "")[:6].ljust(6, "0")
+    return datetime.fromisoformat(f"{match.group(1)}.{fraction}").replace(tzinfo=timezone.utc)
+
+
+class JellyfinMatcher:
+    '''Request parameters and match logic shared by JellyfinClient and the asyncio AsyncJellyfinClient.
+
+    Subclasses make the requests - this decides what to request, and how results match list items.'''
 
     imdb_to_jellyfin_type_map = {
         "movie": ["Movie"],
@@ -21,19 +40,169 @@ class JellyfinClient:
         "show": ["Program", "Series"],
     }
 
-    def __init__(self, server_url: str, api_key: str, user_id: str):
+    def __init__(self, server_url: str, api_key: str, user_id: str, library_index: bool = False, library_index_item_types: list = None, match_cache: MatchCache = None):
         self.server_url = server_url
         self.api_key = api_key
         self.user_id = user_id
 
+        # Match against an in-memory index of the library instead of one search per item
+        self.library_index = library_index
+        self.library_index_item_types = library_index_item_types or ["Movie", "Series", "Program"]
+        self._library_indexes = {}
+
+        # Persistent cache of previous match results
+        self.match_cache = match_cache
+
+
+    def _playlists_params(self) -> dict:
+        return {
+            "enableTotalRecordCount": "false",
+            "enableImages": "true",
+            "enableImageTypes": "Primary",
+            "imageTypeLimit": 1,
+            "Recursive": "true",
+            "includeItemTypes": "Playlist",
+            "fields": ["Name", "Id", "Tags", "Overview"]
+        }
+
+
+    def _library_index_params(self, start_index: int, page_size: int, jellyfin_query_parameters={}) -> dict:
+        params = {
+            "enableTotalRecordCount": "false",
+            "enableImages": "false",
+            "Recursive": "true",
+            "IncludeItemTypes": self.library_index_item_types,
+            "fields": ["ProviderIds", "ProductionYear", "OriginalTitle"],
+            "StartIndex": start_index,
+            "Limit": page_size
+        }
+        return {**params, **jellyfin_query_parameters}
+
+
+    @staticmethod
+    def _search_titles(item) -> list:
+        '''Titles to search for, one after another until one finds something - the original title, then the normalized title'''
+        search_titles = [item["title"]]
+        normalized_title = unicodedata.normalize('NFKC', item["title"])
+        if normalized_title != item["title"]:
+            search_titles.append(normalized_title)
+        return search_titles
+
+
+    @staticmethod
+    def _search_params(item, search_title: str, jellyfin_query_parameters={}) -> dict:
+        params = {
+            "enableTotalRecordCount": "false",
+            "enableImages": "false",
+            "Recursive": "true",
+            "IncludeItemTypes": item["media_type"],
+            "searchTerm": search_title,
+            "fields": ["ProviderIds", "ProductionYear"]
+        }
+        return {**params, **jellyfin_query_parameters}
+
+
+    @staticmethod
+    def _playlist_entries(data: dict) -> list:
+        return [(item.get("PlaylistItemId") or item["Id"], item["Id"]) for item in data["Items"]]
+
+
+    def _uses_library_index(self, media_types: list) -> bool:
+        '''Only use the index if it holds all item types the item could be - anything else falls back to a search'''
+        indexed_types = {t.lower() for t in self.library_index_item_types}
+        return self.library_index and all(t.lower() in indexed_types for t in media_types)
+
+
+    @staticmethod
+    def select_match(item, candidates: list, year_filter: bool = True):
+        '''Picks the Jellyfin item matching a list item out of the candidates, or None'''
+        # Check if there's an exact imdb_id match first
+        if "imdb_id" in item:
+            for result in candidates:
+                if result.get("ProviderIds", {}).get("Imdb", None) == item["imdb_id"]:
+                    return result
+            return None
+
+        # Check if there's a year match
+        if year_filter:
+            for result in candidates:
+                if str(result.get("ProductionYear", None)) == str(item["release_year"]):
+                    return result
+
+        # Otherwise, just take the first result
+        if len(candidates) == 1:
+            return candidates[0]
+        return None
+
+
+    def _start_match(self, item, year_filter: bool = True, jellyfin_query_parameters={}):
+        '''Maps the item's media type to Jellyfin types and looks it up in the match cache.
+        Returns (media types, cache context, cached match or None) - a cached match can be a cached miss.'''
+        item["media_type"] = self.imdb_to_jellyfin_type_map.get(item["media_type"], item["media_type"])
+        media_types = item["media_type"] if isinstance(item["media_type"], list) else [item["media_type"]]
+
+        if self.match_cache is None:
+            return media_types, None, None
+        cache_context = MatchCache.context(year_filter, jellyfin_query_parameters)
+        cached = self.match_cache.get(item, cache_context)
+        if cached is not None:
+            logger.debug(f"Using cached match for {item['title']}: {cached['jellyfin_id']}")
+            metrics.count("match_cache_hits")
+        else:
+            metrics.count("match_cache_misses")
+        return media_types, cache_context, cached
+
+
+    def _finish_match(self, item, candidates: list, year_filter: bool = True, cache_context: str = None):
+        '''Picks the match out of the candidates, logs it and caches it. Returns the Jellyfin item ID or None'''
+        match = self.select_match(item, candidates, year_filter)
+
+        if match is None:
+            logger.warning(f"Item {item['title']} ({item.get('release_year','N/A')}) {item.get('imdb_id','')} not found in jellyfin")
+            logger.debug(f"List Candidate: {item}")
+
+            # Show what Jellyfin found (if anything) to help debug
+            if candidates:
+                logger.debug(f"Jellyfin found {len(candidates)} results but none matched:")
+                for result in candidates[:3]:  # Show first 3 results
+                    result_imdb = result.get("ProviderIds", {}).get("Imdb", "no-imdb")
+                    result_year = result.get("ProductionYear", "no-year")
+                    logger.debug(f"  - '{result.get('Name')}' ({result_year}) IMDB:{result_imdb}")
+            else:
+                logger.debug(f"Jellyfin search returned no results for '{item['title']}'")
+
+            item_id = None
+        else:
+            item_id = match["Id"]
+            logger.info(f"Matched {item['title']} to Jellyfin item {item_id}")
+            logger.debug(f"\tList item: {item}")
+            logger.debug(f"\tMatched JF item: {match}")
+
+        if self.match_cache is not None:
+            self.match_cache.put(item, cache_context, item_id)
+        return item_id
+
+
+class JellyfinClient(JellyfinMatcher):
+
+    def __init__(self, server_url: str, api_key: str, user_id: str, library_index: bool = False, library_index_item_types: list = None, match_cache: MatchCache = None, poster_cache: PosterCache = None):
+        super().__init__(server_url, api_key, user_id, library_index, library_index_item_types, match_cache)
+        self.session = http.create_session(headers={"X-Emby-Token": self.api_key})
+        self._library_index_lock = threading.Lock()
+        self._playlist_lock = threading.Lock()
+        self._playlists = None
+
+        # Persistent cache of generated posters
+        self.poster_cache = poster_cache
+
         # Check if server is reachable
         try:
-            requests.get(self.server_url)
+            self.session.get(self.server_url)
         except requests.exceptions.ConnectionError:
             raise Exception("Server is not reachable")
 
         # Check if api key is valid
-        res = requests.get(f"{self.server_url}/System/Info", headers={"X-Emby-Token": self.api_key})
+        res = self.session.get(f"{self.server_url}/System/Info")
         if res.status_code != 200:
             raise Exception("Invalid API key")
 
@@ -41,91 +210,145 @@ class JellyfinClient:
         logger.debug(f"Jellyfin Version: {jf_info['Version']}")
 
         # Check if user id is valid
-        res = requests.get(f"{self.server_url}/Users/{self.user_id}", headers={"X-Emby-Token": self.api_key})
+        res = self.session.get(f"{self.server_url}/Users/{self.user_id}")
         if res.status_code != 200:
             raise Exception("Invalid user id")
 
 
     def get_all_playlists(self):
-        params = {
-            "enableTotalRecordCount": "false",
-            "enableImages": "false",
-            "Recursive": "true",
-            "includeItemTypes": "Playlist",
-            "fields": ["Name", "Id", "Tags"]
-        }
         logger.info("Getting playlists list...")
-        res = requests.get(f'{self.server_url}/Users/{self.user_id}/Items',headers={"X-Emby-Token": self.api_key}, params=params)
+        res = self.session.get(f'{self.server_url}/Users/{self.user_id}/Items', params=self._playlists_params())
         return res.json()["Items"]
 
 
-    def find_playlist_with_name_or_create(self, list_name: str, list_id: str, description: str, plugin_name: str, media_type: str = "Video", is_public: bool = True) -> str:
-        '''Returns the playlist id of the playlist with the given name. If it doesn't exist, it creates a new playlist and returns the id of the new playlist.'''
-        playlist_id = None
-        playlists = self.get_all_playlists()
+    def _load_playlists(self):
+        '''Loads the playlist inventory once per client, indexed by tag and by name. Call with _playlist_lock held.'''
+        if self._playlists is not None:
+            return
+        self._playlists = {}
+        self._playlists_by_tag = {}
+        self._playlists_by_name = {}
+        for playlist in self.get_all_playlists():
+            self._add_to_playlist_inventory(playlist)
 
-        # Check if list name in tags
-        for playlist in playlists:
-            if json.dumps(list_id) in playlist["Tags"]:
-                playlist_id = playlist["Id"]
-                break
 
-        # if no match - Check if list name == playlist name
-        if playlist_id is None:
-            for playlist in playlists:
-                if list_name == playlist["Name"]:
-                    playlist_id = playlist["Id"]
-                    break
-
-        if playlist_id is not None:
-            logger.info("found existing playlist: " + list_name + " (" + playlist_id + ")")
-
-        if playlist_id is None:
-            # Playlist doesn't exist -> Make a new one
-            logger.info("No matching playlist found for: " + list_name + ". Creating new playlist...")
-            # Use JSON body for better compatibility with is_public parameter
-            res2 = requests.post(
-                f'{self.server_url}/Playlists',
-                headers={"X-Emby-Token": self.api_key},
-                json={
-                    "Name": list_name,
-                    "UserId": self.user_id,
-                    "MediaType": media_type,
-                    "IsPublic": is_public
-                }
-            )
-            playlist_id = res2.json()["Id"]
-            logger.info(f"Created new playlist: {list_name} (IsPublic: {is_public})")
+    def _add_to_playlist_inventory(self, playlist: dict):
+        self._playlists[playlist["Id"]] = playlist
+        for tag in playlist.get("Tags", []):
+            self._playlists_by_tag.setdefault(tag, playlist["Id"])
+        self._playlists_by_name.setdefault(playlist["Name"], playlist["Id"])
 
-        # Update playlist description and add tags so we can find it later
-        if playlist_id is not None:
-            playlist = requests.get(f'{self.server_url}/Users/{self.user_id}/Items/{playlist_id}', headers={"X-Emby-Token": self.api_key}).json()
-            if playlist.get("Overview", "") == "" and description is not None:
+
+    def find_playlist_with_name_or_create(self, list_name: str, list_id: str, description: str, plugin_name: str, media_type: str = "Video", is_public: bool = True) -> str:
+        '''Returns the playlist id of the playlist with the given name. If it doesn't exist, it creates a new playlist and returns the id of the new playlist.'''
+        # Lists running in parallel could otherwise both create the same playlist
+        with self._playlist_lock:
+            self._load_playlists()
+
+            # Check if list name in tags, if no match - Check if list name == playlist name
+            playlist_id = self._playlists_by_tag.get(json.dumps(list_id))
+            if playlist_id is None:
+                playlist_id = self._playlists_by_name.get(list_name)
+
+            if playlist_id is not None:
+                logger.info("found existing playlist: " + list_name + " (" + playlist_id + ")")
+
+            if playlist_id is None:
+                # Playlist doesn't exist -> Make a new one
+                logger.info("No matching playlist found for: " + list_name + ". Creating new playlist...")
+                # Use JSON body for better compatibility with is_public parameter
+                res2 = self.session.post(
+                    f'{self.server_url}/Playlists',
+                    json={
+                        "Name": list_name,
+                        "UserId": self.user_id,
+                        "MediaType": media_type,
+                        "IsPublic": is_public
+                    }
+                )
+                playlist_id = res2.json()["Id"]
+                logger.info(f"Created new playlist: {list_name} (IsPublic: {is_public})")
+                self._add_to_playlist_inventory({"Id": playlist_id, "Name": list_name, "Tags": [], "Overview": "", "ImageTags": {}})
+
+            inventory_entry = self._playlists[playlist_id]
+
+        # Update playlist description and add tags so we can find it later - only if they aren't set already
+        tags = ["Jellyfin-Auto-Playlists", plugin_name, json.dumps(list_id)]
+        missing_tags = [tag for tag in tags if tag not in inventory_entry.get("Tags", [])]
+        missing_overview = (inventory_entry.get("Overview") or "") == "" and bool(description)
+        if missing_tags or missing_overview:
+            playlist = self.session.get(f'{self.server_url}/Users/{self.user_id}/Items/{playlist_id}').json()
+            if playlist.get("Overview", "") == "" and description:
                 playlist["Overview"] = description
-            playlist["Tags"] = list(set(playlist.get("Tags", []) + ["Jellyfin-Auto-Playlists", plugin_name, json.dumps(list_id)]))
-            r = requests.post(f'{self.server_url}/Items/{playlist_id}',headers={"X-Emby-Token": self.api_key}, json=playlist)
+            playlist["Tags"] = list(set(playlist.get("Tags", []) + tags))
+            r = self.session.post(f'{self.server_url}/Items/{playlist_id}', json=playlist)
+
+            with self._playlist_lock:
+                inventory_entry["Overview"] = playlist.get("Overview", "")
+                inventory_entry["Tags"] = playlist["Tags"]
+                for tag in playlist["Tags"]:
+                    self._playlists_by_tag.setdefault(tag, playlist_id)
 
         return playlist_id
 
     def has_poster(self, playlist_id):
         '''Check if a playlist already has a poster'''
+        with self._playlist_lock:
+            self._load_playlists()
+            playlist = self._playlists.get(playlist_id)
+        if playlist is not None:
+            return "Primary" in (playlist.get("ImageTags") or {})
+
         poster_url = f"{self.server_url}/Items/{playlist_id}/Images/Primary"
-        r = requests.get(poster_url, headers={"X-Emby-Token": self.api_key})
+        r = self.session.get(poster_url)
         if r.status_code == 404:
             return False
         return True
 
 
-    def make_poster(self, playlist_id, playlist_name, mosaic_limit=20, google_font_url="https://fonts.googleapis.com/css2?family=Dosis:wght@800&display=swap"):
+    def make_poster(self, playlist_id, playlist_name, mosaic_limit=20, google_font_url="https://fonts.googleapis.com/css2?family=Dosis:wght@800&display=swap", only_if_changed=False):
+        '''Generate and upload a mosaic poster of the playlist's items. With only_if_changed, a poster
+        generated before is only replaced if its title or item images have changed.'''
 
         # Check if playlist poster exists
         poster_urls = fetch_collection_posters(self.server_url, self.api_key, self.user_id, playlist_id)[:mosaic_limit]
         headers={"X-Emby-Token": self.api_key}
 
+        # Item ids and image tags of the posters in the mosaic
+        poster_keys = [url[len(self.server_url):] for url in poster_urls]
+        poster_hash = None
+        if self.poster_cache is not None:
+            poster_hash = PosterCache.poster_hash(playlist_name, poster_keys)
+            previous_hash = self.poster_cache.get_hash(playlist_id)
+            if only_if_changed and previous_hash in (None, poster_hash):
+                # Unchanged, or not generated by us
+                logger.debug(f"Poster of '{playlist_name}' is up to date")
+                return
+        elif only_if_changed:
+            return
+
+        # Only download the posters at the size they're used at in the mosaic
+        cell_size = mosaic_cell_size(len(poster_urls)) if poster_urls else None
+
+        def load_poster(url, poster_key):
+            if self.poster_cache is not None:
+                cell = self.poster_cache.get_cell(poster_key, cell_size)
+                if cell is not None:
+                    metrics.count("poster_cell_cache_hits")
+                    return cell
+                metrics.count("poster_cell_cache_misses")
+            image = safe_download(resized_image_url(url, cell_size), headers, cell_size)
+            if image is not None and self.poster_cache is not None:
+                image = fit_poster(image, cell_size)
+                self.poster_cache.put_cell(poster_key, cell_size, image)
+            return image
+
         # Use a ThreadPoolExecutor to download images in parallel
+        load_poster = with_log_context(load_poster)
         with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            futures = [executor.submit(safe_download, url, headers) for url in poster_urls]
-            results = [future.result() for future in concurrent.futures.as_completed(futures)]
+            futures = [executor.submit(load_poster, url, poster_key) for url, poster_key in zip(poster_urls, poster_keys)]
+            # Keep the playlist order, so the same items always end up in the same place
+            results = [future.result() for future in futures]
 
         # Filter out any failed downloads (None values)
         poster_images = [img for img in results if img is not None]
@@ -133,110 +356,246 @@ class JellyfinClient:
         font_path = get_font(google_font_url)
 
         if poster_images:
-            safe_name = playlist_name.replace(" ", "_").replace("/", "_")
-            output_path = f"/tmp/{safe_name}_cover.jpg"
-            create_mosaic(poster_images, playlist_name, output_path, font_path)
+            cover = render_mosaic(poster_images, playlist_name, font_path)
         else:
             logger.warning(f"No posters available for playlist '{playlist_name}'. Skipping mosaic generation.")
             return
 
-        # Upload
+        if self.upload_poster(playlist_id, encode_jpeg(cover)):
+            if poster_hash is not None:
+                self.poster_cache.put_hash(playlist_id, poster_hash)
+            with self._playlist_lock:
+                if self._playlists is not None and playlist_id in self._playlists:
+                    self._playlists[playlist_id].setdefault("ImageTags", {})["Primary"] = "uploaded"
+
+
+    def upload_poster(self, playlist_id: str, jpeg_data: bytes) -> bool:
+        '''Sets the primary image of an item from JPEG data. Returns whether it was uploaded'''
+        r = self.session.post(f"{self.server_url}/Items/{playlist_id}/Images/Primary", headers={"Content-Type": "image/jpeg"}, data=b64encode(jpeg_data))
+        if not r.ok:
+            logger.error(f"Failed to upload poster for {playlist_id}. Status: {r.status_code}")
+        return r.ok
+
+
+    def build_library_index(self, jellyfin_query_parameters={}, page_size: int = 1000) -> LibraryIndex:
+        '''Pages through the user's library once and builds an in-memory index for matching'''
+        index = LibraryIndex()
+        logger.info(f"Building library index for {', '.join(self.library_index_item_types)} items...")
+        start_index = 0
+        while True:
+            params = self._library_index_params(start_index, page_size, jellyfin_query_parameters)
+            res = self.session.get(f'{self.server_url}/Users/{self.user_id}/Items', params=params)
+            res.raise_for_status()
+            page = res.json()["Items"]
+            for jf_item in page:
+                index.add(jf_item)
+            if len(page) < page_size:
+                break
+            start_index += page_size
+        logger.info(f"Indexed {index.size} library items")
+        return index
 
-        from PIL import Image
-        img = Image.open(output_path)  # or whatever format
-        img = img.convert("RGB")  # Ensures it's safe for JPEG
-        img.save(output_path, format="JPEG")
 
-        with open(output_path, 'rb') as f:
-            img_data = f.read()
-        encoded_data = b64encode(img_data)
+    def get_library_index(self, jellyfin_query_parameters={}) -> LibraryIndex:
+        '''Returns the library index for the given query parameters, building it on first use'''
+        key = json.dumps(jellyfin_query_parameters, sort_keys=True)
+        with self._library_index_lock:
+            if key not in self._library_indexes:
+                self._library_indexes[key] = self.build_library_index(jellyfin_query_parameters)
+            return self._library_indexes[key]
 
-        headers["Content-Type"] = "image/jpeg"
-        r = requests.post(f"{self.server_url}/Items/{playlist_id}/Images/Primary", headers=headers, data=encoded_data)
 
+    def search_items(self, item, jellyfin_query_parameters={}) -> list:
+        '''Searches Jellyfin by title, trying the original title first and then the normalized title'''
+        results = []
+        for search_title in self._search_titles(item):
+            params = self._search_params(item, search_title, jellyfin_query_parameters)
+            res = self.session.get(f'{self.server_url}/Users/{self.user_id}/Items', params=params)
+            results = res.json()["Items"]
 
-    def match_item_to_jellyfin(self, item, year_filter: bool = True, jellyfin_query_parameters={}):
-        '''Matches an item to a Jellyfin item based on title, release year, and IMDB ID. Returns the Jellyfin item ID or None if not found.'''
+            # If we got results, stop searching
+            if results:
+                break
+        return results
 
-        item["media_type"] = self.imdb_to_jellyfin_type_map.get(item["media_type"], item["media_type"])
 
-        # Try original title first, then normalized title as fallback
-        search_titles = [item["title"]]
-        normalized_title = unicodedata.normalize('NFKC', item["title"])
-        if normalized_title != item["title"]:
-            search_titles.append(normalized_title)
+    def get_changed_items(self, since: datetime, jellyfin_query_parameters={}) -> list:
+        '''Returns all matchable library items created or updated since the given time'''
+        item_types = sorted({t for types in self.imdb_to_jellyfin_type_map.values() for t in types})
+        params = {
+            "enableTotalRecordCount": "false",
+            "enableImages": "false",
+            "Recursive": "true",
+            "IncludeItemTypes": item_types,
+            "minDateLastSaved": since.isoformat(),
+            "fields": ["ProviderIds", "ProductionYear", "OriginalTitle", "DateCreated"]
+        }
+        params = {**params, **jellyfin_query_parameters}
+        res = self.session.get(f'{self.server_url}/Users/{self.user_id}/Items', params=params)
+        res.raise_for_status()
+        return res.json()["Items"]
 
-        res = None
-        for search_title in search_titles:
-            params = {
-                "enableTotalRecordCount": "false",
-                "enableImages": "false",
-                "Recursive": "true",
-                "IncludeItemTypes": item["media_type"],
-                "searchTerm": search_title,
-                "fields": ["ProviderIds", "ProductionYear"]
-            }
 
-            params = {**params, **jellyfin_query_parameters}
+    def get_library_item_count(self) -> int:
+        '''Returns the number of matchable items in the library'''
+        item_types = sorted({t for types in self.imdb_to_jellyfin_type_map.values() for t in types})
+        params = {
+            "enableTotalRecordCount": "true",
+            "enableImages": "false",
+            "Recursive": "true",
+            "IncludeItemTypes": item_types,
+            "Limit": 0
+        }
+        res = self.session.get(f'{self.server_url}/Users/{self.user_id}/Items', params=params)
+        res.raise_for_status()
+        return res.json()["TotalRecordCount"]
 
-            res = requests.get(f'{self.server_url}/Users/{self.user_id}/Items',headers={"X-Emby-Token": self.api_key}, params=params)
 
-            # If we got results, stop searching
-            if res.json()["Items"]:
-                break
+    def get_library_watermark(self) -> str:
+        '''Changes whenever matchable items are added to or removed from the library'''
+        item_types = sorted({t for types in self.imdb_to_jellyfin_type_map.values() for t in types})
+        params = {
+            "enableTotalRecordCount": "true",
+            "enableImages": "false",
+            "Recursive": "true",
+            "IncludeItemTypes": item_types,
+            "SortBy": "DateCreated",
+            "SortOrder": "Descending",
+            "Fields": "DateCreated",
+            "Limit": 1
+        }
+        res = self.session.get(f'{self.server_url}/Users/{self.user_id}/Items', params=params)
+        res.raise_for_status()
+        data = res.json()
+        newest = data["Items"][0] if data["Items"] else {}
+        return f'{data["TotalRecordCount"]}:{newest.get("Id", "")}:{newest.get("DateCreated", "")}'
 
-        # Check if there's an exact imdb_id match first
-        match = None
-        if "imdb_id" in item:
-            for result in res.json()["Items"]:
-                if result["ProviderIds"].get("Imdb", None) == item["imdb_id"]:
-                    match = result
-                    break
-        else:
-            # Check if there's a year match
-            if match is None and year_filter:
-                for result in res.json()["Items"]:
-                    if str(result.get("ProductionYear", None)) == str(item["release_year"]):
-                        match = result
-                        break
 
-            # Otherwise, just take the first result
-            if match is None and len(res.json()["Items"]) == 1:
-                match = res.json()["Items"][0]
+    def refresh_match_cache(self):
+        '''Brings the match cache up to date with library changes since the last run.
 
-        if match is None:
-            logger.warning(f"Item {item['title']} ({item.get('release_year','N/A')}) {item.get('imdb_id','')} not found in jellyfin")
-            logger.debug(f"List Candidate: {item}")
+        Cached misses are only re-checked if an item saved since the last run has the same title or IMDb id.
+        Misses which a search could still find under another title are re-matched once they are older than
+        the cache's miss_max_age_days. If items were removed from the library, cached hits are dropped so
+        they get matched again.'''
+        if self.match_cache is None:
+            return
 
-            # Show what Jellyfin found (if anything) to help debug
-            search_results = res.json()['Items']
-            if search_results:
-                logger.debug(f"Jellyfin found {len(search_results)} results but none matched:")
-                for result in search_results[:3]:  # Show first 3 results
-                    result_imdb = result.get("ProviderIds", {}).get("Imdb", "no-imdb")
-                    result_year = result.get("ProductionYear", "no-year")
-                    logger.debug(f"  - '{result.get('Name')}' ({result_year}) IMDB:{result_imdb}")
-            else:
-                logger.debug(f"Jellyfin search returned no results for '{item['title']}'")
+        run_started = datetime.now(timezone.utc)
+        item_count = self.get_library_item_count()
+        last_sync = self.match_cache.get_meta("last_sync")
+        last_count = self.match_cache.get_meta("item_count")
+
+        if last_sync is not None:
+            last_sync = datetime.fromisoformat(last_sync)
+
+            # Allow for some clock drift between us and the jellyfin server
+            changed_items = self.get_changed_items(last_sync - timedelta(hours=1))
+            created = [i for i in changed_items if "DateCreated" in i and parse_jellyfin_date(i["DateCreated"]) > last_sync]
+            logger.info(f"Match cache: {len(changed_items)} library items changed since {last_sync.isoformat()}")
+
+            if item_count < last_count + len(created):
+                logger.info("Match cache: items were removed from the library - dropping cached matches")
+                self.match_cache.clear_hits()
+
+            # Re-check previous misses which could be one of the changed items, the same way they're matched
+            if changed_items:
+                indexes = {}
+                rechecked = 0
+                for item, context in self.match_cache.misses():
+                    settings = json.loads(context)
+                    query_key = json.dumps(settings["query_parameters"], sort_keys=True)
+                    if query_key not in indexes:
+                        indexes[query_key] = LibraryIndex()
+                        changed = changed_items if not settings["query_parameters"] else self.get_changed_items(last_sync - timedelta(hours=1), settings["query_parameters"])
+                        for jf_item in changed:
+                            indexes[query_key].add(jf_item)
+                    media_types = item["media_type"] if isinstance(item["media_type"], list) else [item["media_type"]]
+                    if not indexes[query_key].candidates(item, media_types):
+                        continue
+                    candidates = self.find_candidates(item, media_types, settings["query_parameters"])
+                    match = self.select_match(item, candidates, settings["year_filter"])
+                    if match is not None:
+                        self.match_cache.put(item, context, match["Id"])
+                        rechecked += 1
+                logger.info(f"Match cache: {rechecked} previously missing items are now in the library")
+
+        self.match_cache.set_meta("last_sync", run_started.isoformat())
+        self.match_cache.set_meta("item_count", item_count)
+
+
+    def find_candidates(self, item, media_types: list, jellyfin_query_parameters={}) -> list:
+        '''Returns the Jellyfin items which could match a list item, from the library index or a search'''
+        if self._uses_library_index(media_types):
+            return self.get_library_index(jellyfin_query_parameters).candidates(item, media_types)
+        return self.search_items(item, jellyfin_query_parameters)
 
-            return None
-        else:
-            item_id = match["Id"]
-            logger.info(f"Matched {item['title']} to Jellyfin item {item_id}")
-            logger.debug(f"\tList item: {item}")
-            logger.debug(f"\tMatched JF item: {match}")
-            return item_id
+
+    def match_item_to_jellyfin(self, item, year_filter: bool = True, jellyfin_query_parameters={}):
+        '''Matches an item to a Jellyfin item based on title, release year, and IMDB ID. Returns the Jellyfin item ID or None if not found.'''
+
+        media_types, cache_context, cached = self._start_match(item, year_filter, jellyfin_query_parameters)
+        if cached is not None:
+            return cached["jellyfin_id"]
+        candidates = self.find_candidates(item, media_types, jellyfin_query_parameters)
+        return self._finish_match(item, candidates, year_filter, cache_context)
+
+
+    def get_playlist_entries(self, playlist_id: str) -> list:
+        '''Returns the (entry id, item id) of every item in a playlist, in playlist order'''
+        res = self.session.get(
+            f'{self.server_url}/Playlists/{playlist_id}/Items',
+            params={"userId": self.user_id, "enableImages": "false", "enableUserData": "false"}
+        )
+        res.raise_for_status()
+        return self._playlist_entries(res.json())
 
 
-    def sync_playlist(self, playlist_id: str, item_ids_in_order: list):
-        '''Syncs a playlist with the given items in order. Clears the playlist first, then adds all items in the correct order.'''
+    def sync_playlist(self, playlist_id: str, item_ids_in_order: list, clear: bool = False) -> bool:
+        '''Syncs a playlist with the given items in order. Only removes, adds and moves the entries which differ,
+        unless clear is set - then the playlist is emptied and rebuilt. Returns whether the playlist now holds
+        exactly the given items, in order.'''
         if not item_ids_in_order:
             logger.warning(f"No items to add to playlist {playlist_id}")
-            return
+            return False
 
-        # Clear existing items first
-        self.clear_playlist(playlist_id)
+        if clear:
+            cleared = self.clear_playlist(playlist_id)
+            return self.add_to_playlist(playlist_id, item_ids_in_order) and cleared
 
+        steps = sync_steps(playlist_id, item_ids_in_order)
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(self._sync_step(playlist_id, *request))
+        except StopIteration as done:
+            return done.value
+
+
+    def _sync_step(self, playlist_id: str, action: str, *args):
+        '''Makes a request of utils.playlist_sync.sync_steps and returns its result'''
+        if action == "entries":
+            return self.get_playlist_entries(playlist_id)
+        if action == "remove":
+            return self.remove_from_playlist(playlist_id, *args)
+        if action == "add":
+            return self.add_to_playlist(playlist_id, *args)
+        return self.move_playlist_entry(playlist_id, *args)
+
+
+    def move_playlist_entry(self, playlist_id: str, entry_id: str, new_index: int) -> bool:
+        '''Moves a playlist entry to new_index. Returns whether it was moved'''
+        response = self.session.post(
+            f'{self.server_url}/Playlists/{playlist_id}/Items/{entry_id}/Move/{new_index}'
+        )
+        if response.status_code not in [200, 204]:
+            logger.error(f"Failed to move playlist item. Status: {response.status_code}, Response: {response.text}")
+            return False
+        return True
+
+
+    def add_to_playlist(self, playlist_id: str, item_ids_in_order: list) -> bool:
+        '''Appends the given items to a playlist, in order. Returns whether all of them were added'''
         # Add items in batches to avoid URL length limits (chunk size of 50)
         # This preserves order by adding batches sequentially
         chunk_size = 50
@@ -249,9 +608,8 @@ class JellyfinClient:
             logger.debug(f"Adding batch {i//chunk_size + 1}/{(len(item_ids_in_order) + chunk_size - 1)//chunk_size}: {len(chunk)} items")
 
             try:
-                response = requests.post(
+                response = self.session.post(
                     f'{self.server_url}/Playlists/{playlist_id}/Items',
-                    headers={"X-Emby-Token": self.api_key},
                     params={"ids": ids_param, "userId": self.user_id}
                 )
 
@@ -268,42 +626,48 @@ class JellyfinClient:
 
         if total_added == len(item_ids_in_order):
             logger.info(f"Successfully added {total_added} items to playlist in order")
-        else:
-            logger.warning(f"Only added {total_added}/{len(item_ids_in_order)} items to playlist")
-
-
-    def clear_playlist(self, playlist_id: str):
-        '''Clears a playlist by removing all items from it'''
-        res = requests.get(f'{self.server_url}/Users/{self.user_id}/Items',headers={"X-Emby-Token": self.api_key}, params={"Recursive": "true", "parentId": playlist_id})
-        all_ids = [item["Id"] for item in res.json()["Items"]]
-
-        if not all_ids:
-            logger.info(f"Playlist {playlist_id} is already empty")
-            return
+            return True
+        logger.warning(f"Only added {total_added}/{len(item_ids_in_order)} items to playlist")
+        return False
 
-        logger.info(f"Clearing {len(all_ids)} items from playlist {playlist_id}")
 
+    def remove_from_playlist(self, playlist_id: str, entry_ids: list) -> int:
+        '''Removes the given entries from a playlist. Returns the number removed'''
         # Delete items in chunks to avoid URL length limits (414 error)
         chunk_size = 50
         total_deleted = 0
 
         # Chunk the IDs
-        id_chunks = [all_ids[i:i + chunk_size] for i in range(0, len(all_ids), chunk_size)]
+        id_chunks = [entry_ids[i:i + chunk_size] for i in range(0, len(entry_ids), chunk_size)]
 
         for chunk in id_chunks:
-            response = requests.delete(
+            response = self.session.delete(
                 f'{self.server_url}/Playlists/{playlist_id}/Items',
-                headers={"X-Emby-Token": self.api_key},
                 params={"entryIds": ",".join(chunk)}
             )
 
             if response.status_code in [200, 204]:
                 total_deleted += len(chunk)
-                logger.debug(f"Deleted {len(chunk)} items ({total_deleted}/{len(all_ids)})")
+                logger.debug(f"Deleted {len(chunk)} items ({total_deleted}/{len(entry_ids)})")
             else:
-                logger.error(f"Error clearing playlist items: {response.status_code} - {response.text}")
+                logger.error(f"Error removing playlist items: {response.status_code} - {response.text}")
+        return total_deleted
+
+
+    def clear_playlist(self, playlist_id: str) -> bool:
+        '''Clears a playlist by removing all items from it. Returns whether it is empty now'''
+        res = self.session.get(f'{self.server_url}/Users/{self.user_id}/Items', params={"Recursive": "true", "parentId": playlist_id})
+        all_ids = [item["Id"] for item in res.json()["Items"]]
+
+        if not all_ids:
+            logger.info(f"Playlist {playlist_id} is already empty")
+            return True
+
+        logger.info(f"Clearing {len(all_ids)} items from playlist {playlist_id}")
+        total_deleted = self.remove_from_playlist(playlist_id, all_ids)
 
         if total_deleted == len(all_ids):
             logger.info(f"Successfully cleared playlist {playlist_id}")
-        else:
-            logger.warning(f"Only deleted {total_deleted}/{len(all_ids)} items from playlist")
+            return True
+        logger.warning(f"Only deleted {total_deleted}/{len(all_ids)} items from playlist")
+        return False
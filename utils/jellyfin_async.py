@@ -0,0 +1,345 @@
+import asyncio
+import json
+import threading
+import concurrent.futures
+from base64 import b64encode
+import aiohttp
+from urllib3.util.retry import Retry
+from loguru import logger
+from . import http, metrics
+from .jellyfin import JellyfinMatcher
+from .library_index import LibraryIndex
+from .cache import MatchCache
+from .playlist_sync import sync_steps
+
+
+def _query(params: dict) -> list:
+    '''Query parameters as (key, value) pairs, repeating keys for list values like requests does'''
+    pairs = []
+    for key, value in params.items():
+        for v in value if isinstance(value, (list, tuple)) else [value]:
+            pairs.append((key, str(v).lower() if isinstance(v, bool) else str(v)))
+    return pairs
+
+
+class AsyncJellyfinClient(JellyfinMatcher):
+    '''asyncio version of JellyfinClient, for matching and syncing many items without a thread per request.
+
+    Requests share one keep-alive connection pool, with at most max_concurrent_requests in flight. Items are
+    matched the same way as by JellyfinClient, with the same library index, match cache and metrics.
+
+        async with AsyncJellyfinClient(server_url, api_key, user_id) as client:
+            item_ids = await client.match_items(items)
+    '''
+
+    def __init__(self, server_url: str, api_key: str, user_id: str, max_concurrent_requests: int = 16, library_index: bool = False, library_index_item_types: list = None, match_cache: MatchCache = None):
+        super().__init__(server_url, api_key, user_id, library_index, library_index_item_types, match_cache)
+        self.max_concurrent_requests = int(max_concurrent_requests)
+        self._session = None
+        self._semaphore = None
+        self._library_index_locks = {}
+
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+    async def open(self):
+        '''Opens the connection pool and checks the server, api key and user id'''
+        self._semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrent_requests, keepalive_timeout=30),
+            headers={"X-Emby-Token": self.api_key},
+            timeout=aiohttp.ClientTimeout(total=http._settings["timeout"])
+        )
+
+        try:
+            # Check if server is reachable
+            try:
+                await self._request("GET", "")
+            except aiohttp.ClientConnectionError:
+                raise Exception("Server is not reachable")
+
+            # Check if api key is valid
+            status, jf_info = await self._request("GET", "/System/Info")
+            if status != 200:
+                raise Exception("Invalid API key")
+            logger.debug(f"Jellyfin Version: {jf_info['Version']}")
+
+            # Check if user id is valid
+            status, _ = await self._request("GET", f"/Users/{self.user_id}")
+            if status != 200:
+                raise Exception("Invalid user id")
+        except Exception:
+            await self.close()
+            raise
+
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+    async def _request(self, method: str, path: str, params: dict = None, **kwargs):
+        '''Returns the status and the decoded JSON body (or None) of a request to the server.
+
+        Like requests made through utils.http, idempotent requests are retried after connection errors and
+        429/5xx responses, and the server's rate limiter backs off when it is overloaded.'''
+        url = self.server_url + path
+        retries = int(http._settings["retries"]) if method in Retry.DEFAULT_ALLOWED_METHODS else 0
+        limiter = http._get_rate_limiter(url)
+        for attempt in range(retries + 1):
+            async with self._semaphore:
+                while (delay := limiter.reserve()) > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    async with self._session.request(method, url, params=_query(params or {}), **kwargs) as response:
+                        body = await response.read()
+                        status = response.status
+                        metrics.record_request(url, len(body))
+                        delay = http.handle_response(url, status, response, attempt)
+                except aiohttp.ClientConnectionError as e:
+                    if attempt == retries:
+                        raise
+                    outcome = f"failed ({e})"
+                    delay = float(http._settings["backoff_factor"]) * 2 ** attempt
+                else:
+                    outcome = f"returned {status}"
+            if delay is None or attempt == retries:
+                break
+            logger.debug(f"{method} {url} {outcome} - retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+        try:
+            return status, json.loads(body)
+        except ValueError:
+            return status, None
+
+
+    async def _get_json(self, path: str, params: dict = None):
+        status, data = await self._request("GET", path, params)
+        if status != 200:
+            raise Exception(f"GET {path} failed with status {status}")
+        return data
+
+
+    async def get_all_playlists(self) -> list:
+        logger.info("Getting playlists list...")
+        return (await self._get_json(f"/Users/{self.user_id}/Items", self._playlists_params()))["Items"]
+
+
+    async def create_playlist(self, name: str, media_type: str = "Video", is_public: bool = True) -> str:
+        '''Creates an empty playlist and returns its id'''
+        status, data = await self._request("POST", "/Playlists", json={
+            "Name": name,
+            "UserId": self.user_id,
+            "MediaType": media_type,
+            "IsPublic": is_public
+        })
+        if status not in (200, 201):
+            raise Exception(f"Failed to create playlist {name}: {status}")
+        logger.info(f"Created new playlist: {name} (IsPublic: {is_public})")
+        return data["Id"]
+
+
+    async def build_library_index(self, jellyfin_query_parameters={}, page_size: int = 1000) -> LibraryIndex:
+        '''Pages through the user's library once and builds an in-memory index for matching'''
+        index = LibraryIndex()
+        logger.info(f"Building library index for {', '.join(self.library_index_item_types)} items...")
+        start_index = 0
+        while True:
+            params = self._library_index_params(start_index, page_size, jellyfin_query_parameters)
+            page = (await self._get_json(f"/Users/{self.user_id}/Items", params))["Items"]
+            for jf_item in page:
+                index.add(jf_item)
+            if len(page) < page_size:
+                break
+            start_index += page_size
+        logger.info(f"Indexed {index.size} library items")
+        return index
+
+
+    async def get_library_index(self, jellyfin_query_parameters={}) -> LibraryIndex:
+        '''Returns the library index for the given query parameters, building it on first use'''
+        key = json.dumps(jellyfin_query_parameters, sort_keys=True)
+        lock = self._library_index_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if key not in self._library_indexes:
+                self._library_indexes[key] = await self.build_library_index(jellyfin_query_parameters)
+            return self._library_indexes[key]
+
+
+    async def search_items(self, item, jellyfin_query_parameters={}) -> list:
+        '''Searches Jellyfin by title, trying the original title first and then the normalized title'''
+        results = []
+        for search_title in self._search_titles(item):
+            params = self._search_params(item, search_title, jellyfin_query_parameters)
+            results = (await self._get_json(f"/Users/{self.user_id}/Items", params))["Items"]
+
+            # If we got results, stop searching
+            if results:
+                break
+        return results
+
+
+    async def find_candidates(self, item, media_types: list, jellyfin_query_parameters={}) -> list:
+        '''Returns the Jellyfin items which could match a list item, from the library index or a search'''
+        if self._uses_library_index(media_types):
+            return (await self.get_library_index(jellyfin_query_parameters)).candidates(item, media_types)
+        return await self.search_items(item, jellyfin_query_parameters)
+
+
+    async def match_item_to_jellyfin(self, item, year_filter: bool = True, jellyfin_query_parameters={}):
+        '''Matches an item to a Jellyfin item based on title, release year, and IMDB ID. Returns the Jellyfin item ID or None if not found.'''
+        media_types, cache_context, cached = self._start_match(item, year_filter, jellyfin_query_parameters)
+        if cached is not None:
+            return cached["jellyfin_id"]
+        candidates = await self.find_candidates(item, media_types, jellyfin_query_parameters)
+        return self._finish_match(item, candidates, year_filter, cache_context)
+
+
+    async def match_items(self, items: list, year_filter: bool = True, jellyfin_query_parameters={}) -> list:
+        '''Matches all items concurrently. Returns their Jellyfin item ids (None if not found) in the same order.'''
+        return await asyncio.gather(*(self.match_item_to_jellyfin(item, year_filter, jellyfin_query_parameters) for item in items))
+
+
+    async def get_playlist_entries(self, playlist_id: str) -> list:
+        '''Returns the (entry id, item id) of every item in a playlist, in playlist order'''
+        data = await self._get_json(
+            f"/Playlists/{playlist_id}/Items",
+            {"userId": self.user_id, "enableImages": "false", "enableUserData": "false"}
+        )
+        return self._playlist_entries(data)
+
+
+    async def sync_playlist(self, playlist_id: str, item_ids_in_order: list) -> bool:
+        '''Syncs a playlist with the given items in order, only removing, adding and moving the entries which differ.
+        Returns whether the playlist now holds exactly the given items, in order.'''
+        if not item_ids_in_order:
+            logger.warning(f"No items to add to playlist {playlist_id}")
+            return False
+
+        steps = sync_steps(playlist_id, item_ids_in_order)
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(await self._sync_step(playlist_id, *request))
+        except StopIteration as done:
+            return done.value
+
+
+    async def _sync_step(self, playlist_id: str, action: str, *args):
+        '''Makes a request of utils.playlist_sync.sync_steps and returns its result'''
+        if action == "entries":
+            return await self.get_playlist_entries(playlist_id)
+        if action == "remove":
+            return await self.remove_from_playlist(playlist_id, *args)
+        if action == "add":
+            return await self.add_to_playlist(playlist_id, *args)
+        return await self.move_playlist_entry(playlist_id, *args)
+
+
+    async def add_to_playlist(self, playlist_id: str, item_ids_in_order: list) -> bool:
+        '''Appends the given items to a playlist, in order. Returns whether all of them were added'''
+        # Batches are added one after another to keep the order
+        chunk_size = 50
+        total_added = 0
+        for i in range(0, len(item_ids_in_order), chunk_size):
+            chunk = item_ids_in_order[i:i + chunk_size]
+            status, _ = await self._request(
+                "POST", f"/Playlists/{playlist_id}/Items",
+                params={"ids": ",".join(chunk), "userId": self.user_id}
+            )
+            if status in (200, 204):
+                total_added += len(chunk)
+            else:
+                logger.error(f"Failed to add batch to playlist. Status: {status}")
+
+        if total_added == len(item_ids_in_order):
+            logger.info(f"Successfully added {total_added} items to playlist in order")
+            return True
+        logger.warning(f"Only added {total_added}/{len(item_ids_in_order)} items to playlist")
+        return False
+
+
+    async def remove_from_playlist(self, playlist_id: str, entry_ids: list) -> int:
+        '''Removes the given entries from a playlist. Returns the number removed'''
+        # Removals don't depend on each other, so the chunks are sent concurrently
+        chunk_size = 50
+        chunks = [entry_ids[i:i + chunk_size] for i in range(0, len(entry_ids), chunk_size)]
+        responses = await asyncio.gather(*(
+            self._request("DELETE", f"/Playlists/{playlist_id}/Items", params={"entryIds": ",".join(chunk)})
+            for chunk in chunks
+        ))
+        total_deleted = 0
+        for chunk, (status, _) in zip(chunks, responses):
+            if status in (200, 204):
+                total_deleted += len(chunk)
+            else:
+                logger.error(f"Error removing playlist items: {status}")
+        return total_deleted
+
+
+    async def move_playlist_entry(self, playlist_id: str, entry_id: str, new_index: int) -> bool:
+        '''Moves a playlist entry to new_index. Returns whether it was moved'''
+        status, _ = await self._request("POST", f"/Playlists/{playlist_id}/Items/{entry_id}/Move/{new_index}")
+        if status not in (200, 204):
+            logger.error(f"Failed to move playlist item. Status: {status}")
+            return False
+        return True
+
+
+    async def upload_poster(self, playlist_id: str, jpeg_data: bytes) -> bool:
+        '''Sets the primary image of an item from JPEG data. Returns whether it was uploaded'''
+        status, _ = await self._request(
+            "POST", f"/Items/{playlist_id}/Images/Primary",
+            headers={"Content-Type": "image/jpeg"}, data=b64encode(jpeg_data)
+        )
+        if status not in (200, 204):
+            logger.error(f"Failed to upload poster for {playlist_id}. Status: {status}")
+            return False
+        return True
+
+
+class BackgroundJellyfinClient:
+    '''Runs an AsyncJellyfinClient on an event loop in a background thread, so the threads processing lists can
+    hand it items to match. Coroutines run in the context of the thread which submits them, so their log
+    messages and metrics are attributed to that thread's list.'''
+
+    def __init__(self, client: AsyncJellyfinClient):
+        self.client = client
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="jellyfin-async", daemon=True)
+        self._thread.start()
+        try:
+            self.run(self.client.open()).result()
+        except Exception:
+            self._stop()
+            raise
+
+
+    def run(self, coroutine) -> concurrent.futures.Future:
+        '''Schedules a coroutine on the event loop'''
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+
+    def match_item_to_jellyfin(self, item, year_filter: bool = True, jellyfin_query_parameters={}) -> concurrent.futures.Future:
+        '''Starts matching an item. The future's result is the Jellyfin item ID or None if not found.'''
+        return self.run(self.client.match_item_to_jellyfin(item, year_filter, jellyfin_query_parameters))
+
+
+    def close(self):
+        self.run(self.client.close()).result()
+        self._stop()
+
+
+    def _stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -1,9 +1,17 @@
 import requests
+import concurrent.futures
+from . import http, metrics
+from .cache import JellyseerrCache
+from .log import with_log_context
 import urllib.parse
 from loguru import logger
 
 class JellyseerrClient:
-    def __init__(self, server_url: str, api_key:str=None, email: str=None, password: str=None, user_type: str="local"):
+    # Media statuses for which nothing needs to be requested
+    # (pending, processing, partially available, available)
+    requested_statuses = {2, 3, 4, 5}
+
+    def __init__(self, server_url: str, api_key:str=None, email: str=None, password: str=None, user_type: str="local", cache: JellyseerrCache=None, max_workers: int=4):
         # Fix common url issues
         if server_url.endswith("/"):
             server_url = server_url[:-1]  # Remove trailing slash 
@@ -14,22 +22,25 @@ class JellyseerrClient:
         if user_type not in ["local", "plex", "jellyfin"]:
             raise Exception("Invalid user type. Must be one of: local, plex, jellyfin")
 
+        self.session = http.create_session()
+        # Without a persistent cache, searches are still shared within a run
+        self.cache = cache or JellyseerrCache(":memory:")
+        self.max_workers = max_workers
+
         # Check if server is reachable
         try:
-            r = requests.get(self.server_url + "/status")
+            r = self.session.get(self.server_url + "/status")
             if r.status_code != 200:
                 raise Exception("Jellyseerr Server is not reachable")
         except requests.exceptions.ConnectionError:
             raise Exception("Jellyseerr Server is not reachable")
 
-        self.session = requests.Session()
         self.api_key = api_key
         if api_key is not None:
-            r = self.session.headers.update({
+            # Validated by the /auth/me check below
+            self.session.headers.update({
                 "X-Api-Key": api_key
             })
-            if r.status_code != 200:
-                raise Exception("Invalid jellyseerr API Key")
         if email is not None and password is not None:
             r = self.session.post(f"{self.server_url}/auth/{user_type}", json={
                 "email": email,
@@ -44,42 +55,121 @@ class JellyseerrClient:
             raise Exception("jellyseerr user is not authenticated")
 
 
-    def make_request(self, item):
-        '''Request item from jellyseerr'''
+    def search(self, query: str) -> list:
+        '''Search jellyseerr, reusing recent results for the same query'''
+        results = self.cache.get_search(query)
+        if results is None:
+            r = self.session.get(f"{self.server_url}/search", params={
+                "query": urllib.parse.quote_plus(query)
+            })
+            r.raise_for_status()
+            results = r.json()["results"]
+            self.cache.put_search(query, results)
+        return results
 
-        # Search for item
-        r = self.session.get(f"{self.server_url}/search", params={
-            "query": urllib.parse.quote_plus(item["title"])
-        })
-        
-        # Find matching item
-        mediaId = None
-        for result in r.json()["results"]:
-            # Try IMDB match first
-            if "mediaInfo" in result and "ImdbId" in result["mediaInfo"]:
-                imdb_id = result["mediaInfo"]["ImdbId"]
-                if imdb_id == item["imdb_id"]:
-                    mediaId = result["id"]
+
+    def find_media(self, item):
+        '''Returns the search result matching an item, or None'''
+        for result in self.search(item["title"]):
+            # Try TMDB and IMDB match first
+            media_info = result.get("mediaInfo") or {}
+            if item.get("tmdb_id") and str(result.get("id")) == str(item["tmdb_id"]):
+                logger.debug(f"Found exact TMDB match for {item['title']}")
+                return result
+            if "ImdbId" in media_info:
+                if media_info["ImdbId"] == item.get("imdb_id"):
                     logger.debug(f"Found exact IMDB match for {item['title']}")
-                    break
-            elif "releaseDate" in result:
+                    return result
+            elif "releaseDate" in result or "firstAirDate" in result:
                 # Try year match
-                release_year = result["releaseDate"].split("-")[0]
-                if release_year == str(item["release_year"]).strip():
-                    mediaId = result["id"]
+                release_year = (result.get("releaseDate") or result.get("firstAirDate") or "").split("-")[0]
+                if release_year == str(item.get("release_year", "")).strip():
                     logger.debug(f"Found year match for {item['title']}")
-                    break
-
-        # Request item if not found
-        if mediaId is not None:
-            if "mediaInfo" not in result or result["mediaInfo"]["jellyfinMediaId"] is None:
-                # If it's not already in Jellyfin
-                # Request item
-                r = self.session.post(f"{self.server_url}/request", json={
-                    "mediaType": result["mediaType"],
-                    "mediaId": mediaId,
-                })
-                logger.info(f"Requested {item['title']} from Jellyseerr")
+                    return result
+        return None
+
+
+    def make_request(self, item) -> bool:
+        '''Request item from jellyseerr, unless it is already requested or available. Returns True if a new request was made.'''
+
+        # Skip items we've requested before without searching for them again
+        for provider in ("tmdb", "imdb"):
+            if item.get(f"{provider}_id"):
+                media = self.cache.get_media(provider, item[f"{provider}_id"])
+                if media is not None and self.cache.is_requested(media):
+                    logger.debug(f"{item['title']} has already been requested")
+                    return False
+
+        try:
+            result = self.find_media(item)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Could not search for {item['title']} in Jellyseerr: {e}")
+            return False
+        if result is None:
+            logger.debug(f"{item['title']} not found in Jellyseerr")
+            return False
+
+        media = (result["mediaType"], result["id"])
+        self.cache.put_media("tmdb", result["id"], media)
+        if item.get("imdb_id"):
+            self.cache.put_media("imdb", item["imdb_id"], media)
+        if self.cache.is_requested(media):
+            logger.debug(f"{item['title']} has already been requested")
+            return False
+
+        media_info = result.get("mediaInfo") or {}
+        if media_info.get("jellyfinMediaId") is not None or media_info.get("status") in self.requested_statuses:
+            # Already in Jellyfin or on its way
+            logger.debug(f"{item['title']} is already requested or available in Jellyseerr")
+            self.cache.put_request(media)
+            return False
+
+        # Request item
+        r = self.session.post(f"{self.server_url}/request", json={
+            "mediaType": result["mediaType"],
+            "mediaId": result["id"],
+        })
+        if not r.ok:
+            logger.warning(f"Could not request {item['title']} from Jellyseerr: {r.status_code}")
+            return False
+        self.cache.put_request(media, r.json().get("id"))
+        logger.info(f"Requested {item['title']} from Jellyseerr")
+        return True
+
+
+
+class RequestQueue:
+    '''Requests items from jellyseerr in the background, so missing items are requested while a list
+    is still being scraped and matched. Items are only requested once per queue. Use it as a context
+    manager, so its threads are stopped even if the list fails.'''
+
+    def __init__(self, client: JellyseerrClient):
+        self.client = client
+        self.size = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=client.max_workers)
+        self._futures = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Requests which haven't started yet are dropped if the list failed
+        self._executor.shutdown(wait=True, cancel_futures=exc_type is not None)
+
+    def add(self, item):
+        self.size += 1
+        key = (item["title"], str(item.get("release_year", "")), item.get("imdb_id"), item.get("tmdb_id"))
+        if key not in self._futures:
+            self._futures[key] = self._executor.submit(with_log_context(self._make_request), dict(item))
+
+    def _make_request(self, item) -> bool:
+        with metrics.stage("jellyseerr"):
+            return self.client.make_request(item)
+
+    def wait(self) -> int:
+        '''Waits for all requests to finish. Returns the number of new requests.'''
+        self._executor.shutdown(wait=True)
+        return sum(future.result() for future in self._futures.values())
 
 
 
@@ -0,0 +1,116 @@
+import re
+import bisect
+import unicodedata
+
+
+def normalize_title(title) -> str:
+    '''Normalize a title for lookups - strips accents, case, punctuation and extra whitespace'''
+    title = unicodedata.normalize('NFKD', str(title))
+    title = "".join(c for c in title if not unicodedata.combining(c))
+    title = re.sub(r"[^\w]+", " ", title.casefold())
+    return " ".join(title.split())
+
+
+class LibraryIndex:
+    '''In-memory index of Jellyfin library items by IMDb id and normalized title.
+
+    Title lookups return the same candidates as a Jellyfin searchTerm search: every item whose name or
+    original title contains the title, with exact matches first, then names starting with the title,
+    then the rest. Titles are found through an index of their words, so the library isn't scanned.'''
+
+    def __init__(self):
+        self.by_imdb = {}
+        self.by_title = {}
+        self.by_word = {}
+        self.size = 0
+        self._positions = {}
+        self._words = None
+        self._words_containing = {}
+
+    def add(self, jf_item: dict):
+        '''Add a Jellyfin item (with ProviderIds and ProductionYear fields) to the index'''
+        provider_ids = jf_item.get("ProviderIds") or {}
+        if provider_ids.get("Imdb"):
+            self.by_imdb.setdefault(provider_ids["Imdb"], []).append(jf_item)
+
+        for title in self._titles(jf_item):
+            if title not in self.by_title:
+                for word in title.split():
+                    self.by_word.setdefault(word, set()).add(title)
+            self.by_title.setdefault(title, []).append(jf_item)
+        self._positions.setdefault(jf_item["Id"], self.size)
+        self.size += 1
+        self._words = None
+        self._words_containing = {}
+
+    @staticmethod
+    def _titles(jf_item: dict) -> set:
+        titles = {normalize_title(jf_item.get("Name", ""))}
+        if jf_item.get("OriginalTitle"):
+            titles.add(normalize_title(jf_item["OriginalTitle"]))
+        return titles
+
+    @staticmethod
+    def _title_matches(title: str, search: str) -> bool:
+        # Jellyfin only searches within names for terms longer than one character
+        return title.startswith(search) if len(search) == 1 else search in title
+
+    def _titles_containing(self, search: str) -> set:
+        '''Indexed titles which could contain search - a superset, found through the words of search'''
+        words = search.split()
+        if len(words) > 2:
+            # Words in the middle have to be whole words of the title
+            return self.by_word.get(max(words[1:-1], key=len), set())
+        if self._words is None:
+            self._words = sorted(self.by_word)
+        if len(words) == 2:
+            # The last word has to start a word of the title
+            start = bisect.bisect_left(self._words, words[1])
+            matching_words = []
+            for word in self._words[start:]:
+                if not word.startswith(words[1]):
+                    break
+                matching_words.append(word)
+        else:
+            # A single word can be anywhere in a word of the title
+            if words[0] not in self._words_containing:
+                self._words_containing[words[0]] = [word for word in self._words if words[0] in word]
+            matching_words = self._words_containing[words[0]]
+        return set().union(*(self.by_word[word] for word in matching_words))
+
+    def search(self, title) -> list:
+        '''Returns the indexed items which a searchTerm search for title finds, in the same order'''
+        search = normalize_title(title)
+        if not search:
+            return []
+        found = {}
+        for indexed_title in self._titles_containing(search):
+            if not self._title_matches(indexed_title, search):
+                continue
+            score = 3 if indexed_title == search else 2 if indexed_title.startswith(search) else 1
+            for jf_item in self.by_title[indexed_title]:
+                found[jf_item["Id"]] = max(score, found.get(jf_item["Id"], (0, None))[0]), jf_item
+        # Best matches first, otherwise in library order
+        return [jf_item for _, jf_item in sorted(found.values(), key=lambda match: (-match[0], self._positions[match[1]["Id"]]))]
+
+    def candidates(self, item: dict, media_types) -> list:
+        '''Returns the indexed items which could match a list item, in a stable order'''
+        if item.get("imdb_id"):
+            # Only an item with the IMDb id can match - a search would find it if its title contains the item's
+            search = normalize_title(item["title"])
+            found = [
+                jf_item for jf_item in self.by_imdb.get(item["imdb_id"], [])
+                if search and any(self._title_matches(title, search) for title in self._titles(jf_item))
+            ]
+        else:
+            found = self.search(item["title"])
+
+        wanted = {t.lower() for t in media_types}
+        seen = set()
+        results = []
+        for jf_item in found:
+            if jf_item["Id"] in seen or jf_item.get("Type", "").lower() not in wanted:
+                continue
+            seen.add(jf_item["Id"])
+            results.append(jf_item)
+        return results
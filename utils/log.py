@@ -0,0 +1,66 @@
+import threading
+import contextvars
+
+LOG_FORMAT = "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - "
+
+
+def log_format(record):
+    '''Loguru format which prefixes messages logged while processing a list with the list tag'''
+    if record["extra"].get("list_tag"):
+        return LOG_FORMAT + "[{extra[list_tag]}] <level>{message}</level>\n{exception}"
+    return LOG_FORMAT + "<level>{message}</level>\n{exception}"
+
+
+def with_log_context(fn):
+    '''Wraps fn so it keeps the caller's log context (e.g. the list tag) when run on another thread'''
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+class OrderedLogSink:
+    '''Loguru sink which keeps the output of lists processed in parallel together, in list order.
+
+    Messages of the first unfinished list are written straight away, messages of the other
+    lists are held back until every list before them has finished.'''
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+        self._order = []
+        self._buffers = {}
+        self._finished = set()
+
+    def isatty(self):
+        return hasattr(self.stream, "isatty") and self.stream.isatty()
+
+    def start(self, list_tags: list):
+        '''Begin holding back output for the given lists, in the order they should be written'''
+        with self._lock:
+            self._order = list(list_tags)
+            self._buffers = {tag: [] for tag in list_tags}
+            self._finished = set()
+
+    def finish(self, list_tag: str):
+        '''Mark a list as finished, flushing any lists which are now at the front'''
+        with self._lock:
+            self._finished.add(list_tag)
+            while self._order and self._order[0] in self._finished:
+                self._order.pop(0)
+                if self._order:
+                    self._flush(self._order[0])
+
+    def _flush(self, list_tag: str):
+        for message in self._buffers.pop(list_tag, []):
+            self.stream.write(message)
+        self.stream.flush()
+
+    def write(self, message):
+        list_tag = message.record["extra"].get("list_tag")
+        with self._lock:
+            if list_tag in self._buffers and self._order and list_tag != self._order[0]:
+                self._buffers[list_tag].append(message)
+            else:
+                self.stream.write(message)
+
+    def flush(self):
+        self.stream.flush()
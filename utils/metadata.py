@@ -0,0 +1,44 @@
+'''Title metadata shared by all plugins, so a film is only looked up once across lists and runs.
+
+Titles are stored by the site they were found on and their id there, e.g. ("letterboxd", "/film/alien/")
+or ("imdb", "tt0078748"). Items with an IMDb id and release year which any plugin returns are stored
+as ("imdb", imdb_id) as well, but only fill in what the IMDb title page didn't provide - other plugins
+use their own titles and types.'''
+from .cache import MetadataStore
+
+# In memory only, unless main sets a persistent store
+_store = MetadataStore(":memory:")
+
+
+def set_store(store: MetadataStore):
+    global _store
+    _store = store
+
+
+def get(source: str, source_id: str, authoritative: bool = False):
+    '''Returns {"title", "release_year", "media_type", "imdb_id"} of a title, or None if it isn't known (or is too old).
+    With authoritative, only details which were looked up on the source site itself are returned.'''
+    return _store.get(source, source_id, authoritative)
+
+
+def put(source: str, source_id: str, title: dict):
+    _store.put(source, source_id, title)
+
+
+def resolve(source: str, source_id: str, fetch, authoritative: bool = True):
+    '''Returns the stored details of a title, or fetches them with fetch() and stores them. Nothing is stored if fetch() returns None.
+    Without authoritative, details which other plugins contributed are good enough too.'''
+    title = _store.get(source, source_id, authoritative)
+    if title is None:
+        title = fetch()
+        if title is not None:
+            _store.put(source, source_id, title)
+    return title
+
+
+def add_items(items: list):
+    '''Stores the details of list items with an IMDb id, title and release year by their IMDb id'''
+    _store.add_many([
+        ("imdb", item["imdb_id"], item) for item in items
+        if item.get("imdb_id") and item.get("title") and item.get("release_year") and isinstance(item.get("media_type"), str)
+    ])
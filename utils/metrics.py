@@ -0,0 +1,219 @@
+import time
+import threading
+import contextvars
+import urllib.parse
+import http.server
+from contextlib import contextmanager
+
+# (list metrics, stage name) of the list being processed - see RunMetrics.list_context()
+_current = contextvars.ContextVar("metrics_current", default=None)
+
+PROMETHEUS_PREFIX = "jellyfin_auto_playlists"
+
+
+class ListMetrics:
+    '''Wall time, HTTP traffic and counters of a single list run, per stage'''
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def _stage(self, stage: str) -> dict:
+        return self.stages.setdefault(stage, {"seconds": 0.0, "requests": {}})
+
+    def add_time(self, stage: str, seconds: float):
+        with self._lock:
+            self._stage(stage)["seconds"] += seconds
+
+    def add_request(self, stage: str, host: str, size: int):
+        with self._lock:
+            requests = self._stage(stage)["requests"].setdefault(host, {"count": 0, "bytes": 0})
+            requests["count"] += 1
+            requests["bytes"] += size
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self) -> dict:
+        with self._lock:
+            hosts = {}
+            for stage in self.stages.values():
+                for host, requests in stage["requests"].items():
+                    total = hosts.setdefault(host, {"count": 0, "bytes": 0})
+                    total["count"] += requests["count"]
+                    total["bytes"] += requests["bytes"]
+            return {
+                "seconds": round(self.seconds, 3),
+                "stages": {
+                    name: {"seconds": round(stage["seconds"], 3), "requests": dict(stage["requests"])}
+                    for name, stage in self.stages.items()
+                },
+                "requests": hosts,
+                "counters": dict(self.counters),
+                "cache_hit_rates": _hit_rates(self.counters),
+            }
+
+
+def _hit_rates(counters: dict) -> dict:
+    '''Hit rate of every cache with "<cache>_hits" and "<cache>_misses" counters'''
+    rates = {}
+    for name, hits in counters.items():
+        if name.endswith("_hits"):
+            cache = name[:-len("_hits")]
+            total = hits + counters.get(cache + "_misses", 0)
+            if total:
+                rates[cache] = round(hits / total, 3)
+    return rates
+
+
+class RunMetrics:
+    '''Metrics of all lists processed in a run'''
+
+    def __init__(self):
+        self.started = time.time()
+        self._start = time.monotonic()
+        self.seconds = None
+        self.lists = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def list_context(self, name: str):
+        '''Attribute everything in this context (and threads started with utils.log.with_log_context) to a list'''
+        with self._lock:
+            list_metrics = self.lists.setdefault(name, ListMetrics(name))
+        token = _current.set((list_metrics, None))
+        start = time.monotonic()
+        try:
+            yield list_metrics
+        finally:
+            with list_metrics._lock:
+                list_metrics.seconds += time.monotonic() - start
+            _current.reset(token)
+
+    def finish(self):
+        self.seconds = time.monotonic() - self._start
+
+    def summary(self) -> dict:
+        with self._lock:
+            lists = list(self.lists.values())
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "seconds": round(self.seconds if self.seconds is not None else time.monotonic() - self._start, 3),
+            "lists": {list_metrics.name: list_metrics.summary() for list_metrics in lists},
+        }
+
+    def to_prometheus(self) -> str:
+        '''The run's metrics in the Prometheus text exposition format'''
+        summary = self.summary()
+        lines = [
+            f"# TYPE {PROMETHEUS_PREFIX}_run_seconds gauge",
+            f"{PROMETHEUS_PREFIX}_run_seconds {summary['seconds']}",
+            f"# TYPE {PROMETHEUS_PREFIX}_run_started_timestamp_seconds gauge",
+            f"{PROMETHEUS_PREFIX}_run_started_timestamp_seconds {self.started:.0f}",
+        ]
+        stage_seconds, requests, request_bytes, counters = [], [], [], []
+        for name, list_summary in summary["lists"].items():
+            for stage, stage_summary in list_summary["stages"].items():
+                stage_seconds.append(f'{PROMETHEUS_PREFIX}_stage_seconds{{list="{_escape(name)}",stage="{stage}"}} {stage_summary["seconds"]}')
+                for host, host_requests in stage_summary["requests"].items():
+                    labels = f'list="{_escape(name)}",stage="{stage}",host="{_escape(host)}"'
+                    requests.append(f'{PROMETHEUS_PREFIX}_http_requests{{{labels}}} {host_requests["count"]}')
+                    request_bytes.append(f'{PROMETHEUS_PREFIX}_http_response_bytes{{{labels}}} {host_requests["bytes"]}')
+            for counter, value in list_summary["counters"].items():
+                counters.append(f'{PROMETHEUS_PREFIX}_list_events{{list="{_escape(name)}",event="{counter}"}} {value}')
+        for metric, samples in (("stage_seconds", stage_seconds), ("http_requests", requests), ("http_response_bytes", request_bytes), ("list_events", counters)):
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{metric} gauge")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+@contextmanager
+def stage(name: str):
+    '''Attribute the time and requests in this context to a stage of the current list'''
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    token = _current.set((current[0], name))
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        current[0].add_time(name, time.monotonic() - start)
+        _current.reset(token)
+
+
+def timed_iter(iterable, name: str):
+    '''Yields the items of iterable, attributing the time spent fetching them to a stage'''
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def count(name: str, n: int = 1):
+    '''Add to a counter of the current list, e.g. count("match_cache_hits")'''
+    current = _current.get()
+    if current is not None:
+        current[0].count(name, n)
+
+
+def record_request(url: str, size: int):
+    '''Count a request to url with a response of size bytes towards the current list and stage'''
+    current = _current.get()
+    if current is None:
+        return
+    list_metrics, stage_name = current
+    host = (urllib.parse.urlsplit(url).hostname or "").lower()
+    list_metrics.add_request(stage_name or "other", host, size)
+
+
+def record_response(response, *args, **kwargs):
+    '''requests response hook which counts the response towards the current list and stage'''
+    if _current.get() is None:
+        return
+    if kwargs.get("stream"):
+        size = int(response.headers.get("Content-Length") or 0)
+    else:
+        size = len(response.content)
+    record_request(response.url, size)
+
+
+class _PrometheusHandler(http.server.BaseHTTPRequestHandler):
+    run_metrics = None
+
+    def do_GET(self):
+        run_metrics = type(self).run_metrics
+        body = (run_metrics.to_prometheus() if run_metrics is not None else "").encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_prometheus(port: int, host: str = "0.0.0.0"):
+    '''Serve the metrics of the latest run (see publish()) in Prometheus format on a background thread'''
+    server = http.server.ThreadingHTTPServer((host, int(port)), _PrometheusHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def publish(run_metrics: RunMetrics):
+    '''Make a run's metrics the ones served to Prometheus'''
+    _PrometheusHandler.run_metrics = run_metrics
@@ -0,0 +1,56 @@
+import re
+import json
+import bs4
+
+# lxml builds trees several times faster than Python's html.parser, but is optional
+try:
+    import lxml.html
+    PARSER = "lxml"
+except ImportError:
+    lxml = None
+    PARSER = "html.parser"
+
+_SCRIPT = re.compile(r"<script\b([^>]*)>(.*?)</script\s*>", re.S | re.I)
+_ATTRIBUTE = re.compile(r"""([\w:-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""")
+
+
+def only(*tags) -> bs4.SoupStrainer:
+    '''SoupStrainer which only keeps the given tags (and everything inside them). Each tag is a name, or a
+    (name, class) pair - the name can be None for any tag, and a class with spaces needs all of its classes'''
+    wanted = [(tag, None) if isinstance(tag, str) else (tag[0], tag[1].split()) for tag in tags]
+
+    def match(name, attrs):
+        classes = attrs.get("class") or []
+        if isinstance(classes, str):
+            classes = classes.split()
+        return any(tag_name in (None, name) and (tag_classes is None or all(c in classes for c in tag_classes)) for tag_name, tag_classes in wanted)
+    return bs4.SoupStrainer(match)
+
+
+def parse(markup: str, *tags) -> bs4.BeautifulSoup:
+    '''BeautifulSoup tree of markup, built with the fastest available parser.
+    If tags are given, only those are kept (see only()), which saves most of the time and memory on big pages.'''
+    return bs4.BeautifulSoup(markup, PARSER, parse_only=only(*tags) if tags else None)
+
+
+def find_script(markup: str, id: str = None, type: str = None):
+    '''Contents of the first <script> with the given id and/or type, found without parsing the page. None if there is none'''
+    for script in _SCRIPT.finditer(markup):
+        attrs = {m[1].lower(): next(v for v in m.groups()[1:] if v is not None) for m in _ATTRIBUTE.finditer(script[1])}
+        if (id is None or attrs.get("id") == id) and (type is None or attrs.get("type", "").lower() == type.lower()):
+            return script[2]
+    return None
+
+
+def script_json(markup: str, id: str = None, type: str = None):
+    '''Decoded JSON of the first <script> with the given id and/or type, or None if there is none'''
+    script = find_script(markup, id=id, type=type)
+    return json.loads(script) if script is not None else None
+
+
+def table_rows(markup: str) -> list:
+    '''Text of the <td> cells of every <tr> on the page. With lxml this skips building a BeautifulSoup tree, which is
+    by far the slowest part of reading big tables'''
+    if lxml is not None:
+        return [[td.text_content() for td in tr.iter('td')] for tr in lxml.html.fromstring(markup).iter('tr')]
+    return [[td.text for td in tr.find_all('td')] for tr in parse(markup, 'tr').find_all('tr')]
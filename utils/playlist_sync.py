@@ -0,0 +1,134 @@
+from bisect import bisect_left, insort
+from collections import Counter
+from loguru import logger
+
+
+def plan_playlist_changes(current_entries: list, item_ids_in_order: list):
+    '''Works out which playlist entries to remove and which items to add.
+
+    current_entries is a list of (entry_id, item_id) in playlist order. Returns the entry ids to remove
+    and the item ids to append, so that the playlist holds exactly the wanted items (in any order).'''
+    wanted = Counter(item_ids_in_order)
+    kept = Counter()
+    to_remove = []
+    for entry_id, item_id in current_entries:
+        if kept[item_id] < wanted[item_id]:
+            kept[item_id] += 1
+        else:
+            to_remove.append(entry_id)
+
+    to_add = []
+    for item_id in item_ids_in_order:
+        if kept[item_id] > 0:
+            kept[item_id] -= 1
+        else:
+            to_add.append(item_id)
+    return to_remove, to_add
+
+
+def _longest_increasing_subsequence(values: list) -> set:
+    '''Returns the indices of a longest strictly increasing subsequence of values'''
+    tails = []
+    tail_indices = []
+    previous = [None] * len(values)
+    for i, value in enumerate(values):
+        pos = bisect_left(tails, value)
+        if pos > 0:
+            previous[i] = tail_indices[pos - 1]
+        if pos == len(tails):
+            tails.append(value)
+            tail_indices.append(i)
+        else:
+            tails[pos] = value
+            tail_indices[pos] = i
+
+    result = set()
+    i = tail_indices[-1] if tail_indices else None
+    while i is not None:
+        result.add(i)
+        i = previous[i]
+    return result
+
+
+def plan_playlist_moves(current_entries: list, item_ids_in_order: list) -> list:
+    '''Works out the moves needed to put the playlist entries in the wanted order.
+
+    current_entries must hold exactly the wanted items. Returns a list of (entry_id, new_index) to apply
+    in order, using Jellyfin's move semantics (remove the entry, then insert it at new_index).
+    Entries on a longest already-ordered run are left in place, so the number of moves is minimal.'''
+    # Target position of every entry - duplicates keep their relative order
+    positions = {}
+    for position, item_id in enumerate(item_ids_in_order):
+        positions.setdefault(item_id, []).append(position)
+    seen = Counter()
+    targets = []
+    for _, item_id in current_entries:
+        targets.append(positions[item_id][seen[item_id]])
+        seen[item_id] += 1
+
+    in_place = _longest_increasing_subsequence(targets)
+    settled = sorted(targets[i] for i in in_place)
+    order = list(targets)  # Simulated playlist, as target positions
+    entry_ids = {target: current_entries[i][0] for i, target in enumerate(targets)}
+
+    moves = []
+    for target in sorted(targets[i] for i in range(len(targets)) if i not in in_place):
+        old_index = order.index(target)
+        order.pop(old_index)
+
+        # Place the entry directly after the closest settled entry that comes before it
+        pos = bisect_left(settled, target)
+        new_index = order.index(settled[pos - 1]) + 1 if pos > 0 else 0
+        order.insert(new_index, target)
+        insort(settled, target)
+
+        if new_index != old_index:
+            moves.append((entry_ids[target], new_index))
+    return moves
+
+
+def sync_steps(playlist_id: str, item_ids_in_order: list):
+    '''The requests which sync a playlist with the given items in order, shared by the sync and async Jellyfin clients.
+
+    A generator which yields a request and is sent its result:
+        ("entries",)               -> the playlist's (entry id, item id), in playlist order
+        ("remove", entry_ids)      -> the number of entries removed
+        ("add", item_ids)          -> whether all items were appended
+        ("move", entry_id, index)  -> whether the entry was moved
+    It returns whether the playlist now holds exactly the given items, in order.'''
+    entries = yield ("entries",)
+    to_remove, to_add = plan_playlist_changes(entries, item_ids_in_order)
+
+    if to_remove:
+        logger.info(f"Removing {len(to_remove)} items from playlist {playlist_id}")
+        if (yield ("remove", to_remove)) != len(to_remove):
+            logger.warning(f"Not all items were removed from playlist {playlist_id} - skipping reorder")
+            return False
+    if to_add:
+        logger.info(f"Adding {len(to_add)} items to playlist {playlist_id}")
+        if not (yield ("add", to_add)):
+            logger.warning(f"Not all items were added to playlist {playlist_id} - skipping reorder")
+            return False
+        # New entries get their ids from the server
+        entries = yield ("entries",)
+    else:
+        removed = set(to_remove)
+        entries = [entry for entry in entries if entry[0] not in removed]
+
+    if sorted(item_id for _, item_id in entries) != sorted(item_ids_in_order):
+        logger.warning(f"Playlist {playlist_id} does not hold the expected items after syncing - skipping reorder")
+        return False
+
+    # Every move depends on the ones before it, so they are made one at a time
+    moves = plan_playlist_moves(entries, item_ids_in_order)
+    if moves:
+        logger.info(f"Moving {len(moves)} items in playlist {playlist_id}")
+    for entry_id, new_index in moves:
+        if not (yield ("move", entry_id, new_index)):
+            return False
+
+    if not to_remove and not to_add and not moves:
+        logger.info(f"Playlist {playlist_id} is already up to date")
+    else:
+        logger.info(f"Synced playlist {playlist_id} ({len(item_ids_in_order)} items)")
+    return True
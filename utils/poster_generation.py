@@ -1,8 +1,9 @@
 import os
-import requests
+from . import http
 from loguru import logger
-from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageOps
+from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageFilter, ImageOps
 import math
+import functools
 from io import BytesIO
 import concurrent.futures
 from pyaml_env import parse_config
@@ -14,6 +15,7 @@ LINE_SPACING = 25
 SHADOW_SIZE = 8
 BACKGROUND_COLOR = (0, 0, 0)
 OVERLAY_PADDING = 50
+BLUR_SCALE = 4   # The background is built and blurred at 1/BLUR_SCALE of the canvas size
 
 def get_font(url, font_dir="./fonts"):
     '''Download ttf from google font css'''
@@ -31,12 +33,12 @@ def get_font(url, font_dir="./fonts"):
         os.mkdir(font_dir)
 
     # Download css
-    r = requests.get(url)
+    r = http.get(url)
     r.raise_for_status()
     font_url = r.text.split("url(")[1].split(")")[0]
 
     # Download font
-    r = requests.get(font_url)
+    r = http.get(font_url)
     with open(font_path, 'wb') as f:
         f.write(r.content)
     r.raise_for_status()
@@ -52,7 +54,7 @@ def fetch_collection_posters(jellyfin_url, api_key, user_id, collection_id):
     headers = {'X-Emby-Token': api_key}
     url = f"{jellyfin_url}/Users/{user_id}/Items"
     params = {'parentId': collection_id}
-    response = requests.get(url, headers=headers, params=params)
+    response = http.get(url, headers=headers, params=params)
     response.raise_for_status()
     items = response.json().get('Items', [])
     poster_urls = []
@@ -63,24 +65,37 @@ def fetch_collection_posters(jellyfin_url, api_key, user_id, collection_id):
     logger.info(f"Found {len(poster_urls)} poster(s) for collection ID {collection_id}.")
     return poster_urls
 
-def safe_download(url, headers):
+def safe_download(url, headers, size=None):
     """
     Download an image safely; return None if an error occurs.
     """
     try:
-        return download_image(url, headers)
+        return download_image(url, headers, size)
     except Exception as e:
         logger.error(f"Error downloading image {url}: {e}")
         return None
 
-def download_image(url, headers):
+def download_image(url, headers, size=None):
     """
     Downloads an image from a URL and returns a Pillow Image object.
+    If a size is given, JPEGs are scaled down while decoding to at least that size.
     """
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    image = Image.open(BytesIO(response.content)).convert("RGB")
-    return image
+    with http.get(url, headers=headers, stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        image = Image.open(response.raw)
+        if size is not None:
+            image.draft("RGB", size)
+        return image.convert("RGB")
+
+
+def resized_image_url(url, size, quality=90):
+    """
+    Asks jellyfin to scale and crop an image to the given size before sending it.
+    """
+    width, height = size
+    separator = "&" if "?" in url else "?"
+    return f"{url}{separator}fillWidth={width}&fillHeight={height}&quality={quality}"
 
 
 # --- Text and Font Functions ---
@@ -107,47 +122,85 @@ def wrap_text(text, font, draw, max_width):
     return lines
 
 
+@functools.lru_cache(maxsize=64)
+def load_font(font_file, font_size):
+    """
+    Loads a font, reusing fonts which were loaded before.
+    """
+    return ImageFont.truetype(font_file, font_size)
+
+
 def get_adjusted_font_and_wrapped_text(text, draw, max_width, max_height, font_file, max_font_size=200, min_font_size=20):
     """
     Determines a font size that allows the text to be wrapped within max_width and max_height.
     Returns the chosen font, the wrapped lines, and the total text block height.
     """
-    for font_size in range(max_font_size, min_font_size - 1, -1):
-        font = ImageFont.truetype(font_file, font_size)
+    def layout(font_size):
+        font = load_font(font_file, font_size)
         lines = wrap_text(text, font, draw, max_width)
         ascent, descent = font.getmetrics()
         line_height = ascent + descent
         total_height = line_height * len(lines) + LINE_SPACING * (len(lines) - 1)
         # Check if the text block fits within the limits
-        max_line_width = max(draw.textbbox((0, 0), line, font=font)[2] - draw.textbbox((0, 0), line, font=font)[0] for line in lines)
-        if max_line_width <= max_width and total_height <= max_height:
-            return font, lines, total_height
+        max_line_width = max(right - left for left, _, right, _ in (draw.textbbox((0, 0), line, font=font) for line in lines))
+        return font, lines, total_height, max_line_width <= max_width and total_height <= max_height
+
+    # Binary search for the largest font size at which the text block fits
+    best = None
+    low, high = min_font_size, max_font_size
+    while low <= high:
+        font_size = (low + high) // 2
+        font, lines, total_height, fits = layout(font_size)
+        if fits:
+            best = font, lines, total_height
+            low = font_size + 1
+        else:
+            high = font_size - 1
+    if best is not None:
+        return best
+
     # Fall back to minimum font size
-    font = ImageFont.truetype(font_file, min_font_size)
-    lines = wrap_text(text, font, draw, max_width)
-    ascent, descent = font.getmetrics()
-    line_height = ascent + descent
-    total_height = line_height * len(lines) + LINE_SPACING * (len(lines) - 1)
+    font, lines, total_height, _ = layout(min_font_size)
     logger.info("Using minimum font size.")
     return font, lines, total_height
 
 
-def draw_text_with_shadow(draw, text, position, font, shadow_size, text_color="white", shadow_color="black"):
+def dilate(mask, radius):
+    """
+    Grows every pixel of a mask into a (2 * radius + 1) square, the same as MaxFilter(2 * radius + 1).
+    Works one axis at a time by combining shifted copies, doubling the covered width each step.
+    """
+    def shift(image, dx, dy):
+        shifted = Image.new(image.mode, image.size, 0)
+        shifted.paste(image, (dx, dy))
+        return shifted
+
+    for dx, dy in ((1, 0), (0, 1)):
+        mask = shift(mask, -radius * dx, -radius * dy)
+        covered = 1
+        while covered < radius * 2 + 1:
+            step = min(covered, radius * 2 + 1 - covered)
+            mask = ImageChops.lighter(mask, shift(mask, step * dx, step * dy))
+            covered += step
+    return mask
+
+
+def draw_text_with_shadow(image, text, position, font, shadow_size, text_color="white", shadow_color="black"):
     """
     Draw text with a shadow effect at the specified position.
+    The shadow is the text mask grown by shadow_size pixels in every direction.
     """
     x, y = position
-    # Draw shadow offsets
-    for dx in range(-shadow_size, shadow_size + 1):
-        for dy in range(-shadow_size, shadow_size + 1):
-            if dx == 0 and dy == 0:
-                continue
-            draw.text((x + dx, y + dy), text, font=font, fill=shadow_color)
-    # Draw main text
-    draw.text((x, y), text, font=font, fill=text_color)
+    _, _, right, bottom = font.getbbox(text)
+    mask = Image.new("L", (right + shadow_size * 2, bottom + shadow_size * 2), 0)
+    ImageDraw.Draw(mask).text((shadow_size, shadow_size), text, font=font, fill=255)
+    shadow = dilate(mask, shadow_size)
+    # Draw shadow, then main text
+    image.paste(shadow_color, (x - shadow_size, y - shadow_size), shadow)
+    image.paste(text_color, (x - shadow_size, y - shadow_size), mask)
 
 
-def draw_text_block(draw, lines, font, total_text_height, overlay_y, overlay_height):
+def draw_text_block(image, draw, lines, font, total_text_height, overlay_y, overlay_height):
     """
     Draw the text block centered within the overlay area.
     """
@@ -159,42 +212,67 @@ def draw_text_block(draw, lines, font, total_text_height, overlay_y, overlay_hei
         bbox = draw.textbbox((0, 0), line, font=font)
         line_width = bbox[2] - bbox[0]
         text_x = (CANVAS_WIDTH - line_width) // 2
-        draw_text_with_shadow(draw, line, (text_x, current_y), font, SHADOW_SIZE)
+        draw_text_with_shadow(image, line, (text_x, current_y), font, SHADOW_SIZE)
         current_y += line_height + LINE_SPACING
 
 
 # --- Mosaic Creation Functions ---
 
+def mosaic_cell_size(num_posters):
+    """
+    Size of a single poster in the (reduced size) mosaic background.
+    """
+    grid_cols = math.ceil(math.sqrt(num_posters))
+    grid_rows = math.ceil(num_posters / grid_cols)
+    return math.ceil(CANVAS_WIDTH // BLUR_SCALE / grid_cols), math.ceil(CANVAS_HEIGHT // BLUR_SCALE / grid_rows)
+
+
+def fit_poster(image, size):
+    """
+    Scale and crop a poster so it covers a mosaic cell of the given size.
+    """
+    if image.size == tuple(size):
+        return image
+    # Cheaply shrink large posters close to the cell size first
+    reduce_factor = min(image.width // size[0], image.height // size[1]) // 2
+    if reduce_factor > 1:
+        image = image.reduce(reduce_factor)
+    return ImageOps.fit(image, size, method=Image.Resampling.BILINEAR)
+
+
 def create_mosaic_background(poster_images):
     """
     Create the mosaic background from poster images.
     Returns a blurred canvas with the images pasted in a grid that fills the entire canvas.
     Some parts of the posters may be cut off to ensure a complete fill.
+    The mosaic is built and blurred at reduced resolution - the blur hides the difference.
     """
-    canvas = Image.new('RGB', (CANVAS_WIDTH, CANVAS_HEIGHT), BACKGROUND_COLOR)
     num_posters = len(poster_images)
     if num_posters == 0:
         raise ValueError("No poster images available!")
 
-    # Determine the grid dimensions (number of columns and rows)
+    width = CANVAS_WIDTH // BLUR_SCALE
+    height = CANVAS_HEIGHT // BLUR_SCALE
+    canvas = Image.new('RGB', (width, height), BACKGROUND_COLOR)
+
+    # Determine the number of grid columns
     grid_cols = math.ceil(math.sqrt(num_posters))
-    grid_rows = math.ceil(num_posters / grid_cols)
 
     # Calculate cell size so that the entire canvas area is used.
-    cell_width = CANVAS_WIDTH // grid_cols
-    cell_height = CANVAS_HEIGHT // grid_rows
+    cell_width, cell_height = mosaic_cell_size(num_posters)
 
     # Place each poster image into its respective cell.
     # ImageOps.fit will scale and crop the image as necessary to cover the entire cell.
     for idx, img in enumerate(poster_images):
-        fitted_img = ImageOps.fit(img, (cell_width, cell_height), method=Image.Resampling.LANCZOS)
+        fitted_img = fit_poster(img, (cell_width, cell_height))
         col = idx % grid_cols
         row = idx // grid_cols
         x = col * cell_width   # No horizontal offset
         y = row * cell_height  # No vertical offset
         canvas.paste(fitted_img, (x, y))
 
-    return canvas.filter(ImageFilter.GaussianBlur(radius=10))
+    blurred = canvas.filter(ImageFilter.GaussianBlur(radius=10 / BLUR_SCALE))
+    return blurred.resize((CANVAS_WIDTH, CANVAS_HEIGHT), Image.Resampling.BICUBIC)
 
 
 def apply_text_overlay(image, collection_name, font_file):
@@ -227,15 +305,31 @@ def apply_text_overlay(image, collection_name, font_file):
 
     # Draw text on top of the overlay
     draw = ImageDraw.Draw(image)
-    draw_text_block(draw, lines, font, total_text_height, overlay_y, overlay_height)
+    draw_text_block(image, draw, lines, font, total_text_height, overlay_y, overlay_height)
 
 
-def create_mosaic(poster_images, collection_name, output_path, font_path):
+def render_mosaic(poster_images, collection_name, font_path):
     """
-    Creates the complete mosaic cover by combining the background and text overlay.
+    Renders the complete mosaic cover by combining the background and text overlay.
     """
     logger.debug("Starting mosaic creation...")
     blurred = create_mosaic_background(poster_images)
     apply_text_overlay(blurred, collection_name, font_path)
-    blurred.save(output_path)
+    return blurred
+
+
+def encode_jpeg(image, quality=90):
+    """
+    Encodes an image as JPEG in memory.
+    """
+    buffer = BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def create_mosaic(poster_images, collection_name, output_path, font_path):
+    """
+    Creates the complete mosaic cover and saves it to output_path.
+    """
+    render_mosaic(poster_images, collection_name, font_path).save(output_path)
     logger.debug(f"Cover art saved to {output_path}")